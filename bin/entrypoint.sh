@@ -15,13 +15,18 @@ if [[ $DEPLOYMENT_PLATFORM == "heroku" ]]; then
         snake_eyes stripe sync
 
         gunicorn --config "python:config.gunicorn" "snake_eyes.app:create_app()"
+    elif [[ $APP_TYPE == "beat" ]]; then
+        celery beat --app snake_eyes.app:celery --loglevel info
     else
-        celery worker --beat --app snake_eyes.blueprints.contact.tasks --loglevel info
+        # WORKER_QUEUES picks the queues of this dyno, all of them by default
+        exec snake_eyes worker $WORKER_QUEUES
     fi
 elif [[ $DEPLOYMENT_PLATFORM == "local" ]]; then
     if [[ $APP_TYPE == "web" ]]; then
         gunicorn --config "python:config.gunicorn" "snake_eyes.app:create_app()"
+    elif [[ $APP_TYPE == "beat" ]]; then
+        celery beat --app snake_eyes.app:celery --loglevel info
     else
-        celery worker --beat --app snake_eyes.blueprints.contact.tasks --loglevel info
+        exec snake_eyes worker $WORKER_QUEUES
     fi
 fi
@@ -0,0 +1,330 @@
+import json
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from os import environ
+from os import path
+from statistics import median
+from time import perf_counter
+
+import requests
+
+from click import UsageError
+from click import command
+from click import echo
+from click import group
+from click import option
+from sqlalchemy import text
+
+from lib.src.util_email import EmailClient
+from snake_eyes.app import create_app
+from snake_eyes.blueprints.user.models import User
+from snake_eyes.extensions import db
+
+
+app = create_app()
+db.app = app
+
+BENCH_EMAIL_DOMAIN = "bench.local"
+# Environments the benchmarks may write synthetic rows into
+BENCH_ENVIRONMENTS = ("development", "test")
+
+# Boots the worker's Celery app in a fresh interpreter and reports how long
+# it took, the peak RSS and how many Flask apps were built along the way.
+# Trees from before the shared Celery app started the worker from the
+# contact tasks, whose app includes every other tasks module.
+CELERY_BOOT_SCRIPT = """
+import json
+import resource
+import time
+
+start = time.perf_counter()
+
+import flask
+
+flask_apps = []
+flask_init = flask.Flask.__init__
+
+
+def counting_init(self, *args, **kwargs):
+    flask_apps.append(self)
+    flask_init(self, *args, **kwargs)
+
+
+flask.Flask.__init__ = counting_init
+
+try:
+    from snake_eyes.app import celery
+except ImportError:
+    from snake_eyes.blueprints.contact.tasks import celery
+
+celery.loader.import_default_modules()
+
+print(json.dumps({
+    "seconds": time.perf_counter() - start,
+    "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "flask_apps": len(flask_apps),
+    "tasks": len([name for name in celery.tasks if not name.startswith("celery.")]),
+}))
+"""
+
+
+class EmailServiceStub(BaseHTTPRequestHandler):
+    """
+    Stand-in for the e-mail service which accepts every message after a
+    fixed latency and counts the messages it received.
+    """
+
+    latency = 0.005
+    received = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        time.sleep(self.latency)
+
+        with self.lock:
+            EmailServiceStub.received += len(body.get("messages", [body]))
+
+        self.send_response(202)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+def _time_query(build_query, runs):
+    """
+    Run a query several times and collect its latency.
+
+    :param build_query: Callable returning the query to run
+    :type build_query: function
+    :param runs: Number of runs
+    :type runs: int
+    :return: list of milliseconds
+    """
+    timings = []
+
+    for _ in range(runs):
+        start = perf_counter()
+        build_query().all()
+        timings.append((perf_counter() - start) * 1000)
+
+    return timings
+
+
+def _log_timings(label, timings):
+    """
+    Log the median and 95th percentile of a benchmark.
+
+    :param label: Name of the benchmark
+    :type label: str
+    :param timings: Latencies in milliseconds
+    :type timings: list
+    """
+    p95 = sorted(timings)[int(len(timings) * 0.95) - 1]
+    echo(f"{label : <32} p50 {median(timings) : >8.2f}ms  p95 {p95 : >8.2f}ms")
+
+
+@group()
+def cli():
+    """
+    Run benchmarks against the configured db
+    """
+    pass
+
+
+@command()
+@option("--users", "user_count", type=int, required=True, help="Synthetic users")
+@option("--runs", default=20, help="Runs per query")
+def search(user_count, runs):
+    """
+    Benchmark admin user search with synthetic users, removed afterwards
+    """
+    flask_env = environ.get("FLASK_ENV", "production")
+
+    if flask_env not in BENCH_ENVIRONMENTS:
+        raise UsageError(
+            f"Refusing to add synthetic users with FLASK_ENV={flask_env}, "
+            f"use one of {', '.join(BENCH_ENVIRONMENTS)}"
+        )
+
+    echo(f"Adding {user_count} synthetic users...")
+
+    try:
+        db.session.execute(
+            text(
+                """
+                INSERT INTO users (created_on, updated_on, email, username,
+                                   sign_in_count, coins)
+                SELECT now(), now(),
+                       'bench' || g || '@' || :domain, 'bench' || g, 0, 100
+                FROM generate_series(1, :user_count) AS g
+                """
+            ),
+            {"domain": BENCH_EMAIL_DOMAIN, "user_count": user_count},
+        )
+        db.session.commit()
+        db.session.execute("ANALYZE users")
+
+        queries = (
+            ("substring", "ench4242"),
+            ("short", "42"),
+            ("misspelled", "bnech42421"),
+            ("email prefix", f"bench424242@{BENCH_EMAIL_DOMAIN}"),
+        )
+
+        for label, query in queries:
+            timings = _time_query(
+                lambda: User.query.filter(User.search(query))
+                .order_by(User.search_rank(query))
+                .limit(50),
+                runs,
+            )
+            _log_timings(f"{label} ({query})", timings)
+    finally:
+        db.session.rollback()
+        User.query.filter(User.email.like(f"%@{BENCH_EMAIL_DOMAIN}")).delete(
+            synchronize_session=False
+        )
+        db.session.commit()
+        db.session.execute("ANALYZE users")
+
+
+def _boot_celery(runs, tree=None):
+    """
+    Boot the worker's Celery app in fresh interpreters.
+
+    :param runs: Number of interpreters to boot
+    :type runs: int
+    :param tree: Checkout to boot, the current one when None
+    :type tree: str
+    :return: list of dicts
+    """
+    env = dict(environ)
+
+    if tree is not None:
+        env["PYTHONPATH"] = path.pathsep.join(
+            filter(None, (tree, env.get("PYTHONPATH")))
+        )
+
+    results = []
+
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", CELERY_BOOT_SCRIPT],
+            check=True,
+            cwd=tree,
+            env=env,
+            stdout=subprocess.PIPE,
+        ).stdout
+        results.append(json.loads(output.decode("utf-8").splitlines()[-1]))
+
+    return results
+
+
+def _log_boot(label, results):
+    """
+    Log the boot time, memory, Flask apps and tasks of a layout.
+
+    :param label: Name of the layout
+    :type label: str
+    :param results: Results from `_boot_celery`
+    :type results: list
+    """
+    _log_timings(f"{label} boot", [result["seconds"] * 1000 for result in results])
+    max_rss_mb = median(result["max_rss_kb"] for result in results) / 1024
+
+    echo(f"{label + ' peak rss' : <32} {max_rss_mb : >8.1f}MB")
+    echo(f"{label + ' flask apps built' : <32} {results[0]['flask_apps'] : >8}")
+    echo(f"{label + ' tasks registered' : <32} {results[0]['tasks'] : >8}")
+
+
+@command()
+@option("--runs", default=5, help="Fresh interpreters to boot")
+@option("--before", "before_ref", default=None, help="Git ref to compare with")
+def celery_boot(runs, before_ref):
+    """
+    Benchmark how long a worker takes to load its tasks and how much memory
+    it uses, optionally against an older commit checked out on the side
+    """
+    if before_ref is not None:
+        tree = tempfile.mkdtemp(prefix="bench-")
+        subprocess.run(
+            ["git", "worktree", "add", "--detach", tree, before_ref], check=True
+        )
+
+        try:
+            _log_boot(before_ref, _boot_celery(runs, tree))
+        finally:
+            subprocess.run(["git", "worktree", "remove", "--force", tree])
+
+    _log_boot("current", _boot_celery(runs))
+
+
+@command()
+@option("--messages", default=500, help="Messages to send per strategy")
+@option("--batch-size", default=50, help="Messages per bulk call")
+@option("--latency", default=5.0, help="Milliseconds the stub takes per call")
+def email(messages, batch_size, latency):
+    """
+    Benchmark e-mail delivery against a local stub of the e-mail service
+    """
+    EmailServiceStub.latency = latency / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), EmailServiceStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    client = EmailClient()
+    client.host = f"http://127.0.0.1:{server.server_port}"
+    client.default_sender = app.config["MAIL_DEFAULT_SENDER"]
+
+    outbox = [
+        client.message(f"bench{i}@{BENCH_EMAIL_DOMAIN}", "Bench", 1, {"i": i})
+        for i in range(messages)
+    ]
+
+    def unpooled():
+        for message in outbox:
+            requests.post(f"{client.host}/api/email/", json=message)
+
+    def pooled():
+        for message in outbox:
+            client.send(message)
+
+    def bulk():
+        client.bulk = True
+
+        for start in range(0, len(outbox), batch_size):
+            end = start + batch_size
+            client.send_batch(outbox[start:end])
+
+    try:
+        for label, strategy in (
+            ("new connection per message", unpooled),
+            ("pooled session", pooled),
+            (f"bulk calls of {batch_size}", bulk),
+        ):
+            EmailServiceStub.received = 0
+            start = perf_counter()
+            strategy()
+            seconds = perf_counter() - start
+
+            echo(
+                f"{label : <32} {EmailServiceStub.received / seconds : >8.0f} msg/s"
+                f"  {seconds : >8.2f}s"
+            )
+    finally:
+        server.shutdown()
+
+
+cli.add_command(search)
+cli.add_command(celery_boot)
+cli.add_command(email)
@@ -0,0 +1,113 @@
+import time
+
+from click import Choice
+from click import ClickException
+from click import command
+from click import echo
+from click import group
+from click import option
+from click import progressbar
+
+from snake_eyes.app import create_app
+from snake_eyes.blueprints.billing.models.coupon import Coupon
+from snake_eyes.extensions import db
+
+
+app = create_app()
+db.app = app
+
+
+@group()
+def cli():
+    """
+    Manage coupons in bulk
+    """
+    pass
+
+
+@command()
+@option("--count", default=1000, help="Coupons to generate")
+@option("--percent-off", type=int, help="Discount based on percent off")
+@option("--amount-off", type=float, help="Discount in dollars")
+@option("--currency", help="3 digit currency abbreviation, STRIPE_CURRENCY by default")
+@option("--duration", type=Choice(list(Coupon.DURATION)), default="once")
+@option("--duration-in-months", type=int, help="Months a repeating coupon lasts")
+@option("--max-redemptions", default=1, help="Redemptions allowed per coupon")
+@option("--redeem-by", help="Last redeem date, for example 2026-12-31T23:59:59")
+@option("--batch-size", default=1000, help="Coupons pushed to Stripe per batch")
+@option("--workers", default=8, help="Concurrent calls to Stripe")
+@option("--retries", default=5, help="Rounds of retries on connection errors")
+def generate(
+    count,
+    percent_off,
+    amount_off,
+    currency,
+    duration,
+    duration_in_months,
+    max_redemptions,
+    redeem_by,
+    batch_size,
+    workers,
+    retries,
+):
+    """
+    Generate coupons with unique random codes
+    """
+    if (percent_off is None) == (amount_off is None):
+        raise ClickException("Pick either --percent-off or --amount-off")
+
+    with app.app_context():
+        currency = currency or app.config["STRIPE_CURRENCY"]
+        params = Coupon.generation_params(
+            {
+                "percent_off": percent_off,
+                "amount_off": amount_off,
+                "currency": currency,
+                "duration": duration,
+                "duration_in_months": duration_in_months,
+                "max_redemptions": max_redemptions,
+                "redeem_by": redeem_by,
+            }
+        )
+
+        coupons = Coupon.insert_unique(count, params)
+        echo(f"Inserted {len(coupons)} coupons")
+
+        created, failed = 0, count - len(coupons)
+
+        with progressbar(length=len(coupons), label="Pushing to Stripe") as bar:
+            for attempt in range(retries + 1):
+                retry_coupons = []
+
+                for start in range(0, len(coupons), batch_size):
+                    end = start + batch_size
+                    batch = coupons[start:end]
+                    batch_created, batch_failed, batch_retry = Coupon.push_batch(
+                        batch, params, workers=workers
+                    )
+
+                    created += batch_created
+                    failed += batch_failed
+                    retry_coupons += batch_retry
+                    bar.update(len(batch) - len(batch_retry))
+
+                coupons = retry_coupons
+
+                if not coupons or attempt == retries:
+                    break
+
+                time.sleep(2 ** attempt)
+
+    echo(f"Created {created} coupons, {failed} failed")
+
+    if coupons:
+        raise ClickException(
+            f"{len(coupons)} coupon(s) could not be confirmed on Stripe, they "
+            f"were left invalid"
+        )
+
+    if failed:
+        raise ClickException(f"{failed} coupon(s) could not be created")
+
+
+cli.add_command(generate)
@@ -1,18 +1,55 @@
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+
+from click import ClickException
 from click import argument
 from click import command
 from click import echo
 from click import group
+from click import option
+from stripe.error import StripeError
 
 from snake_eyes.app import create_app
 from snake_eyes.blueprints.billing.gateways.stripecom import (
     Plan as PaymentPlan,
 )
+from snake_eyes.blueprints.billing.plans import PlanRegistry
+from snake_eyes.blueprints.billing.plans import plan_registry
 from snake_eyes.extensions import db
 
 
 app = create_app()
 db.app = app
 
+CREATE_FIELDS = ("metadata",) + PlanRegistry.REMOTE_FIELDS
+
+
+def _sync_plan(plan, action):
+    """
+    Create or update a single plan on stripe.
+
+    :param plan: Configured plan
+    :type plan: dict
+    :param action: create, update or unchanged
+    :type action: str
+    :return: Seconds it took
+    """
+    start = time.perf_counter()
+
+    if action == "create":
+        PaymentPlan.create(_id=plan["id"], **{k: plan.get(k) for k in CREATE_FIELDS})
+    elif action == "update":
+        PaymentPlan.update(
+            id=plan["id"],
+            name=plan.get("name"),
+            metadata=plan.get("metadata"),
+            statement_descriptor=plan.get("statement_descriptor"),
+        )
+
+    return time.perf_counter() - start
+
 
 @group()
 def cli():
@@ -23,23 +60,67 @@ def cli():
 
 
 @command()
-def sync():
+@option("--workers", default=4, help="How many plans are synced at once")
+def sync(workers):
     """
-    Sync the plans to stripe
+    Sync the plans to stripe and reload them in every running process
     """
-    if app.config["STRIPE_PLANS"] is not None:
-        for _, value in app.config["STRIPE_PLANS"].items():
-            plan = PaymentPlan.retrieve(value.get("id"))
-
-            if plan:
-                PaymentPlan.update(
-                    id=value.get("id"),
-                    name=value.get("name"),
-                    metadata=value.get("metadata"),
-                    statement_descriptor=value.get("statement_descriptor"),
+    plans = app.config["STRIPE_PLANS"]
+
+    if not plans:
+        return
+
+    started = time.perf_counter()
+
+    try:
+        remote_plans = PaymentPlan.list().data
+    except StripeError as e:
+        raise ClickException(f"Could not list the plans on stripe: {e}")
+
+    changes = PlanRegistry.diff(plans, remote_plans)
+    failures = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_sync_plan, plan, action): (plan, action, fields)
+            for plan, action, fields in changes
+        }
+
+        for future in as_completed(futures):
+            plan, action, fields = futures[future]
+
+            try:
+                duration = future.result()
+            except StripeError as e:
+                failures += 1
+                echo(f"{plan['id']}: {action} failed, {e}", err=True)
+                continue
+
+            echo(f"{plan['id']}: {action} in {duration * 1000:.0f}ms")
+
+            immutable = set(fields) - set(PlanRegistry.UPDATABLE_FIELDS)
+
+            if immutable:
+                echo(
+                    f"{plan['id']}: {', '.join(sorted(immutable))} differ on "
+                    "stripe and can't be updated, create a new plan instead",
+                    err=True,
                 )
-            else:
-                PaymentPlan.create(**value)
+
+    try:
+        remote_plans = PaymentPlan.list().data
+    except StripeError as e:
+        raise ClickException(f"Could not list the plans on stripe: {e}")
+
+    version = plan_registry.publish(PlanRegistry.merge_remote(plans, remote_plans))
+
+    echo(
+        f"Synced {len(changes)} plan(s) in {time.perf_counter() - started:.2f}s, "
+        f"published as registry version {version}"
+    )
+
+    if failures:
+        raise ClickException(f"{failures} plan(s) failed to sync")
 
 
 @command()
@@ -48,8 +129,17 @@ def delete(plan_ids):
     """
     Delete plans from stripe
     """
+    failures = 0
+
     for plan_id in plan_ids:
-        PaymentPlan.delete(plan_id)
+        try:
+            PaymentPlan.delete(plan_id)
+        except StripeError as e:
+            failures += 1
+            echo(f"{plan_id}: delete failed, {e}", err=True)
+
+    if failures:
+        raise ClickException(f"{failures} plan(s) failed to delete")
 
 
 @command()
@@ -57,7 +147,10 @@ def show():
     """
     List all existing plans
     """
-    echo(PaymentPlan.list())
+    try:
+        echo(PaymentPlan.list())
+    except StripeError as e:
+        raise ClickException(str(e))
 
 
 cli.add_command(sync)
@@ -0,0 +1,68 @@
+import sys
+
+from os import WEXITSTATUS
+from os import WIFEXITED
+from os import wait
+from signal import SIGTERM
+from signal import signal
+from subprocess import Popen
+
+from click import BadParameter
+from click import argument
+from click import command
+
+from config.settings import CELERY_QUEUE_CONCURRENCY
+
+
+@command()
+@argument("queues", nargs=-1)
+def cli(queues):
+    """
+    Start a Celery worker per queue, every queue when none are given.
+
+    Each worker only consumes its own queue with the concurrency set in
+    CELERY_QUEUE_CONCURRENCY so bulk jobs never hold up e-mails or
+    webhooks. Beat runs on its own with `celery beat`.
+
+    :param queues: Queues to consume
+    :return: None, exits with the code of the first worker to stop
+    """
+    unknown = set(queues) - set(CELERY_QUEUE_CONCURRENCY)
+
+    if unknown:
+        raise BadParameter(f"Unknown queue(s): {', '.join(sorted(unknown))}")
+
+    # Stopping the command stops the workers, which finish their tasks first.
+    signal(SIGTERM, lambda *_: sys.exit(0))
+
+    workers = [
+        Popen(
+            [
+                "celery",
+                "worker",
+                "--app",
+                "snake_eyes.app:celery",
+                "--queues",
+                queue,
+                "--concurrency",
+                str(CELERY_QUEUE_CONCURRENCY[queue]),
+                "--hostname",
+                f"{queue}@%h",
+                "--loglevel",
+                "info",
+            ]
+        )
+        for queue in queues or CELERY_QUEUE_CONCURRENCY
+    ]
+
+    try:
+        _, status = wait()
+    finally:
+        for worker in workers:
+            if worker.poll() is None:
+                worker.terminate()
+
+        for worker in workers:
+            worker.wait()
+
+    sys.exit(WEXITSTATUS(status) if WIFEXITED(status) else 1)
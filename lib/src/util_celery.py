@@ -0,0 +1,60 @@
+from celery import Celery
+from celery import Task
+
+
+class FlaskTask(Task):
+    """
+    Run every task inside the context of the Flask app
+    """
+
+    abstract = True
+
+    def __call__(self, *args, **kwargs):
+        with self.app.get_flask_app().app_context():
+            return super(FlaskTask, self).__call__(*args, **kwargs)
+
+
+class FlaskCelery(Celery):
+    """
+    Celery app shared by every tasks module, tied to a Flask app lazily.
+
+    Importing a tasks module only registers its tasks, the Flask app is
+    built by the factory the first time the configuration is needed and
+    only if no app was created by the process beforehand.
+    """
+
+    def __init__(self, main=None, app_factory=None, **kwargs):
+        kwargs.setdefault("task_cls", FlaskTask)
+        super(FlaskCelery, self).__init__(main, **kwargs)
+
+        self.app_factory = app_factory
+        self.flask_app = None
+
+    def init_app(self, app):
+        """
+        Tie the Flask app to Celery.
+
+        :param app: Flask application instance
+        """
+        self.flask_app = app
+        app.extensions["celery"] = self
+
+    def get_flask_app(self):
+        """
+        Flask app of this process, built by the factory when none exists.
+
+        :return: Flask app
+        """
+        if self.flask_app is None:
+            self.init_app(self.app_factory())
+
+        return self.flask_app
+
+    def on_configure(self):
+        """
+        Load the Flask app's config right before Celery reads its own.
+        """
+        config = self.get_flask_app().config
+
+        self.conf.update(config)
+        self.conf.update(BROKER_URL=config["CELERY_BROKER_URL"])
@@ -0,0 +1,214 @@
+import logging
+import os
+
+from uuid import uuid4
+
+import requests
+
+from requests.adapters import HTTPAdapter
+
+
+logger = logging.getLogger(__name__)
+
+
+class EmailError(Exception):
+    pass
+
+
+class EmailServiceError(EmailError):
+    """
+    The e-mail service could not be reached or failed, worth retrying.
+    """
+
+    def __init__(self, message, unsent=None):
+        super(EmailServiceError, self).__init__(message)
+
+        # Messages of a batch that were not sent when the service failed.
+        self.unsent = unsent or []
+
+
+class EmailRejectedError(EmailError):
+    """
+    The e-mail service refused the message, retrying would not help.
+    """
+
+    pass
+
+
+# Celery options of the tasks sending e-mails, transient failures of the
+# e-mail service are retried with a jittered exponential backoff.
+RETRY_OPTIONS = {
+    "autoretry_for": (EmailServiceError,),
+    "retry_backoff": True,
+    "retry_backoff_max": 300,
+    "retry_jitter": True,
+    "retry_kwargs": {"max_retries": 5},
+}
+
+
+class EmailClient:
+    """
+    Client of the transactional e-mail service, set up like other
+    extensions. Every process keeps a pooled keep-alive session and every
+    call is bounded by connect and read timeouts.
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, app=None):
+        self.host = None
+        self.default_sender = None
+        self.timeout = (3.05, 10)
+        self.pool_size = 10
+        self.bulk = False
+
+        self._pid = None
+        self._session = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Read the e-mail service settings from the app's config.
+
+        :param app: Flask application instance
+        """
+        self.host = app.config["EMAIL_SERVICE_HOST"]
+        self.default_sender = app.config["MAIL_DEFAULT_SENDER"]
+        self.timeout = (
+            app.config["EMAIL_CONNECT_TIMEOUT"],
+            app.config["EMAIL_READ_TIMEOUT"],
+        )
+        self.pool_size = app.config["EMAIL_POOL_SIZE"]
+        self.bulk = app.config["EMAIL_SERVICE_BULK"]
+
+        self._session = None
+        app.extensions["email_client"] = self
+
+    @property
+    def session(self):
+        """
+        Session of the current process, a forked worker builds its own so
+        pooled sockets are never shared across processes.
+
+        :return: requests Session
+        """
+        if self._session is None or self._pid != os.getpid():
+            adapter = HTTPAdapter(
+                pool_connections=self.pool_size, pool_maxsize=self.pool_size
+            )
+
+            session = requests.Session()
+            session.headers.update({"Accept": "application/json"})
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+
+            self._session = session
+            self._pid = os.getpid()
+
+        return self._session
+
+    def message(
+        self,
+        receiver,
+        subject,
+        template_id,
+        template_params,
+        sender=None,
+        request_id=None,
+    ):
+        """
+        Build a message for the e-mail service.
+
+        :param receiver: E-mail address of the receiver
+        :type receiver: str
+        :param subject: Subject of the e-mail
+        :type subject: str
+        :param template_id: Template rendered by the e-mail service
+        :type template_id: int
+        :param template_params: Values of the template
+        :type template_params: dict
+        :param sender: E-mail address of the sender, defaults to the app's
+        :type sender: str
+        :param request_id: Lets the service drop a message sent twice
+        :type request_id: str
+        :return: dict
+        """
+        return {
+            "sender": sender or self.default_sender,
+            "receiver": receiver,
+            "subject": subject,
+            "template_id": template_id,
+            "request_id": request_id or uuid4().hex,
+            "template_params": template_params,
+        }
+
+    def send(self, message):
+        """
+        Send a single message.
+
+        :param message: Message built by `message`
+        :type message: dict
+        :return: requests Response
+        """
+        return self._post("/api/email/", message)
+
+    def send_batch(self, messages):
+        """
+        Send several messages, in a single call when the e-mail service
+        supports bulk sends and one at a time over the pooled session
+        otherwise. Rejected messages are logged and skipped.
+
+        :param messages: Messages built by `message`
+        :type messages: list
+        :raise EmailServiceError: With the messages that were not sent
+        :return: int, number of messages sent
+        """
+        if not messages:
+            return 0
+
+        if self.bulk:
+            try:
+                self._post("/api/email/bulk/", {"messages": messages})
+            except EmailRejectedError as e:
+                logger.error(f"Dropped a batch of {len(messages)} e-mails: {e}")
+                return 0
+            except EmailServiceError as e:
+                raise EmailServiceError(str(e), unsent=messages)
+
+            return len(messages)
+
+        sent = 0
+
+        for i, message in enumerate(messages):
+            try:
+                self.send(message)
+                sent += 1
+            except EmailRejectedError as e:
+                logger.error(f"Dropped e-mail {message['request_id']}: {e}")
+            except EmailServiceError as e:
+                raise EmailServiceError(str(e), unsent=messages[i:])
+
+        return sent
+
+    def _post(self, path, payload):
+        try:
+            response = self.session.post(
+                f"{self.host}{path}", json=payload, timeout=self.timeout
+            )
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise EmailServiceError(f"E-mail service unavailable: {e}")
+
+        if response.status_code in self.RETRY_STATUSES:
+            raise EmailServiceError(
+                f"E-mail service failed with status {response.status_code}"
+            )
+
+        if response.status_code >= 400:
+            raise EmailRejectedError(
+                f"E-mail service rejected the message with status "
+                f"{response.status_code}: {response.text}"
+            )
+
+        return response
@@ -0,0 +1,119 @@
+import time
+
+from flask import current_app
+from flask import g
+from flask import has_app_context
+from flask import has_request_context
+from flask import request
+from sqlalchemy import event
+
+
+class QueryStats:
+    """
+    Instrumentation of the db engine, set up like other extensions. Every
+    request counts its SQL queries and the time they took, statements
+    slower than the threshold are logged along with the route that sent
+    them and the totals can be reported in a Server-Timing header.
+
+    Settings are read from the current app so every app created by the
+    process keeps its own.
+    """
+
+    START_TIME_KEY = "query_stats:start_time"
+
+    def __init__(self, app=None, db=None):
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        """
+        Hook onto the engine of the app when enabled in its config.
+
+        :param app: Flask application instance
+        :param db: Flask-SQLAlchemy instance the app was registered with
+        """
+        app.extensions["query_stats"] = self
+
+        if not app.config["QUERY_STATS_ENABLED"]:
+            return None
+
+        engine = db.get_engine(app)
+
+        if not event.contains(engine, "before_cursor_execute", self.before_execute):
+            event.listen(engine, "before_cursor_execute", self.before_execute)
+            event.listen(engine, "after_cursor_execute", self.after_execute)
+            event.listen(engine, "handle_error", self.handle_error)
+
+        app.before_request(self.reset)
+        app.after_request(self.report)
+
+    def before_execute(self, conn, cursor, statement, *args):
+        conn.info[QueryStats.START_TIME_KEY] = time.perf_counter()
+
+    def after_execute(self, conn, cursor, statement, *args):
+        started = conn.info.pop(QueryStats.START_TIME_KEY, None)
+
+        if started is None or not has_app_context():
+            return None
+
+        duration = time.perf_counter() - started
+
+        if has_request_context():
+            g.query_count = g.get("query_count", 0) + 1
+            g.query_time = g.get("query_time", 0.0) + duration
+
+        if duration >= current_app.config["SLOW_QUERY_THRESHOLD"]:
+            current_app.logger.warning(
+                f"Slow query from {QueryStats.route()} took "
+                f"{duration * 1000:.1f}ms: {statement}"
+            )
+
+    def handle_error(self, context):
+        # after_cursor_execute does not fire for a statement that raised.
+        if context.connection is not None:
+            context.connection.info.pop(QueryStats.START_TIME_KEY, None)
+
+    def reset(self):
+        """
+        Start counting from zero, the app context and its `g` can outlive a
+        single request.
+
+        :return: None
+        """
+        g.query_count = 0
+        g.query_time = 0.0
+
+    def report(self, response):
+        """
+        Log the totals of the request and add them to the response.
+
+        :param response: Flask response
+        :return: Flask response
+        """
+        count = g.get("query_count", 0)
+        duration = g.get("query_time", 0.0) * 1000
+
+        current_app.logger.debug(
+            f"{QueryStats.route()} sent {count} queries in {duration:.1f}ms"
+        )
+
+        if current_app.config["QUERY_STATS_SERVER_TIMING"]:
+            response.headers.add(
+                "Server-Timing", f'db;dur={duration:.1f};desc="{count} queries"'
+            )
+
+        return response
+
+    @classmethod
+    def route(cls):
+        """
+        Route of the current request, or the process when there is none.
+
+        :return: str
+        """
+        if not has_request_context():
+            return "a background job"
+
+        rule = request.url_rule.rule if request.url_rule else request.path
+
+        return f"{request.method} {rule}"
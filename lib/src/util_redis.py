@@ -0,0 +1,96 @@
+from redis import StrictRedis
+
+
+# Stores a value unless its version changed since it was read, so a cache
+# entry read from the db right before an invalidation is not put back.
+STORE_IF_VERSION_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return 0
+end
+
+redis.call('SETEX', KEYS[1], ARGV[2], ARGV[3])
+
+return 1
+"""
+
+
+class Redis:
+    """
+    Shared Redis connection pool for the app, set up like other extensions
+    """
+
+    def __init__(self, app=None):
+        self._client = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Create the client from the app's config.
+        Connections are only opened on first use.
+
+        :param app: Flask application instance
+        """
+        self._client = StrictRedis.from_url(app.config["REDIS_URL"])
+        app.extensions["redis"] = self
+
+    def get_with_version(self, key, version_key):
+        """
+        Read a cached value along with the version of what it caches.
+
+        :param key: Key of the value
+        :type key: str
+        :param version_key: Key of the version
+        :type version_key: str
+        :return: tuple of the value, or None, and the version
+        """
+        value, version = self._client.mget(key, version_key)
+
+        return value, version or b"0"
+
+    def setex_if_version(self, key, version_key, version, ttl, value):
+        """
+        Cache a value unless its version was bumped since it was read with
+        `get_with_version`.
+
+        :param key: Key of the value
+        :type key: str
+        :param version_key: Key of the version
+        :type version_key: str
+        :param version: Version read before the value was computed
+        :type version: bytes
+        :param ttl: Seconds the value is kept
+        :type ttl: int
+        :param value: Value to cache
+        :type value: bytes
+        :return: bool, whether the value was stored
+        """
+        stored = self._client.eval(
+            STORE_IF_VERSION_SCRIPT, 2, key, version_key, version, ttl, value
+        )
+
+        return stored == 1
+
+    def invalidate_versioned(self, keys, version_ttl):
+        """
+        Drop cached values and bump their versions so lookups running
+        meanwhile do not store what they read.
+
+        :param keys: (key, version key) tuples
+        :type keys: list
+        :param version_ttl: Seconds a version is kept, past any lookup
+        :type version_ttl: int
+        :return: None
+        """
+        pipe = self._client.pipeline()
+
+        for key, version_key in keys:
+            pipe.delete(key)
+            pipe.incr(version_key)
+            pipe.expire(version_key, version_ttl)
+
+        pipe.execute()
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
@@ -1,12 +1,32 @@
+import time
+
 from datetime import datetime
 
+from flask import current_app
+from itsdangerous import BadSignature
+from itsdangerous import URLSafeSerializer
+from sqlalchemy import DDL
 from sqlalchemy import DateTime
+from sqlalchemy import and_
+from sqlalchemy import event
+from sqlalchemy import func
+from sqlalchemy import literal
+from sqlalchemy import or_
+from sqlalchemy import tuple_
 from sqlalchemy.types import TypeDecorator
 
 from lib.src.util_datetime import tz_aware_datetime
 from snake_eyes.extensions import db
 
 
+# Trigram indexes need pg_trgm, make sure it exists for create_all() as well
+event.listen(
+    db.metadata,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
+
+
 class AwareDateTime(TypeDecorator):
     """
     Time zone aware utility for storing date time objects
@@ -20,11 +40,35 @@ class AwareDateTime(TypeDecorator):
         return value
 
 
+class KeysetPagination:
+    """
+    A page of results fetched with keyset (seek) pagination
+    """
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
 class ResourceMixin:
     """
     Mixin for managing db objects
     """
 
+    # Columns covered by trigram indexes, used by search()
+    SEARCH_COLUMNS = ()
+    # Column searched with a prefix match when the query is an email
+    SEARCH_EMAIL_COLUMN = None
+
     created_on = db.Column(AwareDateTime(), default=tz_aware_datetime)
     updated_on = db.Column(
         AwareDateTime(), default=tz_aware_datetime, onupdate=tz_aware_datetime
@@ -48,6 +92,171 @@ class ResourceMixin:
 
         return field, direction
 
+    @classmethod
+    def search(cls, query):
+        """
+        Search a resource by its trigram indexed fields.
+        Email queries are matched on their prefix, anything else by
+        substring or trigram similarity.
+
+        :param query: Search query
+        :type query: str
+        :return: SQLAlchemy filter
+        """
+        if not query:
+            return ""
+
+        # Wildcards typed in are matched literally
+        pattern = query.replace("\\", "\\\\")
+        pattern = pattern.replace("%", "\\%").replace("_", "\\_")
+
+        if cls.SEARCH_EMAIL_COLUMN and "@" in query:
+            column = getattr(cls, cls.SEARCH_EMAIL_COLUMN)
+
+            return column.ilike(f"{pattern}%", escape="\\")
+
+        columns = [getattr(cls, column) for column in cls.SEARCH_COLUMNS]
+        search_query = f"%{pattern}%"
+
+        # `%` is pg_trgm's similarity operator when applied to text, the
+        # compiler escapes it for the driver unlike a custom op("%").
+        search_chain = [column.ilike(search_query, escape="\\") for column in columns]
+        search_chain += [column % query for column in columns]
+
+        return or_(*search_chain)
+
+    @classmethod
+    def search_rank(cls, query):
+        """
+        Order search results by their best trigram similarity to the query.
+
+        :param query: Search query
+        :type query: str
+        :return: SQLAlchemy order by clause
+        """
+        columns = [getattr(cls, column) for column in cls.SEARCH_COLUMNS]
+        similarities = [func.similarity(column, query) for column in columns]
+
+        return func.greatest(*similarities).desc()
+
+    @classmethod
+    def cursor_serializer(cls):
+        """
+        Serializer used to sign the opaque pagination cursors
+
+        :return: URLSafeSerializer
+        """
+        return URLSafeSerializer(current_app.config["SECRET_KEY"], salt="cursor")
+
+    @classmethod
+    def seek(cls, query, cursor=None, per_page=50, direction="desc", prefix=()):
+        """
+        Paginate a query on (created_on, id) without OFFSET or COUNT(*)
+
+        :param query: Query to paginate, any ordering is replaced
+        :type query: SQLAlchemy query
+        :param cursor: Cursor token from a previous page
+        :type cursor: str
+        :param per_page: Number of items per page
+        :type per_page: int
+        :param direction: Sort direction
+        :type direction: str
+        :param prefix: Non null expressions sorted ascending ahead of
+                       (created_on, id), to group the rows of a page
+        :type prefix: tuple
+        :return: KeysetPagination
+        """
+        serializer = cls.cursor_serializer()
+        key, backwards = None, False
+
+        if cursor:
+            try:
+                *values, created_on, _id, backwards = serializer.loads(cursor)
+                key = (*values, (datetime.fromisoformat(created_on), _id))
+
+                if len(values) != len(prefix):
+                    raise ValueError("Cursor of another ordering")
+            except (BadSignature, TypeError, ValueError):
+                key, backwards = None, False
+
+        # Walking back to a previous page scans in the opposite order,
+        # the rows are reversed afterwards so pages always read the same way.
+        descending = (direction == "desc") != backwards
+        columns = [(column, not backwards) for column in prefix]
+        columns.append((tuple_(cls.created_on, cls.id), not descending))
+
+        if key is not None:
+            query = query.filter(ResourceMixin.seek_condition(columns, key))
+
+        order = [
+            column.asc() if ascending else column.desc()
+            for column, ascending in columns[:-1]
+        ]
+
+        if descending:
+            order += [cls.created_on.desc(), cls.id.desc()]
+        else:
+            order += [cls.created_on.asc(), cls.id.asc()]
+
+        rows = (
+            query.add_columns(*prefix)
+            .order_by(None)
+            .order_by(*order)
+            .limit(per_page + 1)
+            .all()
+        )
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+
+        if backwards:
+            rows.reverse()
+
+        # Rows come with the prefix values when there is a prefix.
+        items = [row[0] for row in rows] if prefix else rows
+        row_values = [list(row[1:]) if prefix else [] for row in rows]
+
+        has_next = key is not None if backwards else has_more
+        has_prev = has_more if backwards else key is not None
+
+        next_cursor, prev_cursor = None, None
+
+        if items and has_next:
+            last = items[-1]
+            next_cursor = serializer.dumps(
+                row_values[-1] + [last.created_on.isoformat(), last.id, False]
+            )
+
+        if items and has_prev:
+            first = items[0]
+            prev_cursor = serializer.dumps(
+                row_values[0] + [first.created_on.isoformat(), first.id, True]
+            )
+
+        return KeysetPagination(items, next_cursor, prev_cursor)
+
+    @classmethod
+    def seek_condition(cls, columns, key):
+        """
+        Rows coming after a key in a lexicographic ordering.
+
+        :param columns: (expression, ascending) pairs in sort order
+        :type columns: list
+        :param key: Values of the expressions for the last row seen
+        :type key: tuple
+        :return: SQLAlchemy filter
+        """
+        # Booleans are bound as values, SQLAlchemy would compare them
+        # with IS otherwise, which has no ordering.
+        key = [literal(value) if isinstance(value, bool) else value for value in key]
+        conditions = []
+
+        for i, (column, ascending) in enumerate(columns):
+            equal = [c == value for (c, _), value in zip(columns[:i], key)]
+            after = column > key[i] if ascending else column < key[i]
+            conditions.append(and_(*equal, after))
+
+        return or_(*conditions)
+
     @classmethod
     def get_bulk_action_ids(cls, scope, ids, omit_ids=[], query=""):
         """
@@ -76,6 +285,67 @@ class ResourceMixin:
 
         return ids
 
+    @classmethod
+    def update_in_chunks(cls, condition, values, chunk_size=1000, returning=None):
+        """
+        Update the rows matching a condition a chunk at a time, each chunk
+        in its own short transaction so locks are never held for long.
+
+        The condition has to stop matching once a row is updated, which
+        also makes running the update again a no-op. Rows locked by
+        someone else are skipped until the next run.
+
+        :param condition: SQLAlchemy filter matching the rows to update
+        :param values: Values to set
+        :type values: dict
+        :param chunk_size: Rows updated per transaction
+        :type chunk_size: int
+        :param returning: Column whose values are collected as "returned"
+        :return: dict with the rows updated, the chunks and the seconds
+        """
+        start = time.perf_counter()
+        chunk = (
+            db.session.query(cls.id)
+            .filter(condition)
+            .order_by(cls.id)
+            .limit(chunk_size)
+            .with_for_update(skip_locked=True)
+        )
+        statement = cls.__table__.update().where(cls.id.in_(chunk.statement))
+
+        if returning is not None:
+            statement = statement.returning(returning)
+
+        updated, chunks, returned = 0, 0, []
+
+        while True:
+            result = db.session.execute(statement.values(values))
+
+            if returning is not None:
+                returned.extend(row[0] for row in result)
+
+            db.session.commit()
+
+            if not result.rowcount:
+                break
+
+            updated += result.rowcount
+            chunks += 1
+
+            if result.rowcount < chunk_size:
+                break
+
+        report = {
+            "updated": updated,
+            "chunks": chunks,
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+
+        if returning is not None:
+            report["returned"] = returned
+
+        return report
+
     @classmethod
     def bulk_delete(cls, ids):
         """
@@ -1,5 +1,8 @@
+from contextlib import contextmanager
+
 from flask import url_for
 from pytest import fixture
+from sqlalchemy import event
 
 
 class ViewTestMixin:
@@ -43,3 +46,25 @@ def login(client, identity="", password=""):
 
 def logout(client):
     return client.get(url_for("user.logout"), follow_redirects=True)
+
+
+@contextmanager
+def capture_queries(engine):
+    """
+    Record every SQL statement sent through an engine.
+
+    :param engine: SQLAlchemy engine
+    :type engine: Engine
+    :return: list of statements
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
@@ -1,10 +1,10 @@
 from logging import ERROR
 from logging import Formatter
 from logging.handlers import SMTPHandler
+from pkgutil import iter_modules
 
 import stripe
 
-from celery import Celery
 from flask import Flask
 from flask import render_template
 from flask import request
@@ -12,21 +12,29 @@ from flask_login import current_user
 from itsdangerous import URLSafeTimedSerializer
 from werkzeug.contrib.fixers import ProxyFix
 
+from lib.src.util_celery import FlaskCelery
+from snake_eyes import blueprints
 from snake_eyes.blueprints.admin import admin_bp
 from snake_eyes.blueprints.bet import bet_bp
 from snake_eyes.blueprints.billing import billing_bp
 from snake_eyes.blueprints.billing import stripe_webhook_bp
+from snake_eyes.blueprints.billing.gateways.breaker import stripe_breaker
+from snake_eyes.blueprints.billing.gateways.transport import PooledHTTPClient
+from snake_eyes.blueprints.billing.plans import plan_registry
 from snake_eyes.blueprints.billing.template_processors import current_year
 from snake_eyes.blueprints.billing.template_processors import format_currency
 from snake_eyes.blueprints.contact import contact_bp
 from snake_eyes.blueprints.page import page_bp
 from snake_eyes.blueprints.user import user_bp
-from snake_eyes.blueprints.user.models import User
+from snake_eyes.blueprints.user.cache import UserCache
 from snake_eyes.extensions import babel
 from snake_eyes.extensions import csrf
 from snake_eyes.extensions import db
+from snake_eyes.extensions import email_client
 from snake_eyes.extensions import limiter
 from snake_eyes.extensions import login_manager
+from snake_eyes.extensions import query_stats
+from snake_eyes.extensions import redis
 
 
 def create_app(settings_override=None):
@@ -47,6 +55,15 @@ def create_app(settings_override=None):
 
     stripe.api_key = app.config.get("STRIPE_SECRET_KEY")
     stripe.api_version = app.config.get("STRIPE_API_VERSION")
+    stripe.default_http_client = PooledHTTPClient(
+        connect_timeout=app.config["STRIPE_CONNECT_TIMEOUT"],
+        read_timeout=app.config["STRIPE_READ_TIMEOUT"],
+        max_retries=app.config["STRIPE_MAX_RETRIES"],
+        backoff=app.config["STRIPE_RETRY_BACKOFF"],
+        deadline=app.config["STRIPE_RETRY_DEADLINE"],
+        pool_size=app.config["STRIPE_POOL_SIZE"],
+        breaker=stripe_breaker,
+    )
 
     middleware(app)
     error_handler(app)
@@ -62,40 +79,24 @@ def create_app(settings_override=None):
 
     template_processors(app)
     init_extensions(app)
-    authentication(app, User)
+    authentication(app)
     locale(app)
 
     return app
 
 
-def create_celery(app=None):
+def task_packages():
     """
-    Create a new Celery object and tie together the Celery config to the app's
-    config. Wrap all tasks in the context of the application.
+    Packages Celery looks for a tasks module in, the app's own package for
+    the tasks shared by blueprints and then every blueprint.
 
-    :param app: Flask app
-    :return: Celery app
+    :return: list
     """
-    app = app or create_app()
-
-    celery = Celery(
-        app.import_name,
-        broker=app.config["CELERY_BROKER_URL"],
-        include=app.config["CELERY_TASK_LIST"],
-    )
-    celery.conf.update(app.config)
-
-    BaseTask = celery.Task
-
-    class ContextTask(BaseTask):
-        abstract = True
-
-        def __call__(self, *args, **kwargs):
-            with app.app_context():
-                return BaseTask.__call__(self, *args, **kwargs)
-
-    celery.Task = ContextTask
-    return celery
+    return [__package__] + [
+        f"{blueprints.__name__}.{name}"
+        for _, name, is_package in iter_modules(blueprints.__path__)
+        if is_package
+    ]
 
 
 def init_extensions(app):
@@ -106,24 +107,29 @@ def init_extensions(app):
     :param app: Flask application isntance
     """
     db.init_app(app)
+    query_stats.init_app(app, db)
     login_manager.init_app(app)
     csrf.init_app(app)
     limiter.init_app(app)
     babel.init_app(app)
+    redis.init_app(app)
+    email_client.init_app(app)
+    celery.init_app(app)
+    stripe_breaker.init_app(app)
+    plan_registry.init_app(app)
 
 
-def authentication(app, user_model):
+def authentication(app):
     """
     Initialization requied for Flask-Login.
 
     :param app: Flask app instance
-    :param user_model: Model with auth information
     """
     login_manager.login_view = "user.login"
 
     @login_manager.user_loader
     def load_user(uid):
-        return user_model.query.get(uid)
+        return UserCache.get(uid)
 
     @login_manager.token_loader
     def load_token(token):
@@ -133,7 +139,7 @@ def authentication(app, user_model):
         data = serializer.loads(token, max_age=duration)
         user_uid = data[0]
 
-        return user_model.query.get(user_uid)
+        return UserCache.get(user_uid)
 
 
 def middleware(app):
@@ -223,3 +229,7 @@ def locale(app):
             return current_user.locale
 
         return request.accept_languages.best_match(app.config.get("LANGUAGES").keys())
+
+
+celery = FlaskCelery("snake_eyes", app_factory=create_app)
+celery.autodiscover_tasks(task_packages)
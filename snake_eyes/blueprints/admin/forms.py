@@ -111,3 +111,15 @@ class CouponForm(Form):
             self.amount_off.errors.append(error)
 
         return result
+
+
+class CouponGenerateForm(CouponForm):
+    code = None
+    count = IntegerField(
+        "Number of codes", [DataRequired(), NumberRange(min=1, max=100000)]
+    )
+    max_redemptions = IntegerField(
+        "Max Redemptions per code",
+        [Optional(), NumberRange(min=1, max=2147483647)],
+        default=1,
+    )
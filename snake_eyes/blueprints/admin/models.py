@@ -1,26 +1,152 @@
+from datetime import timedelta
+
+from flask import current_app
+from redis.exceptions import RedisError
 from sqlalchemy import func
+from sqlalchemy import select
 
+from lib.src.util_datetime import tz_aware_datetime
+from lib.src.util_sqlalchemy import ResourceMixin
 from snake_eyes.blueprints.bet.models.bet import Bet
 from snake_eyes.blueprints.billing.models.subscription import Subscription
 from snake_eyes.blueprints.user.models import User
 from snake_eyes.blueprints.user.models import db
+from snake_eyes.extensions import redis
+
+
+class DashboardStat(ResourceMixin, db.Model):
+    """
+    Snapshot of the dashboard aggregates, one row per group
+    """
+
+    __tablename__ = "dashboard_stats"
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    stat = db.Column(db.String(32), index=True, nullable=False)
+    label = db.Column(db.String(128))
+    count = db.Column(db.BigInteger(), nullable=False, default=0)
+
+    def __init__(self, **kwargs):
+        super(DashboardStat, self).__init__(**kwargs)
 
 
 class Dashboard:
+    GROUPED_STATS = (
+        ("users", User, User.role),
+        ("plans", Subscription, Subscription.plan),
+        ("payouts", Bet, Bet.payout),
+    )
+    # Key of the advisory lock held while the snapshot is rebuilt
+    REFRESH_LOCK_ID = 71001
+    # Set while a refresh queued by the dashboard page is pending
+    REFRESH_QUEUED_KEY = "dashboard:refresh_queued"
+
+    @classmethod
+    def refresh(cls):
+        """
+        Recompute every aggregate and replace the snapshot atomically.
+
+        Refreshes are serialized by a transaction level advisory lock, a
+        refresh started while another one runs is skipped and the current
+        snapshot is kept, otherwise both would delete the old rows and
+        insert their own.
+
+        :return: int, None when another refresh is running
+        """
+        locked = db.session.execute(
+            select([func.pg_try_advisory_xact_lock(Dashboard.REFRESH_LOCK_ID)])
+        ).scalar()
+
+        if not locked:
+            db.session.rollback()
+            return None
+
+        rows = []
+
+        for stat, model, field in Dashboard.GROUPED_STATS:
+            count = func.count(field)
+
+            for total, label in db.session.query(count, field).group_by(field):
+                label = None if label is None else str(label)
+                rows.append({"stat": stat, "label": label, "count": total})
+
+            rows.append({"stat": f"{stat}_total", "count": model.query.count()})
+
+        coupons = Subscription.query.filter(Subscription.coupon.isnot(None)).count()
+        rows.append({"stat": "coupons", "count": coupons})
+
+        DashboardStat.query.delete(synchronize_session=False)
+        db.session.bulk_insert_mappings(DashboardStat, rows)
+        db.session.commit()
+
+        return len(rows)
+
     @classmethod
-    def _group_and_count(cls, model, field):
+    def refreshed_on(cls):
         """
-        Group results for a specific model and field
+        When the snapshot was taken.
 
-        :param model: Model to be used
-        :type model: SQLAlchemy model
-        :param field: Field for grouping
-        :type field: SQLAlchemy field
+        :return: datetime, None when there is no snapshot yet
         """
-        count = func.count(field)
-        query = db.session.query(count, field).group_by(field).all()
+        return db.session.query(func.min(DashboardStat.created_on)).scalar()
 
-        return {"query": query, "total": model.query.count()}
+    @classmethod
+    def is_stale(cls, refreshed_on, max_age):
+        """
+        Whether a snapshot is missing or older than the given age.
+
+        :param refreshed_on: When the snapshot was taken
+        :type refreshed_on: datetime or None
+        :param max_age: Seconds a snapshot stays fresh
+        :type max_age: int
+        :return: bool
+        """
+        if refreshed_on is None:
+            return True
+
+        return tz_aware_datetime() - refreshed_on > timedelta(seconds=max_age)
+
+    @classmethod
+    def queue_refresh(cls, interval):
+        """
+        Refresh the snapshot in the background, at most once per interval
+        however often the dashboard is viewed.
+
+        :param interval: Seconds before another refresh may be queued
+        :type interval: int
+        :return: bool, whether a refresh was queued
+        """
+        from snake_eyes.blueprints.admin.tasks import refresh_dashboard_stats
+
+        try:
+            queued = redis.set(Dashboard.REFRESH_QUEUED_KEY, 1, nx=True, ex=interval)
+        except RedisError as e:
+            current_app.logger.warning(f"Dashboard refresh not queued: {e}")
+            return False
+
+        if queued:
+            refresh_dashboard_stats.delay()
+
+        return bool(queued)
+
+    @classmethod
+    def _group_and_count(cls, stat):
+        """
+        Read the grouped results of a stat from the snapshot
+
+        :param stat: Name of the stat
+        :type stat: str
+        :return: dict
+        """
+        rows = DashboardStat.query.filter(
+            DashboardStat.stat.in_((stat, f"{stat}_total"))
+        ).all()
+
+        query = [(row.count, row.label) for row in rows if row.stat == stat]
+        total = sum(row.count for row in rows if row.stat != stat)
+
+        return {"query": query, "total": total}
 
     @classmethod
     def group_and_count_users(cls):
@@ -28,7 +154,7 @@ class Dashboard:
         Perform a group by/count on all users
         :return: dict
         """
-        return Dashboard._group_and_count(User, User.role)
+        return Dashboard._group_and_count("users")
 
     @classmethod
     def group_and_count_plans(cls):
@@ -36,7 +162,7 @@ class Dashboard:
         Perform a group by/count on all plans
         :return: dict
         """
-        return Dashboard._group_and_count(Subscription, Subscription.plan)
+        return Dashboard._group_and_count("plans")
 
     @classmethod
     def group_and_count_coupons(cls):
@@ -45,12 +171,13 @@ class Dashboard:
 
         :return: tuple
         """
-        count = (
-            db.session.query(Subscription)
-            .filter(Subscription.coupon.isnot(None))
-            .count()
-        )
-        total = db.session.query(func.count(Subscription.id)).scalar()
+        rows = DashboardStat.query.filter(
+            DashboardStat.stat.in_(("coupons", "plans_total"))
+        ).all()
+
+        counts = {row.stat: row.count for row in rows}
+        count = counts.get("coupons", 0)
+        total = counts.get("plans_total", 0)
 
         percentage = 0 if total == 0 else round((count / float(total)) * 100, 1)
 
@@ -63,4 +190,4 @@ class Dashboard:
 
         :return: dict
         """
-        return Dashboard._group_and_count(Bet, Bet.payout)
+        return Dashboard._group_and_count("payouts")
@@ -0,0 +1,196 @@
+from contextlib import contextmanager
+from uuid import uuid4
+
+from celery.exceptions import Retry
+from flask import current_app
+from redis.exceptions import RedisError
+
+from lib.src.util_datetime import tz_aware_datetime
+from snake_eyes.extensions import redis
+
+
+class BulkProgress:
+    """
+    Progress of the bulk jobs started from the admin, kept in Redis so
+    every Celery worker can report on the same job.
+    """
+
+    TTL = 86400
+
+    @classmethod
+    def key(cls, kind, job_id):
+        """
+        Redis key of a job
+
+        :param kind: Kind of job
+        :type kind: str
+        :param job_id: Job id
+        :type job_id: str
+        :return: str
+        """
+        return f"bulk_progress:{kind}:{job_id}"
+
+    @classmethod
+    def start(cls, kind, total):
+        """
+        Start tracking a job and make it the latest of its kind.
+
+        :param kind: Kind of job, for example delete_users
+        :type kind: str
+        :param total: Number of items to process
+        :type total: int
+        :return: str, job id
+        """
+        job_id = uuid4().hex
+        key = BulkProgress.key(kind, job_id)
+
+        pipe = redis.pipeline()
+        pipe.hmset(
+            key,
+            {
+                "total": total,
+                "done": 0,
+                "failed": 0,
+                "started_on": tz_aware_datetime().isoformat(),
+            },
+        )
+        pipe.expire(key, BulkProgress.TTL)
+        pipe.setex(BulkProgress.key(kind, "latest"), BulkProgress.TTL, job_id)
+        pipe.execute()
+
+        return job_id
+
+    @classmethod
+    def advance(cls, kind, job_id, done=0, failed=0, handled=None):
+        """
+        Count processed items.
+
+        :param kind: Kind of job
+        :type kind: str
+        :param job_id: Job id
+        :type job_id: str
+        :param done: Items processed successfully
+        :type done: int
+        :param failed: Items that could not be processed
+        :type failed: int
+        :param handled: Ids to checkpoint so a retried job skips them
+        :type handled: list
+        :return: None
+        """
+        key = BulkProgress.key(kind, job_id)
+
+        pipe = redis.pipeline()
+        pipe.hincrby(key, "done", done)
+        pipe.hincrby(key, "failed", failed)
+
+        if handled:
+            pipe.sadd(f"{key}:handled", *handled)
+            pipe.expire(f"{key}:handled", BulkProgress.TTL)
+
+        pipe.execute()
+
+    @classmethod
+    def handled(cls, kind, job_id):
+        """
+        Ids checkpointed by a job.
+
+        :param kind: Kind of job
+        :type kind: str
+        :param job_id: Job id
+        :type job_id: str
+        :return: set of int
+        """
+        members = redis.smembers(f"{BulkProgress.key(kind, job_id)}:handled")
+
+        return {int(member) for member in members}
+
+    @classmethod
+    def finish(cls, kind, job_id):
+        """
+        Mark a job as finished.
+
+        :param kind: Kind of job
+        :type kind: str
+        :param job_id: Job id
+        :type job_id: str
+        :return: None
+        """
+        redis.hset(
+            BulkProgress.key(kind, job_id),
+            "finished_on",
+            tz_aware_datetime().isoformat(),
+        )
+
+    @classmethod
+    def fail(cls, kind, job_id, error):
+        """
+        Mark a job as finished because it failed.
+
+        :param kind: Kind of job
+        :type kind: str
+        :param job_id: Job id
+        :type job_id: str
+        :param error: What went wrong
+        :type error: str
+        :return: None
+        """
+        redis.hmset(
+            BulkProgress.key(kind, job_id),
+            {"finished_on": tz_aware_datetime().isoformat(), "error": error},
+        )
+
+    @classmethod
+    @contextmanager
+    def failing_on_error(cls, kind, job_id):
+        """
+        Mark a job as failed when the wrapped work raises, a task being
+        retried is still running so it is left alone.
+
+        :param kind: Kind of job
+        :type kind: str
+        :param job_id: Job id
+        :type job_id: str
+        """
+        try:
+            yield
+        except Retry:
+            raise
+        except Exception as e:
+            BulkProgress.fail(kind, job_id, f"{type(e).__name__}: {e}")
+            raise
+
+    @classmethod
+    def latest(cls, kind):
+        """
+        Progress of the latest job of a kind.
+
+        :param kind: Kind of job
+        :type kind: str
+        :return: dict or None
+        """
+        try:
+            job_id = redis.get(BulkProgress.key(kind, "latest"))
+
+            if job_id is None:
+                return None
+
+            progress = redis.hgetall(BulkProgress.key(kind, job_id.decode("utf-8")))
+        except RedisError as e:
+            current_app.logger.warning(f"Bulk progress unavailable: {e}")
+            return None
+
+        if not progress:
+            return None
+
+        progress = {k.decode("utf-8"): v.decode("utf-8") for k, v in progress.items()}
+
+        for field in ("total", "done", "failed"):
+            progress[field] = int(progress[field])
+
+        progress["percent"] = (
+            round((progress["done"] + progress["failed"]) * 100 / progress["total"])
+            if progress["total"]
+            else 100
+        )
+
+        return progress
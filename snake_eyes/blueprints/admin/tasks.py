@@ -0,0 +1,12 @@
+from snake_eyes.app import celery
+from snake_eyes.blueprints.admin.models import Dashboard
+
+
+@celery.task()
+def refresh_dashboard_stats():
+    """
+    Recompute the admin dashboard statistics.
+
+    :return: int
+    """
+    return Dashboard.refresh()
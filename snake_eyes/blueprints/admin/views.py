@@ -1,4 +1,5 @@
 from flask import Blueprint
+from flask import current_app
 from flask import flash
 from flask import redirect
 from flask import render_template
@@ -6,15 +7,19 @@ from flask import request
 from flask import url_for
 from flask_login import current_user
 from flask_login import login_required
+from redis.exceptions import RedisError
 from sqlalchemy import text
 
 from snake_eyes.blueprints.admin.forms import BulkDeleteForm
 from snake_eyes.blueprints.admin.forms import CouponForm
+from snake_eyes.blueprints.admin.forms import CouponGenerateForm
 from snake_eyes.blueprints.admin.forms import SearchForm
 from snake_eyes.blueprints.admin.forms import UserCancelSubscriptionForm
 from snake_eyes.blueprints.admin.forms import UserForm
 from snake_eyes.blueprints.admin.models import Dashboard
+from snake_eyes.blueprints.admin.progress import BulkProgress
 from snake_eyes.blueprints.billing.decorators import handle_stripe_exceptions
+from snake_eyes.blueprints.billing.gateways.breaker import stripe_breaker
 from snake_eyes.blueprints.billing.models.coupon import Coupon
 from snake_eyes.blueprints.billing.models.invoice import Invoice
 from snake_eyes.blueprints.billing.models.subscription import Subscription
@@ -35,18 +40,72 @@ def before_request():
     pass
 
 
+def paginate(model, query, sort_by, page, *order_by, prefix=()):
+    """
+    Paginate an admin list, the default created_on ordering uses keyset
+    pagination while other sort columns fall back to page numbers.
+    Searches without an explicit sort are ranked by similarity.
+
+    :param model: Model being listed
+    :type model: SQLAlchemy model
+    :param query: Filtered query
+    :type query: SQLAlchemy query
+    :param sort_by: Sort field and direction
+    :type sort_by: tuple
+    :param page: Page number for the fallback
+    :type page: int
+    :param order_by: Ordering for the fallback
+    :param prefix: Expressions grouping the rows ahead of created_on
+    :type prefix: tuple
+    :return: KeysetPagination or Pagination
+    """
+    field, direction = sort_by
+    search_query = request.args.get("q", "")
+
+    if search_query and "sort" not in request.args:
+        order_by = (model.search_rank(search_query),)
+    elif field == "created_on":
+        return model.seek(
+            query,
+            cursor=request.args.get("cursor"),
+            direction=direction,
+            prefix=prefix,
+        )
+
+    return query.order_by(*order_by).paginate(page, 50, True)
+
+
 @bp.route("")
 def dashboard():
+    refreshed_on = Dashboard.refreshed_on()
+    stale = Dashboard.is_stale(
+        refreshed_on, current_app.config["DASHBOARD_STATS_MAX_AGE"]
+    )
+
+    # The page never aggregates inline, a stale snapshot is served with a
+    # marker while a refresh runs in the background.
+    if stale:
+        Dashboard.queue_refresh(current_app.config["DASHBOARD_REFRESH_QUEUE_INTERVAL"])
+
     group_and_count_coupons = Dashboard.group_and_count_coupons()
     group_and_count_payouts = Dashboard.group_and_count_payouts()
     group_and_count_plans = Dashboard.group_and_count_plans()
     group_and_count_users = Dashboard.group_and_count_users()
+
+    try:
+        gateway = stripe_breaker.stats()
+    except RedisError:
+        gateway = None
+
     return render_template(
         "admin/page/dashboard.html",
         group_and_count_coupons=group_and_count_coupons,
         group_and_count_plans=group_and_count_plans,
         group_and_count_users=group_and_count_users,
         group_and_count_payouts=group_and_count_payouts,
+        gateway=gateway,
+        refreshed_on=refreshed_on,
+        stale=stale,
     )
 
 
@@ -62,10 +121,15 @@ def users(page):
     )
     order_values = f"{sort_by[0]} {sort_by[1]}"
 
-    paginated_users = (
-        User.query.filter(User.search(request.args.get("q", "")))
-        .order_by(User.role.asc(), User.payment_id, text(order_values))
-        .paginate(page, 50, True)
+    paginated_users = paginate(
+        User,
+        User.with_billing().filter(User.search(request.args.get("q", ""))),
+        sort_by,
+        page,
+        User.role.asc(),
+        User.payment_id,
+        text(order_values),
+        prefix=(User.role, User.payment_id.is_(None)),
     )
 
     return render_template(
@@ -73,6 +137,7 @@ def users(page):
         form=search_form,
         bulk_form=bulk_form,
         users=paginated_users,
+        progress=BulkProgress.latest("delete_users"),
     )
 
 
@@ -92,7 +157,11 @@ def users_bulk_delete():
 
         delete_users.delay(ids)
 
-        flash(f"{len(ids)} users(s) were scheduled for deletion", "success")
+        flash(
+            f"{len(ids)} users(s) were scheduled for deletion, "
+            f"the progress is shown below",
+            "success",
+        )
     else:
         flash("No users were deleted", "error")
 
@@ -101,7 +170,7 @@ def users_bulk_delete():
 
 @bp.route("/users/edit/<int:id>", methods=["GET", "POST"])
 def users_edit(id):
-    user = User.query.get(id)
+    user = User.with_billing().get(id)
     form = UserForm(obj=user)
 
     coupon = (
@@ -140,7 +209,7 @@ def users_cancel_subscription():
     form = UserCancelSubscriptionForm()
 
     if form.validate_on_submit():
-        user = User.query.get(request.form.get("id"))
+        user = User.with_billing().get(request.form.get("id"))
 
         if user:
             subscription = Subscription()
@@ -164,10 +233,12 @@ def coupons(page):
     )
     order_values = f"{sort_by[0]} {sort_by[1]}"
 
-    paginated_coupons = (
-        Coupon.query.filter(Coupon.search(request.args.get("q", "")))
-        .order_by(text(order_values))
-        .paginate(page, 50, True)
+    paginated_coupons = paginate(
+        Coupon,
+        Coupon.query.filter(Coupon.search(request.args.get("q", ""))),
+        sort_by,
+        page,
+        text(order_values),
     )
 
     return render_template(
@@ -175,6 +246,8 @@ def coupons(page):
         form=search_form,
         bulk_form=bulk_form,
         coupons=paginated_coupons,
+        progress=BulkProgress.latest("delete_coupons"),
+        generate_progress=BulkProgress.latest("generate_coupons"),
     )
 
 
@@ -204,6 +277,35 @@ def coupons_new():
     return render_template("admin/coupon/new.html", form=form, coupon=coupon)
 
 
+@bp.route("/coupons/generate", methods=["GET", "POST"])
+def coupons_generate():
+    form = CouponGenerateForm()
+
+    if form.validate_on_submit():
+        params = {
+            "duration": form.duration.data,
+            "percent_off": form.percent_off.data,
+            "amount_off": form.amount_off.data,
+            "currency": form.currency.data,
+            "redeem_by": form.redeem_by.data and form.redeem_by.data.isoformat(),
+            "max_redemptions": form.max_redemptions.data,
+            "duration_in_months": form.duration_in_months.data,
+        }
+
+        from snake_eyes.blueprints.billing.tasks import generate_coupons
+
+        generate_coupons.delay(form.count.data, params)
+
+        flash(
+            f"{form.count.data} coupons(s) were scheduled to be generated, "
+            f"the progress is shown below",
+            "success",
+        )
+        return redirect(url_for("admin.coupons"))
+
+    return render_template("admin/coupon/generate.html", form=form)
+
+
 @bp.route("/coupons/bulk_delete", methods=["POST"])
 def coupons_bulk_delete():
     form = BulkDeleteForm()
@@ -218,7 +320,11 @@ def coupons_bulk_delete():
         from snake_eyes.blueprints.billing.tasks import delete_coupons
 
         delete_coupons.delay(ids)
-        flash(f"{len(ids)} coupons(s) were scheduled to be deleted", "success")
+        flash(
+            f"{len(ids)} coupons(s) were scheduled to be deleted, "
+            f"the progress is shown below",
+            "success",
+        )
     else:
         flash("No coupons were deleted, something went wrong", "error")
 
@@ -233,10 +339,12 @@ def invoices(page):
         request.args.get("sort", "created_on"), request.args.get("direction", "desc")
     )
     order_values = f"invoices.{sort_by[0]} {sort_by[1]}"
-    paginated_invoices = (
-        Invoice.query.filter(Invoice.search(request.args.get("q", "")))
-        .order_by(text(order_values))
-        .paginate(page, 50, True)
+    paginated_invoices = paginate(
+        Invoice,
+        Invoice.query_with_users().filter(Invoice.search(request.args.get("q", ""))),
+        sort_by,
+        page,
+        text(order_values),
     )
 
     return render_template(
@@ -1,4 +1,7 @@
 from flask_wtf import Form
+from wtforms import FieldList
+from wtforms import Form as BaseForm
+from wtforms import FormField
 from wtforms import IntegerField
 from wtforms.validators import DataRequired
 from wtforms.validators import NumberRange
@@ -7,3 +10,18 @@ from wtforms.validators import NumberRange
 class BetForm(Form):
     guess = IntegerField("Guess", [DataRequired(), NumberRange(min=2, max=12)])
     wagered = IntegerField("Wagered", [DataRequired(), NumberRange(min=1)])
+
+
+class BetEntryForm(BaseForm):
+    """
+    A single bet inside of a batch, CSRF is handled by the parent form
+    """
+
+    guess = IntegerField("Guess", [DataRequired(), NumberRange(min=2, max=12)])
+    wagered = IntegerField("Wagered", [DataRequired(), NumberRange(min=1)])
+
+
+class BetBatchForm(Form):
+    MAX_BETS = 50
+
+    bets = FieldList(FormField(BetEntryForm), min_entries=1, max_entries=MAX_BETS)
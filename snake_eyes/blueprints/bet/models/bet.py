@@ -1,3 +1,6 @@
+from sqlalchemy import text
+from sqlalchemy.orm.attributes import set_committed_value
+
 from lib.src.util_datetime import tz_aware_datetime
 from lib.src.util_sqlalchemy import ResourceMixin
 from snake_eyes.extensions import db
@@ -5,6 +8,35 @@ from snake_eyes.extensions import db
 
 class Bet(ResourceMixin, db.Model):
     __tablename__ = "bets"
+    __table_args__ = (
+        db.Index("ix_bets_user_id_created_on_id", "user_id", "created_on", "id"),
+    )
+
+    # Debit or credit the user and record the bet in a single statement.
+    # The user row is only updated when they can cover the wager, in which
+    # case the bet is inserted from the CTE, otherwise nothing is written.
+    SETTLE_STATEMENT = text(
+        """
+        WITH settled_user AS (
+            UPDATE users
+            SET coins = coins + :net, last_bet_on = :now, updated_on = :now
+            WHERE id = :user_id AND coins >= :wagered
+            RETURNING id, coins, last_bet_on
+        )
+        INSERT INTO bets (
+            created_on, updated_on, user_id, guess, dice_1, dice_2, roll,
+            wagered, payout, net
+        )
+        SELECT
+            :now, :now, settled_user.id, :guess, :dice_1, :dice_2, :roll,
+            :wagered, :payout, :net
+        FROM settled_user
+        RETURNING
+            bets.id,
+            (SELECT coins FROM settled_user) AS coins,
+            (SELECT last_bet_on FROM settled_user) AS last_bet_on
+        """
+    )
     id = db.Column(db.Integer, primary_key=True)
 
     # Relationships
@@ -24,9 +56,136 @@ class Bet(ResourceMixin, db.Model):
     payout = db.Column(db.Float())
     net = db.Column(db.BigInteger())
 
+    # Same as above for a batch of bets, the user is only updated when they
+    # can cover the total wager and every bet shares a single net delta.
+    SETTLE_BATCH_STATEMENT = text(
+        """
+        WITH settled_user AS (
+            UPDATE users
+            SET coins = coins + :net, last_bet_on = :now, updated_on = :now
+            WHERE id = :user_id AND coins >= :wagered
+            RETURNING id, coins, last_bet_on
+        ), inserted_bets AS (
+            INSERT INTO bets (
+                created_on, updated_on, user_id, guess, dice_1, dice_2, roll,
+                wagered, payout, net
+            )
+            SELECT
+                :now, :now, settled_user.id, batch.guess, batch.dice_1,
+                batch.dice_2, batch.roll, batch.wagered, batch.payout, batch.net
+            FROM settled_user, unnest(
+                CAST(:guesses AS integer[]),
+                CAST(:dice_1s AS integer[]),
+                CAST(:dice_2s AS integer[]),
+                CAST(:rolls AS integer[]),
+                CAST(:wagers AS bigint[]),
+                CAST(:payouts AS double precision[]),
+                CAST(:nets AS bigint[])
+            ) AS batch(guess, dice_1, dice_2, roll, wagered, payout, net)
+            RETURNING bets.id
+        )
+        SELECT
+            coins,
+            last_bet_on,
+            (SELECT count(*) FROM inserted_bets) AS bet_count
+        FROM settled_user
+        """
+    )
+
     def __init__(self, **kwargs):
         super(Bet, self).__init__(**kwargs)
 
+    @classmethod
+    def from_wagers(cls, user_id, wagers, payouts, dice_1s, dice_2s):
+        """
+        Build a batch of bets from guesses, wagers and already rolled dice.
+
+        :param user_id: User placing the bets
+        :type user_id: int
+        :param wagers: (guess, wagered) pairs
+        :type wagers: list
+        :param payouts: Payout multiplier for each guess
+        :type payouts: dict
+        :param dice_1s: First dice of every roll
+        :type dice_1s: list
+        :param dice_2s: Second dice of every roll
+        :type dice_2s: list
+        :return: list
+        """
+        outcomes = [dice_1 + dice_2 for dice_1, dice_2 in zip(dice_1s, dice_2s)]
+        winners = [
+            Bet.is_winner(guess, outcome)
+            for (guess, _), outcome in zip(wagers, outcomes)
+        ]
+        multipliers = [
+            Bet.determine_payout(float(payouts[str(guess)]), is_winner)
+            for (guess, _), is_winner in zip(wagers, winners)
+        ]
+        nets = [
+            Bet.calculate_net(wagered, payout, is_winner)
+            for (_, wagered), payout, is_winner in zip(wagers, multipliers, winners)
+        ]
+
+        return [
+            Bet(
+                user_id=user_id,
+                guess=guess,
+                dice_1=dice_1,
+                dice_2=dice_2,
+                roll=outcome,
+                wagered=wagered,
+                payout=payout,
+                net=net,
+            )
+            for (guess, wagered), dice_1, dice_2, outcome, payout, net in zip(
+                wagers, dice_1s, dice_2s, outcomes, multipliers, nets
+            )
+        ]
+
+    @classmethod
+    def bulk_save_and_update_user(cls, bets, user):
+        """
+        Commit a batch of bets and apply their combined net to the user
+        in one transaction.
+
+        :param bets: Bets to be saved
+        :type bets: list
+        :param user: User placing the bets
+        :type user: User instance
+        :return: User instance or None if the wagers were rejected
+        """
+        now = tz_aware_datetime()
+        params = {
+            "now": now,
+            "user_id": user.id,
+            "wagered": sum(bet.wagered for bet in bets),
+            "net": sum(bet.net for bet in bets),
+            "guesses": [bet.guess for bet in bets],
+            "dice_1s": [bet.dice_1 for bet in bets],
+            "dice_2s": [bet.dice_2 for bet in bets],
+            "rolls": [bet.roll for bet in bets],
+            "wagers": [bet.wagered for bet in bets],
+            "payouts": [bet.payout for bet in bets],
+            "nets": [bet.net for bet in bets],
+        }
+
+        result = db.session.execute(Bet.SETTLE_BATCH_STATEMENT, params).first()
+        db.session.commit()
+
+        if result is None:
+            return None
+
+        Bet.invalidate_user(user.id)
+
+        for bet in bets:
+            bet.created_on = now
+            bet.updated_on = now
+
+        set_committed_value(user, "coins", result.coins)
+        set_committed_value(user, "last_bet_on", result.last_bet_on)
+
+        return user
+
     @classmethod
     def is_winner(cls, guess, roll):
         """
@@ -68,18 +227,60 @@ class Bet(ResourceMixin, db.Model):
         """
         return int(wagered * payout) if is_winner else -wagered
 
+    @classmethod
+    def invalidate_user(cls, user_id):
+        """
+        The settlement statements write coins outside of the ORM,
+        so the cached user has to be dropped by hand.
+
+        :param user_id: ID of the user
+        :type user_id: int
+        """
+        from snake_eyes.blueprints.user.cache import UserCache
+
+        UserCache.invalidate(user_id)
+
     def save_and_update_user(self, user):
         """
-        Commit the bet and update the user's information.
+        Commit the bet and update the user's coins in one transaction.
 
-        :return: SQLAlchemy save result
+        The wager is rejected by the database when the user's current balance
+        can not cover it, so concurrent bets can not overdraw the account.
+
+        :param user: User placing the bet
+        :type user: User instance
+        :return: User instance or None if the wager was rejected
         """
-        self.save()
+        now = tz_aware_datetime()
+        params = {
+            "now": now,
+            "user_id": user.id,
+            "guess": self.guess,
+            "dice_1": self.dice_1,
+            "dice_2": self.dice_2,
+            "roll": self.roll,
+            "wagered": self.wagered,
+            "payout": self.payout,
+            "net": self.net,
+        }
+
+        result = db.session.execute(Bet.SETTLE_STATEMENT, params).first()
+        db.session.commit()
+
+        if result is None:
+            return None
+
+        Bet.invalidate_user(user.id)
+
+        self.id = result.id
+        self.user_id = user.id
+        self.created_on = now
+        self.updated_on = now
 
-        user.coins += self.net
-        user.last_bet_on = tz_aware_datetime()
+        set_committed_value(user, "coins", result.coins)
+        set_committed_value(user, "last_bet_on", result.last_bet_on)
 
-        return user.save()
+        return user
 
     def to_json(self):
         """
@@ -8,3 +8,14 @@ def roll():
     :return: int
     """
     return randint(1, 6)
+
+
+def roll_many(count):
+    """
+    Randomly roll a dice several times
+
+    :param count: Number of rolls
+    :type count: int
+    :return: list
+    """
+    return [roll() for _ in range(count)]
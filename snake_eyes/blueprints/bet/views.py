@@ -4,15 +4,35 @@ from flask import render_template
 from flask import request
 from flask_login import current_user
 from flask_login import login_required
+from limits import parse as parse_limit
 
 from lib.src.util_json import render_json
 from snake_eyes.blueprints.bet.decorators import coins_required
+from snake_eyes.blueprints.bet.forms import BetBatchForm
 from snake_eyes.blueprints.bet.forms import BetForm
 from snake_eyes.blueprints.bet.models.bet import Bet
 from snake_eyes.blueprints.bet.models.dice import roll
+from snake_eyes.blueprints.bet.models.dice import roll_many
 from snake_eyes.extensions import limiter
 
 
+# Adds the bets of a batch to the fixed window of the limit, only when they
+# all fit in it.
+BATCH_LIMIT_SCRIPT = """
+local hits = tonumber(ARGV[1])
+
+if tonumber(redis.call('GET', KEYS[1]) or 0) + hits > tonumber(ARGV[2]) then
+    return 0
+end
+
+if redis.call('INCRBY', KEYS[1], hits) == hits then
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+end
+
+return 1
+"""
+
+
 bp = Blueprint("bet", __name__, template_folder="templates", url_prefix="/bet")
 
 
@@ -69,20 +89,79 @@ def place_bet():
 
         bet = Bet(**params)
 
-        bet.save_and_update_user(current_user)
+        if bet.save_and_update_user(current_user._get_current_object()) is None:
+            error = "You cannot wager more than your total coins"
+            return render_json(400, {"error": error})
 
         return render_json(200, {"data": bet.to_json()})
 
     return render_json(400, {"error": "You need to wager at least 1 coin"})
 
 
-@bp.route("/history", defaults={"page": 1})
-@bp.route("/history/page/<int:page>")
-def history(page):
-    paginated_bets = (
-        Bet.query.filter(Bet.user_id == current_user.id)
-        .order_by(Bet.created_on.desc())
-        .paginate(page, 50, True)
+@bp.route("/place_batch", methods=["POST"])
+@coins_required
+def place_batch():
+    form = BetBatchForm()
+
+    if form.validate_on_submit():
+        wagers = [(entry.guess.data, entry.wagered.data) for entry in form.bets]
+
+        if not hit_batch_limit(len(wagers)):
+            return render_json(429, {"error": "You have been temporarily rate limited"})
+
+        if sum(wagered for _, wagered in wagers) > current_user.coins:
+            error = "You cannot wager more than your total coins"
+            return render_json(400, {"error": error})
+
+        bets = Bet.from_wagers(
+            current_user.id,
+            wagers,
+            current_app.config["DICE_ROLL_PAYOUT"],
+            roll_many(len(wagers)),
+            roll_many(len(wagers)),
+        )
+
+        user = current_user._get_current_object()
+
+        if Bet.bulk_save_and_update_user(bets, user) is None:
+            error = "You cannot wager more than your total coins"
+            return render_json(400, {"error": error})
+
+        return render_json(200, {"data": [bet.to_json() for bet in bets]})
+
+    error = f"Place between 1 and {BetBatchForm.MAX_BETS} bets of at least 1 coin"
+    return render_json(400, {"error": error})
+
+
+def hit_batch_limit(count):
+    """
+    Count every bet in a batch against the user's batch rate limit, in a
+    single round trip. A batch that does not fit in what is left of the
+    limit is rejected without using any of it.
+
+    The script runs on the limiter's own Redis client, so the batch is
+    counted in the same store as the limits Flask-Limiter checks.
+
+    :param count: Number of bets in the batch
+    :type count: int
+    :return: bool
+    """
+    limit = parse_limit(current_app.config["BET_BATCH_RATE_LIMIT"])
+    key = limit.key_for(request.endpoint, str(current_user.id))
+    storage = limiter._storage.storage
+
+    return bool(
+        storage.eval(
+            BATCH_LIMIT_SCRIPT, 1, key, count, limit.amount, limit.get_expiry()
+        )
+    )
+
+
+@bp.route("/history")
+def history():
+    paginated_bets = Bet.seek(
+        Bet.query.filter(Bet.user_id == current_user.id),
+        cursor=request.args.get("cursor"),
     )
 
     return render_template("bet/history.html", bets=paginated_bets)
@@ -0,0 +1,205 @@
+from pickle import dumps
+from pickle import loads
+
+from flask import current_app
+from flask_sqlalchemy import SignallingSession
+from redis.exceptions import RedisError
+from sqlalchemy import event
+
+from lib.src.util_datetime import tz_aware_datetime
+from snake_eyes.blueprints.billing.models.coupon import Coupon
+from snake_eyes.blueprints.billing.models.invoice import Invoice
+from snake_eyes.extensions import redis
+
+
+class UpcomingInvoiceCache:
+    """
+    Cache of a customer's parsed upcoming invoice, so browsing billing
+    details does not call Stripe on every page view.
+    """
+
+    @classmethod
+    def key(cls, customer_id):
+        """
+        Cache key of a customer's upcoming invoice
+
+        :param customer_id: Stripe customer id
+        :type customer_id: str
+        :return: str
+        """
+        return f"upcoming_invoice:{customer_id}"
+
+    @classmethod
+    def get(cls, customer_id):
+        """
+        Return the upcoming invoice of a customer, from the cache when
+        possible, otherwise from Stripe.
+
+        :param customer_id: Stripe customer id
+        :type customer_id: str
+        :return: dict
+        """
+        ttl = current_app.config["UPCOMING_INVOICE_CACHE_TTL"]
+        key = UpcomingInvoiceCache.key(customer_id)
+
+        if ttl:
+            try:
+                cached = redis.get(key)
+
+                if cached is not None:
+                    return loads(cached)
+            except RedisError as e:
+                current_app.logger.warning(f"Upcoming invoice cache unavailable: {e}")
+
+        upcoming = Invoice.upcoming(customer_id)
+
+        if ttl:
+            try:
+                redis.setex(key, ttl, dumps(upcoming))
+            except RedisError as e:
+                current_app.logger.warning(f"Upcoming invoice cache unavailable: {e}")
+
+        return upcoming
+
+    @classmethod
+    def invalidate(cls, *customer_ids):
+        """
+        Drop the upcoming invoice of one or more customers.
+
+        :param customer_ids: Stripe customer ids
+        :type customer_ids: str
+        """
+        keys = [UpcomingInvoiceCache.key(c) for c in customer_ids if c is not None]
+
+        if not keys:
+            return
+
+        try:
+            redis.delete(*keys)
+        except RedisError as e:
+            current_app.logger.warning(f"Upcoming invoice cache unavailable: {e}")
+
+
+class CouponCache:
+    """
+    Cache of coupon lookups by code, unknown codes are cached for a
+    shorter while so codes being typed in do not reach the db either.
+
+    Every invalidation bumps the version of the code, a lookup only caches
+    what it read when the version did not change in the meantime.
+    """
+
+    MISSING = "missing"
+    PENDING_KEY = "coupon_cache_invalidations"
+    # Seconds the version of a code is kept, well past any lookup
+    VERSION_TTL = 86400
+
+    @classmethod
+    def key(cls, code):
+        """
+        Cache key of a coupon code
+
+        :param code: Coupon code
+        :type code: str
+        :return: str
+        """
+        return f"coupon:{code.upper()}"
+
+    @classmethod
+    def version_key(cls, code):
+        """
+        Key of the version of a coupon code, bumped on invalidation
+
+        :param code: Coupon code
+        :type code: str
+        :return: str
+        """
+        return f"coupon:{code.upper()}:version"
+
+    @classmethod
+    def lookup(cls, code):
+        """
+        Return the JSON representation of a redeemable coupon, from the
+        cache when possible, otherwise from the db.
+
+        :param code: Coupon code
+        :type code: str
+        :return: dict or None
+        """
+        ttl = current_app.config["COUPON_CACHE_TTL"]
+        key = CouponCache.key(code)
+        version_key = CouponCache.version_key(code)
+        version = None
+
+        if ttl:
+            try:
+                cached, version = redis.get_with_version(key, version_key)
+
+                if cached is not None:
+                    cached = loads(cached)
+
+                    if cached == CouponCache.MISSING:
+                        return None
+
+                    # The redeem window is checked on every hit, a coupon
+                    # past its date stops being offered right away.
+                    redeem_by = cached["redeem_by"]
+
+                    if redeem_by is None or redeem_by >= tz_aware_datetime():
+                        return cached["data"]
+
+                    return None
+            except RedisError as e:
+                current_app.logger.warning(f"Coupon cache unavailable: {e}")
+
+        coupon = Coupon.find_by_code(code)
+
+        if version is not None:
+            if coupon is None:
+                cached = CouponCache.MISSING
+                ttl = current_app.config["COUPON_CACHE_MISSING_TTL"]
+            else:
+                cached = {"data": coupon.to_json(), "redeem_by": coupon.redeem_by}
+
+            try:
+                redis.setex_if_version(key, version_key, version, ttl, dumps(cached))
+            except RedisError as e:
+                current_app.logger.warning(f"Coupon cache unavailable: {e}")
+
+        return None if coupon is None else coupon.to_json()
+
+    @classmethod
+    def invalidate(cls, *codes):
+        """
+        Drop one or more coupon codes from the cache.
+
+        :param codes: Coupon codes
+        :type codes: str
+        """
+        if not codes:
+            return
+
+        keys = [
+            (CouponCache.key(code), CouponCache.version_key(code)) for code in codes
+        ]
+
+        try:
+            redis.invalidate_versioned(keys, CouponCache.VERSION_TTL)
+        except RedisError as e:
+            current_app.logger.warning(f"Coupon cache unavailable: {e}")
+
+
+@event.listens_for(SignallingSession, "after_commit")
+def invalidate_coupon_changes(session):
+    """
+    Drop the coupons redeemed in the transaction once it is committed
+    """
+    CouponCache.invalidate(*session.info.pop(CouponCache.PENDING_KEY, ()))
+
+
+@event.listens_for(SignallingSession, "after_soft_rollback")
+def discard_coupon_changes(session, previous_transaction):
+    """
+    Nothing was written, keep the cache as is
+    """
+    session.info.pop(CouponCache.PENDING_KEY, None)
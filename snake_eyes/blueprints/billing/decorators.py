@@ -10,10 +10,14 @@ from stripe.error import CardError
 from stripe.error import InvalidRequestError
 from stripe.error import StripeError
 
+from snake_eyes.blueprints.billing.gateways.breaker import CircuitOpenError
+from snake_eyes.blueprints.billing.models.coupon import CouponRedemptionError
+
 
 def handle_stripe_exceptions(function):
     """
-    Handle Stripe exceptions so they do not throw 500s.
+    Handle Stripe exceptions and coupons that can no longer be redeemed so
+    they do not throw 500s.
 
     :param function: Function to decorate
     :type function: Function
@@ -24,6 +28,9 @@ def handle_stripe_exceptions(function):
     def decorated_function(*args, **kwargs):
         try:
             return function(*args, **kwargs)
+        except CouponRedemptionError:
+            flash("Sorry, this coupon is no longer valid", "error")
+            return redirect(url_for("user.settings"))
         except CardError:
             flash("Sorry, the card was declined. Try again perhaps?", "error")
             return redirect(url_for("user.settings"))
@@ -33,6 +40,9 @@ def handle_stripe_exceptions(function):
         except AuthenticationError:
             flash("Authentication with our payment gateway failed", "error")
             return redirect(url_for("user.settings"))
+        except CircuitOpenError:
+            flash("Our payment gateway is unavailable, try again shortly", "error")
+            return redirect(url_for("user.settings"))
         except APIConnectionError:
             flash("Our payment gateway is having connectivity issues", "error")
             return redirect(url_for("user.settings"))
@@ -0,0 +1,164 @@
+import logging
+
+from redis.exceptions import RedisError
+from stripe.error import APIConnectionError
+
+from snake_eyes.extensions import redis
+
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(APIConnectionError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker whose state lives in Redis so every worker process
+    stops calling a failing service at once.
+
+    Closed: calls go through, failures are counted over a sliding window.
+    Open: calls fail fast for the recovery timeout once too many failed.
+    Half open: a single call probes the service, its outcome closes or
+    re-opens the circuit while the other calls keep failing fast.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, redis_client, app=None):
+        self.name = name
+        self.redis = redis_client
+        self.failure_threshold = 5
+        self.window = 60
+        self.recovery_timeout = 30
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Read the thresholds from the app's config, prefixed by the name of
+        the breaker.
+
+        :param app: Flask application instance
+        """
+        prefix = self.name.upper()
+
+        self.failure_threshold = app.config[f"{prefix}_BREAKER_FAILURE_THRESHOLD"]
+        self.window = app.config[f"{prefix}_BREAKER_WINDOW"]
+        self.recovery_timeout = app.config[f"{prefix}_BREAKER_RECOVERY_TIMEOUT"]
+
+    def key(self, suffix):
+        return f"breaker:{self.name}:{suffix}"
+
+    def allow(self):
+        """
+        Check whether a call may go through.
+
+        :return: bool, True when the call is a half open probe
+        """
+        try:
+            is_open, is_tripped = self.redis.mget(self.key("open"), self.key("tripped"))
+
+            if is_open is None and is_tripped is None:
+                return False
+
+            if is_open is None and self.redis.set(
+                self.key("probe"), 1, nx=True, ex=self.recovery_timeout
+            ):
+                return True
+
+            self.redis.incr(self.key("rejected"))
+        except RedisError as e:
+            logger.warning(f"Circuit breaker {self.name} unavailable: {e}")
+            return False
+
+        raise CircuitOpenError(
+            f"{self.name} is unavailable, calls are suspended for a moment"
+        )
+
+    def record_success(self, probe=False):
+        """
+        Close the circuit after a successful probe.
+
+        :param probe: Whether the call was the half open probe
+        :type probe: bool
+        :return: None
+        """
+        if not probe:
+            return None
+
+        try:
+            self.redis.delete(
+                self.key("tripped"), self.key("probe"), self.key("failures")
+            )
+        except RedisError as e:
+            logger.warning(f"Circuit breaker {self.name} unavailable: {e}")
+
+        logger.info(f"Circuit breaker {self.name} closed")
+
+    def record_failure(self, probe=False):
+        """
+        Count a failure and open the circuit past the threshold or when
+        the half open probe failed.
+
+        :param probe: Whether the call was the half open probe
+        :type probe: bool
+        :return: None
+        """
+        try:
+            pipe = self.redis.pipeline()
+            pipe.incr(self.key("failures"))
+            pipe.expire(self.key("failures"), self.window)
+            failures, _ = pipe.execute()
+
+            if probe or failures >= self.failure_threshold:
+                pipe = self.redis.pipeline()
+                pipe.set(self.key("open"), 1, ex=self.recovery_timeout)
+                pipe.set(self.key("tripped"), 1)
+                pipe.incr(self.key("opened"))
+                pipe.delete(self.key("probe"), self.key("failures"))
+                pipe.execute()
+
+                logger.warning(f"Circuit breaker {self.name} opened")
+        except RedisError as e:
+            logger.warning(f"Circuit breaker {self.name} unavailable: {e}")
+
+    def state(self):
+        """
+        Current state of the circuit.
+
+        :return: str
+        """
+        is_open, is_tripped = self.redis.mget(self.key("open"), self.key("tripped"))
+
+        if is_open is not None:
+            return CircuitBreaker.OPEN
+
+        if is_tripped is not None:
+            return CircuitBreaker.HALF_OPEN
+
+        return CircuitBreaker.CLOSED
+
+    def stats(self):
+        """
+        State of the circuit along with its counters.
+
+        :return: dict
+        """
+        failures, opened, rejected = self.redis.mget(
+            self.key("failures"), self.key("opened"), self.key("rejected")
+        )
+
+        return {
+            "state": self.state(),
+            "failures": int(failures or 0),
+            "opened": int(opened or 0),
+            "rejected": int(rejected or 0),
+        }
+
+
+stripe_breaker = CircuitBreaker("stripe", redis)
@@ -1,3 +1,9 @@
+import hmac
+import json
+import time
+
+from hashlib import sha256
+
 from stripe import Charge as StripeCharge
 from stripe import Coupon as StripeCoupon
 from stripe import Customer as StripeCustomer
@@ -6,9 +12,12 @@ from stripe import Invoice as StripeInvoice
 from stripe import Plan as StripePlan
 from stripe.error import StripeError
 
+from snake_eyes.blueprints.billing.gateways.transport import timed
+
 
 class Coupon:
     @classmethod
+    @timed("coupon.create")
     def create(
         cls,
         code=None,
@@ -55,6 +64,7 @@ class Coupon:
         )
 
     @classmethod
+    @timed("coupon.delete")
     def delete(cls, _id=None):
         """
         Delete an existing coupon
@@ -71,6 +81,7 @@ class Coupon:
 
 class Invoice:
     @classmethod
+    @timed("invoice.upcoming")
     def upcoming(cls, customer_id):
         """
         Retrieve an upcoming invoice item for a user.
@@ -87,6 +98,7 @@ class Invoice:
 
 class Subscription:
     @classmethod
+    @timed("subscription.update")
     def update(cls, customer_id=None, coupon=None, plan=None):
         """
         Update an existing subscription.
@@ -115,6 +127,7 @@ class Subscription:
         return subscription.save()
 
     @classmethod
+    @timed("subscription.cancel")
     def cancel(cls, customer_id=None):
         """
         Cancel an existing subscription.
@@ -134,6 +147,7 @@ class Subscription:
 
 class Card:
     @classmethod
+    @timed("card.update")
     def update(cls, customer_id, stripe_token=None):
         """
         Update an existing card through a customer.
@@ -155,6 +169,7 @@ class Card:
 
 class Plan:
     @classmethod
+    @timed("plan.retrieve")
     def retrieve(cls, plan):
         """
         Retrieve an existing plan.
@@ -166,28 +181,25 @@ class Plan:
         :type plan: str
         :return: Stripe plan
         """
-        try:
-
-            return StripePlan.retrieve(plan)
-        except StripeError as e:
-            print(e)
+        return StripePlan.retrieve(plan)
 
     @classmethod
-    def list(cls):
+    @timed("plan.list")
+    def list(cls, limit=100):
         """
         List all plans.
 
         API Documentation:
           https://stripe.com/docs/api#list_plans
 
+        :param limit: Max number of plans to return
+        :type limit: int
         :return: Stripe plans
         """
-        try:
-            return StripePlan.all()
-        except StripeError as e:
-            print(e)
+        return StripePlan.all(limit=limit)
 
     @classmethod
+    @timed("plan.create")
     def create(
         cls,
         _id=None,
@@ -226,22 +238,20 @@ class Plan:
         :type statement_descriptor: str
         :return: Stripe plan
         """
-        try:
-            return StripePlan.create(
-                id=_id,
-                name=name,
-                amount=amount,
-                currency=currency,
-                interval=interval,
-                interval_count=interval_count,
-                trial_period_days=trial_period_days,
-                metadata=metadata,
-                statement_descriptor=statement_descriptor,
-            )
-        except StripeError as e:
-            print(e)
+        return StripePlan.create(
+            id=_id,
+            name=name,
+            amount=amount,
+            currency=currency,
+            interval=interval,
+            interval_count=interval_count,
+            trial_period_days=trial_period_days,
+            metadata=metadata,
+            statement_descriptor=statement_descriptor,
+        )
 
     @classmethod
+    @timed("plan.update")
     def update(cls, id=None, name=None, metadata=None, statement_descriptor=None):
         """
         Update an existing plan.
@@ -259,18 +269,16 @@ class Plan:
         :type statement_descriptor: str
         :return: Stripe plan
         """
-        try:
-            plan = StripePlan.retrieve(id)
+        plan = StripePlan.retrieve(id)
 
-            plan.name = name
-            plan.metadata = metadata
-            plan.statement_descriptor = statement_descriptor
+        plan.name = name
+        plan.metadata = metadata
+        plan.statement_descriptor = statement_descriptor
 
-            return plan.save()
-        except StripeError as e:
-            print(e)
+        return plan.save()
 
     @classmethod
+    @timed("plan.delete")
     def delete(cls, plan):
         """
         Delete an existing plan.
@@ -282,16 +290,14 @@ class Plan:
         :type plan: str
         :return: Stripe plan object
         """
-        try:
-            plan = StripePlan.retrieve(plan)
+        plan = StripePlan.retrieve(plan)
 
-            return plan.delete()
-        except StripeError as e:
-            print(e)
+        return plan.delete()
 
 
 class Event:
     @classmethod
+    @timed("event.retrieve")
     def retrieve(cls, event_id):
         """
         Retrieve an event, this is used to validate the event in attempt to
@@ -307,8 +313,104 @@ class Event:
         return StripeEvent.retrieve(event_id)
 
 
+class SignatureVerificationError(StripeError):
+    pass
+
+
+class Webhook:
+    SCHEME = "v1"
+
+    @classmethod
+    def compute_signature(cls, payload, secret, timestamp):
+        """
+        HMAC-SHA256 of a timestamped payload, as Stripe signs webhooks.
+
+        :param payload: Raw request body
+        :type payload: bytes
+        :param secret: Webhook endpoint signing secret
+        :type secret: str
+        :param timestamp: Unix time the payload was signed at
+        :type timestamp: int
+        :return: str
+        """
+        signed_payload = f"{timestamp}.".encode("utf-8") + payload
+
+        return hmac.new(secret.encode("utf-8"), signed_payload, sha256).hexdigest()
+
+    @classmethod
+    def sign(cls, payload, secret, timestamp=None):
+        """
+        Build a Stripe-Signature header for a payload, used to replay
+        signed events offline.
+
+        :param payload: Raw request body
+        :type payload: bytes
+        :param secret: Webhook endpoint signing secret
+        :type secret: str
+        :param timestamp: Unix time to sign at, defaults to now
+        :type timestamp: int
+        :return: str
+        """
+        if timestamp is None:
+            timestamp = int(time.time())
+
+        signature = Webhook.compute_signature(payload, secret, timestamp)
+
+        return f"t={timestamp},{Webhook.SCHEME}={signature}"
+
+    @classmethod
+    def construct_event(cls, payload, header, secret, tolerance):
+        """
+        Verify the signature of a webhook locally and return its event, this
+        protects us from events not sent by Stripe without an API call.
+
+        API Documentation:
+          https://stripe.com/docs/webhooks#signatures
+
+        :param payload: Raw request body
+        :type payload: bytes
+        :param header: Stripe-Signature header
+        :type header: str
+        :param secret: Webhook endpoint signing secret
+        :type secret: str
+        :param tolerance: Max age of the signature in seconds
+        :type tolerance: int
+        :return: dict
+        """
+        if not secret:
+            raise SignatureVerificationError("No webhook secret is configured")
+
+        timestamp = None
+        signatures = []
+
+        for item in (header or "").split(","):
+            key, _, value = item.strip().partition("=")
+
+            if key == "t":
+                timestamp = value
+            elif key == Webhook.SCHEME:
+                signatures.append(value)
+
+        if not timestamp or not timestamp.isdigit() or not signatures:
+            raise SignatureVerificationError("Unable to parse signature header")
+
+        if abs(time.time() - int(timestamp)) > tolerance:
+            raise SignatureVerificationError("Timestamp outside the tolerance")
+
+        expected = Webhook.compute_signature(payload, secret, int(timestamp))
+
+        if not any(hmac.compare_digest(expected, sig) for sig in signatures):
+            raise SignatureVerificationError("No signatures match the payload")
+
+        try:
+            return json.loads(payload.decode("utf-8"))
+        except ValueError:
+            raise SignatureVerificationError("Payload is not valid JSON")
+
+
 class Customer:
     @classmethod
+    @timed("customer.create")
     def create(cls, token=None, email=None, coupon=None, plan=None):
         """
         Create a new customer.
@@ -339,6 +441,7 @@ class Customer:
 
 class Charge:
     @classmethod
+    @timed("charge.create")
     def create(cls, customer_id=None, currency=None, amount=None):
         """
         Create a new charge.
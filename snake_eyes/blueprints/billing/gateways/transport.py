@@ -0,0 +1,243 @@
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+
+from functools import wraps
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from stripe import http_client
+from stripe.error import APIConnectionError
+from stripe.http_client import HTTPClient
+
+
+logger = logging.getLogger(__name__)
+
+
+class GatewayMetrics:
+    """
+    Latency and error counts of each gateway operation, kept per process
+    and logged as they are recorded.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._operations = {}
+
+    def observe(self, operation, duration, ok=True):
+        """
+        Record a call to a gateway operation.
+
+        :param operation: Name of the operation, for example customer.create
+        :type operation: str
+        :param duration: Seconds the call took
+        :type duration: float
+        :param ok: Whether the call succeeded
+        :type ok: bool
+        :return: None
+        """
+        with self._lock:
+            stats = self._operations.setdefault(
+                operation, {"count": 0, "errors": 0, "total": 0.0, "max": 0.0}
+            )
+            stats["count"] += 1
+            stats["errors"] += 0 if ok else 1
+            stats["total"] += duration
+            stats["max"] = max(stats["max"], duration)
+
+        logger.info(
+            f"gateway operation={operation} ok={ok} "
+            f"duration_ms={duration * 1000:.1f}"
+        )
+
+    def snapshot(self):
+        """
+        Current stats of every operation with their average latency.
+
+        :return: dict
+        """
+        with self._lock:
+            return {
+                operation: dict(stats, avg=stats["total"] / stats["count"])
+                for operation, stats in self._operations.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._operations.clear()
+
+
+metrics = GatewayMetrics()
+
+
+def timed(operation):
+    """
+    Record the latency of a gateway operation.
+
+    :param operation: Name of the operation
+    :type operation: str
+    :return: Function
+    """
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            start = time.perf_counter()
+            ok = False
+
+            try:
+                result = f(*args, **kwargs)
+                ok = True
+
+                return result
+            finally:
+                metrics.observe(operation, time.perf_counter() - start, ok)
+
+        return decorated_function
+
+    return decorator
+
+
+class PooledHTTPClient(HTTPClient):
+    """
+    HTTP client for the stripe library that keeps a pooled keep-alive
+    session per process, bounds every call with connect and read timeouts
+    and retries transient failures with jittered exponential backoff.
+    Calls fail fast while the circuit breaker is open.
+    """
+
+    name = "requests"
+
+    RETRY_STATUSES = (409, 429, 500, 502, 503, 504)
+
+    def __init__(
+        self,
+        connect_timeout=3.05,
+        read_timeout=10,
+        max_retries=2,
+        backoff=0.5,
+        deadline=15,
+        pool_size=10,
+        breaker=None,
+        verify_ssl_certs=True,
+    ):
+        super(PooledHTTPClient, self).__init__(verify_ssl_certs=verify_ssl_certs)
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.deadline = deadline
+        self.pool_size = pool_size
+        self.breaker = breaker
+
+        self._pid = None
+        self._session = None
+
+    @property
+    def session(self):
+        """
+        Session of the current process, a forked worker builds its own so
+        pooled sockets are never shared across processes.
+
+        :return: requests Session
+        """
+        if self._session is None or self._pid != os.getpid():
+            adapter = HTTPAdapter(
+                pool_connections=self.pool_size, pool_maxsize=self.pool_size
+            )
+
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+
+            self._session = session
+            self._pid = os.getpid()
+
+        return self._session
+
+    def request(self, method, url, headers, post_data=None):
+        """
+        Send a request on behalf of the stripe library.
+
+        POST requests get an idempotency key so that retrying one which
+        reached Stripe never applies it twice.
+
+        :param method: HTTP method
+        :type method: str
+        :param url: Stripe API url
+        :type url: str
+        :param headers: Request headers
+        :type headers: dict
+        :param post_data: Encoded request body
+        :type post_data: str
+        :return: Tuple of body, status code and headers
+        """
+        headers = dict(headers)
+
+        if method.lower() == "post":
+            headers.setdefault("Idempotency-Key", str(uuid.uuid4()))
+
+        verify = False
+
+        if self._verify_ssl_certs:
+            verify = os.path.join(
+                os.path.dirname(http_client.__file__), "data/ca-certificates.crt"
+            )
+
+        probe = self.breaker.allow() if self.breaker else False
+        started = time.monotonic()
+        attempt = 0
+
+        while True:
+            try:
+                result = self.session.request(
+                    method,
+                    url,
+                    headers=headers,
+                    data=post_data,
+                    timeout=self.timeout,
+                    verify=verify,
+                )
+                error = None
+            except (requests.exceptions.ConnectionError, requests.Timeout) as e:
+                result = None
+                error = e
+            except requests.exceptions.RequestException as e:
+                if self.breaker:
+                    self.breaker.record_failure(probe)
+
+                raise APIConnectionError(
+                    f"Unexpected error communicating with Stripe: {e}"
+                )
+
+            retryable = error is not None or result.status_code in self.RETRY_STATUSES
+
+            if not retryable or not self._should_retry(attempt, started):
+                break
+
+            self._sleep(attempt)
+            attempt += 1
+
+        if self.breaker:
+            if error is not None or result.status_code >= 500:
+                self.breaker.record_failure(probe)
+            else:
+                self.breaker.record_success(probe)
+
+        if error is not None:
+            raise APIConnectionError(
+                f"Could not connect to Stripe after {attempt + 1} attempt(s): {error}"
+            )
+
+        return result.content, result.status_code, result.headers
+
+    def _should_retry(self, attempt, started):
+        elapsed = time.monotonic() - started
+
+        return attempt < self.max_retries and elapsed < self.deadline
+
+    def _sleep(self, attempt):
+        time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
@@ -1,15 +1,30 @@
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+from contextlib import contextmanager
 from datetime import datetime
-from random import choice
+from datetime import timedelta
+from io import StringIO
+from secrets import token_bytes
 from string import ascii_uppercase
 from string import digits
 
+from flask import current_app
 from pytz import UTC
 from pytz import utc
 from sqlalchemy import and_
+from sqlalchemy import bindparam
+from sqlalchemy import case
 from sqlalchemy import or_
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.hybrid import hybrid_property
+from stripe.error import APIConnectionError
+from stripe.error import APIError
+from stripe.error import InvalidRequestError
+from stripe.error import StripeError
 
+from lib.src.util_datetime import tz_aware_datetime
 from lib.src.util_money import cents_to_dollars
 from lib.src.util_money import dollars_to_cents
 from lib.src.util_sqlalchemy import AwareDateTime
@@ -17,15 +32,52 @@ from lib.src.util_sqlalchemy import ResourceMixin
 from snake_eyes.blueprints.billing.gateways.stripecom import (
     Coupon as PaymentCoupon,
 )
+from snake_eyes.blueprints.billing.models.coupon_redemption_flush import (
+    CouponRedemptionFlush,
+)
 from snake_eyes.extensions import db
 
 
+CODE_CHARSET = "".join(c for c in digits + ascii_uppercase if c not in "BIOS01")
+CODE_LENGTH = 12
+# Bytes past the last multiple of the charset's size are rejected so every
+# character is equally likely.
+CODE_BYTES_LIMIT = 256 - 256 % len(CODE_CHARSET)
+CODE_TRANSLATION = bytes(ord(CODE_CHARSET[b % len(CODE_CHARSET)]) for b in range(256))
+CODE_REJECTED = bytes(range(CODE_BYTES_LIMIT, 256))
+
+
+class CouponRedemptionError(Exception):
+    """
+    The coupon expired or ran out of redemptions, nothing may be charged
+    with its discount.
+    """
+
+    pass
+
+
 class Coupon(ResourceMixin, db.Model):
     DURATION = OrderedDict(
         [("forever", "Forever"), ("once", "Once"), ("repeating", "Repeating")]
     )
 
     __tablename__ = "coupons"
+    __table_args__ = (
+        db.Index("ix_coupons_created_on_id", "created_on", "id"),
+        db.Index(
+            "ix_coupons_code_trgm",
+            "code",
+            postgresql_using="gin",
+            postgresql_ops={"code": "gin_trgm_ops"},
+        ),
+        db.Index(
+            "ix_coupons_redeem_by_valid",
+            "redeem_by",
+            postgresql_where=db.text("valid"),
+        ),
+    )
+
+    SEARCH_COLUMNS = ("code",)
 
     id = db.Column(db.Integer, primary_key=True)
 
@@ -69,44 +121,71 @@ class Coupon(ResourceMixin, db.Model):
         Create a human readable random coupon code
         :return: str
         """
-        charset = digits + ascii_uppercase
-        charset = charset.replace("B", "").replace("I", "")
-        charset = charset.replace("O", "").replace("S", "")
-        charset = charset.replace("0", "").replace("1", "")
-
-        samples = "".join(choice(charset) for _ in range(14))
-
-        return f"{samples[0:4]}-{samples[5:9]}-{samples[10:14]}"
+        return Coupon.random_coupon_codes(1)[0]
 
     @classmethod
-    def search(cls, query):
+    def random_coupon_codes(cls, count):
         """
-        Search a resource by 1 or more fields.
+        Create unique human readable random coupon codes, drawn in one go
+        from a cryptographically secure source.
 
-        :param query: Search query
-        :type query: str
-        :return: SQLAlchemy filter object
+        :param count: Number of codes
+        :type count: int
+        :return: list
         """
-        if query:
-            search_query = f"%{query}%"
-            return or_(Coupon.code.ilike(search_query))
+        codes = set()
+
+        while len(codes) < count:
+            # Random bytes are mapped to the charset by a translation table,
+            # the bytes that would bias the draw are dropped along the way.
+            needed = (count - len(codes)) * CODE_LENGTH
+            chars = token_bytes(needed + needed // 4).translate(
+                CODE_TRANSLATION, CODE_REJECTED
+            )
+
+            for start in range(0, len(chars) - CODE_LENGTH + 1, CODE_LENGTH):
+                end = start + CODE_LENGTH
+                code = chars[start:end].decode("ascii")
+                codes.add(f"{code[0:4]}-{code[4:8]}-{code[8:12]}")
 
-        return ""
+        return list(codes)[:count]
 
     @classmethod
-    def expire_old_coupons(cls, compare_datetime=datetime.now(utc)):
+    def expired(cls, compare_datetime):
         """
-        Invalidate expired coupons
+        Condition matching the valid coupons past their redeem by date. The
+        bare `valid` test matches the predicate of the partial index on
+        redeem_by, `valid IS true` would not be proven to imply it.
 
         :param compare_datetime: Time to compare at
-        :type compare_datetime: date
-        :return: SQLAlchemy commit object
+        :type compare_datetime: datetime
+        :return: SQLAlchemy filter
         """
-        Coupon.query.filter(Coupon.redeem_by <= compare_datetime).update(
-            {Coupon.valid: not Coupon.valid}
+        return and_(Coupon.redeem_by <= compare_datetime, Coupon.valid)
+
+    @classmethod
+    def expire_old_coupons(cls, compare_datetime=None, chunk_size=1000):
+        """
+        Invalidate expired coupons, coupons already invalid are left alone.
+
+        :param compare_datetime: Time to compare at, defaults to now
+        :type compare_datetime: datetime
+        :param chunk_size: Coupons updated per transaction
+        :type chunk_size: int
+        :return: dict with the coupons updated, the chunks and the seconds
+        """
+        if compare_datetime is None:
+            compare_datetime = tz_aware_datetime()
+
+        report = Coupon.update_in_chunks(
+            Coupon.expired(compare_datetime),
+            {"valid": False},
+            chunk_size=chunk_size,
+            returning=Coupon.code,
         )
+        Coupon.invalidate_codes(report.pop("returned"))
 
-        return db.session.commit()
+        return report
 
     @classmethod
     def create(cls, params):
@@ -142,32 +221,309 @@ class Coupon(ResourceMixin, db.Model):
         db.session.add(coupon)
         db.session.commit()
 
+        Coupon.invalidate_codes([coupon.code])
+
         return True
 
     @classmethod
-    def bulk_delete(cls, ids):
+    def generation_params(cls, params):
         """
-        Overriding the general bulk_delete method as we
-        also need to delete them one at a time while deleting
-        the from Stripe
+        Parameters shared by generated coupons, as stored locally and sent
+        to Stripe.
+
+        :param params: Parameters from the admin or the CLI, the amount off
+                       in dollars and the redeem date as an ISO string
+        :type params: dict
+        :return: dict
+        """
+        params = dict(params)
+
+        if params.get("amount_off"):
+            params["amount_off"] = dollars_to_cents(params["amount_off"])
+
+        if params.get("redeem_by"):
+            params["redeem_by"] = datetime.fromisoformat(params["redeem_by"])
+
+            if params["redeem_by"].tzinfo is None:
+                params["redeem_by"] = params["redeem_by"].replace(tzinfo=UTC)
+
+        return params
+
+    @classmethod
+    def insert_codes(cls, codes, params):
+        """
+        Insert coupons with COPY, codes already taken are skipped. The
+        coupons stay invalid until they exist on Stripe.
+
+        :param codes: Coupon codes
+        :type codes: list
+        :param params: Parameters from `generation_params`
+        :type params: dict
+        :return: list of (id, code) tuples of the inserted coupons
+        """
+        connection = db.session.connection()
+        connection.execute(
+            "CREATE TEMP TABLE coupon_codes (code varchar(128)) ON COMMIT DROP"
+        )
+
+        cursor = connection.connection.cursor()
+        cursor.copy_expert(
+            "COPY coupon_codes (code) FROM STDIN", StringIO("\n".join(codes))
+        )
+
+        inserted = connection.execute(
+            text(
+                """
+                INSERT INTO coupons (created_on, updated_on, code, duration,
+                                     amount_off, percent_off, currency,
+                                     duration_in_months, max_redemptions,
+                                     redeem_by, times_redeemed, valid)
+                SELECT now(), now(), code, CAST(:duration AS duration_types),
+                       :amount_off, :percent_off, :currency,
+                       :duration_in_months, :max_redemptions,
+                       :redeem_by, 0, false
+                FROM coupon_codes
+                ON CONFLICT (code) DO NOTHING
+                RETURNING id, code
+                """
+            ),
+            {
+                "duration": params.get("duration"),
+                "amount_off": params.get("amount_off"),
+                "percent_off": params.get("percent_off"),
+                "currency": params.get("currency"),
+                "duration_in_months": params.get("duration_in_months"),
+                "max_redemptions": params.get("max_redemptions"),
+                "redeem_by": params.get("redeem_by"),
+            },
+        ).fetchall()
+        db.session.commit()
+
+        return [(row.id, row.code) for row in inserted]
+
+    @classmethod
+    def insert_unique(cls, count, params, attempts=5):
+        """
+        Insert coupons with freshly generated codes, codes colliding with
+        existing ones are replaced by new ones.
+
+        :param count: Number of coupons
+        :type count: int
+        :param params: Parameters from `generation_params`
+        :type params: dict
+        :param attempts: Rounds of generation before giving up
+        :type attempts: int
+        :return: list of (id, code) tuples
+        """
+        coupons = []
+
+        for _ in range(attempts):
+            missing = count - len(coupons)
+
+            if not missing:
+                break
 
-        :param ids: List fo ids of coupons to be deleted
+            coupons += Coupon.insert_codes(Coupon.random_coupon_codes(missing), params)
+
+        return coupons
+
+    @classmethod
+    def unpushed(cls, ids):
+        """
+        Generated coupons not confirmed on Stripe yet, the ones past their
+        redeem by date are left alone.
+
+        :param ids: Ids of the generated coupons
+        :type ids: list
+        :return: list of (id, code) tuples
+        """
+        return (
+            db.session.query(Coupon.id, Coupon.code)
+            .filter(
+                Coupon.id.in_(ids),
+                ~Coupon.valid,
+                or_(
+                    Coupon.redeem_by.is_(None),
+                    Coupon.redeem_by > tz_aware_datetime(),
+                ),
+            )
+            .order_by(Coupon.id)
+            .all()
+        )
+
+    @classmethod
+    def push_batch(cls, coupons, params, workers=1):
+        """
+        Create coupons on Stripe concurrently. The ones created are made
+        valid, the ones Stripe refused are deleted.
+
+        A connection error or a Stripe outage leaves no way to tell whether
+        the coupon was created, those coupons stay invalid so they can be
+        pushed again, where Stripe answering that they exist means they
+        were created.
+
+        :param coupons: (id, code) tuples from `insert_codes`
+        :type coupons: list
+        :param params: Parameters from `generation_params`
+        :type params: dict
+        :param workers: How many creations run on Stripe at once
+        :type workers: int
+        :return: tuple of created and failed counts and the (id, code)
+                 tuples to push again
+        """
+        codes = dict(coupons)
+        created_ids, failed_ids, retry_ids = [], [], []
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(Coupon.create_remote, code, params): _id
+                for _id, code in coupons
+            }
+
+            for future in as_completed(futures):
+                coupon_id = futures[future]
+
+                try:
+                    future.result()
+                except (APIConnectionError, APIError) as e:
+                    current_app.logger.warning(
+                        f"Will retry coupon {codes[coupon_id]} on Stripe: {e}"
+                    )
+                    retry_ids.append(coupon_id)
+                    continue
+                except StripeError as e:
+                    current_app.logger.warning(
+                        f"Could not create coupon {codes[coupon_id]} on Stripe: {e}"
+                    )
+                    failed_ids.append(coupon_id)
+                    continue
+
+                created_ids.append(coupon_id)
+
+        if created_ids:
+            Coupon.query.filter(Coupon.id.in_(created_ids)).update(
+                {Coupon.valid: True}, synchronize_session=False
+            )
+
+        if failed_ids:
+            Coupon.query.filter(Coupon.id.in_(failed_ids)).delete(
+                synchronize_session=False
+            )
+
+        db.session.commit()
+
+        Coupon.invalidate_codes([codes[_id] for _id in created_ids])
+
+        return (
+            len(created_ids),
+            len(failed_ids),
+            [(_id, codes[_id]) for _id in retry_ids],
+        )
+
+    @classmethod
+    def create_remote(cls, code, params):
+        """
+        Create a coupon on Stripe, a coupon already there counts as created
+        since an earlier attempt may have gone through unanswered.
+
+        :param code: Coupon code
+        :type code: str
+        :param params: Parameters from `generation_params`
+        :type params: dict
+        :return: None
+        """
+        try:
+            PaymentCoupon.create(code=code, **params)
+        except InvalidRequestError as e:
+            error = (e.json_body or {}).get("error") or {}
+
+            if error.get("code") != "resource_already_exists":
+                raise
+
+    @classmethod
+    def bulk_delete(cls, ids, workers=1):
+        """
+        Override the general bulk delete method.
+        Coupons are deleted from Stripe before being deleted locally.
+
+        :param ids: List of ids of coupons to be deleted
         :type ids: list
+        :param workers: How many deletions run on Stripe at once
+        :type workers: int
         :return: int
         """
-        count = 0
+        deleted_ids, _, _ = Coupon.delete_batch(ids, workers=workers)
 
-        for _id in ids:
-            coupon = Coupon.query.get(_id)
+        return len(deleted_ids)
 
-            if coupon is not None:
-                stripe_response = PaymentCoupon.delete(coupon.code)
+    @classmethod
+    def delete_batch(cls, ids, workers=1):
+        """
+        Delete coupons from Stripe concurrently, then delete the ones that
+        are gone from Stripe locally in a single statement.
 
-                if stripe_response.get("deleted"):
-                    coupon.delete()
-                    count += 1
+        Coupons that no longer exist on Stripe are deleted locally too, so
+        a batch interrupted between both steps can simply be run again.
 
-        return count
+        :param ids: List of ids of coupons to be deleted
+        :type ids: list
+        :param workers: How many deletions run on Stripe at once
+        :type workers: int
+        :return: tuple of deleted ids, failed ids and ids worth retrying
+        """
+        coupons = dict(
+            db.session.query(Coupon.id, Coupon.code).filter(Coupon.id.in_(ids))
+        )
+        deleted_ids, failed_ids, retry_ids = [], [], []
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(Coupon.delete_remote, code): coupon_id
+                for coupon_id, code in coupons.items()
+            }
+
+            for future in as_completed(futures):
+                coupon_id = futures[future]
+
+                try:
+                    future.result()
+                except APIConnectionError:
+                    retry_ids.append(coupon_id)
+                    continue
+                except StripeError as e:
+                    current_app.logger.warning(
+                        f"Could not delete coupon {coupon_id} on Stripe: {e}"
+                    )
+                    failed_ids.append(coupon_id)
+                    continue
+
+                deleted_ids.append(coupon_id)
+
+        if deleted_ids:
+            Coupon.query.filter(Coupon.id.in_(deleted_ids)).delete(
+                synchronize_session=False
+            )
+            db.session.commit()
+
+            Coupon.invalidate_codes([coupons[_id] for _id in deleted_ids])
+
+        return deleted_ids, failed_ids, retry_ids
+
+    @classmethod
+    def delete_remote(cls, code):
+        """
+        Delete a coupon from Stripe, a coupon already missing counts as
+        deleted.
+
+        :param code: Coupon code
+        :type code: str
+        :return: None
+        """
+        try:
+            PaymentCoupon.delete(code)
+        except InvalidRequestError as e:
+            if e.http_status != 404:
+                raise
 
     @classmethod
     def find_by_code(cls, code):
@@ -182,19 +538,272 @@ class Coupon(ResourceMixin, db.Model):
             Coupon.redeemable, Coupon.code == code.upper()
         ).first()
 
-    def redeem(self):
+    @classmethod
+    def invalidate_codes(cls, codes):
+        """
+        Drop coupon codes from the lookup cache once they changed.
+
+        :param codes: Coupon codes
+        :type codes: list
+        """
+        from snake_eyes.blueprints.billing.cache import CouponCache
+
+        CouponCache.invalidate(*codes)
+
+    @classmethod
+    def redeem_code(cls, code):
+        """
+        Count a redemption of a coupon as part of the caller's transaction,
+        the coupon is invalidated once it reaches its max redemptions. When
+        the counts are kept in Redis the row is not touched at all until
+        they are flushed to the db.
+
+        :param code: Coupon code
+        :type code: str
+        :return: bool, whether the coupon could be redeemed
+        """
+        code = code.upper()
+
+        if current_app.config["COUPON_REDEMPTIONS_IN_REDIS"]:
+            redeemed = Coupon.reserve_in_redis(code)
+
+            if redeemed is not None:
+                return redeemed
+
+        return Coupon.redeem_in_db(code)
+
+    @classmethod
+    def redeem_in_db(cls, code):
+        """
+        Count a redemption of a coupon in the db. A single conditional
+        UPDATE does the check and the increment so concurrent redemptions
+        can never go past the max.
+
+        :param code: Coupon code
+        :type code: str
+        :return: bool, whether the coupon could be redeemed
+        """
+        times_redeemed = Coupon.times_redeemed + 1
+        statement = (
+            Coupon.__table__.update()
+            .where(Coupon.code == code)
+            .where(Coupon.valid)
+            .where(
+                or_(
+                    Coupon.max_redemptions.is_(None),
+                    Coupon.times_redeemed < Coupon.max_redemptions,
+                )
+            )
+            .values(
+                times_redeemed=times_redeemed,
+                valid=case(
+                    [(times_redeemed >= Coupon.max_redemptions, False)],
+                    else_=Coupon.valid,
+                ),
+            )
+            .returning(Coupon.id)
+        )
+
+        redeemed = db.session.execute(statement).first() is not None
+
+        if redeemed:
+            Coupon.invalidate_codes_on_commit([code])
+
+        return redeemed
+
+    @classmethod
+    def claim_code(cls, code):
+        """
+        Redeem a coupon before anything is charged with its discount. The
+        redemption is committed right away in a transaction of its own so
+        the coupon's row is not locked while Stripe is called.
+
+        :param code: Coupon code
+        :type code: str
+        :raise CouponRedemptionError: The coupon is no longer valid
+        :return: bool, whether the redemption was counted in Redis
+        """
+        code = code.upper()
+        redeemed = None
+
+        if current_app.config["COUPON_REDEMPTIONS_IN_REDIS"]:
+            redeemed = Coupon.reserve_in_redis(code)
+
+        in_redis = redeemed is not None
+
+        if not in_redis:
+            redeemed = Coupon.redeem_in_db(code)
+
+        if not redeemed:
+            db.session.rollback()
+            raise CouponRedemptionError(f"Coupon {code} is no longer valid")
+
+        db.session.commit()
+
+        return in_redis
+
+    @classmethod
+    def release_claim(cls, code, in_redis):
+        """
+        Give back a redemption made by `claim_code`, a coupon it used up is
+        made valid again unless it expired meanwhile.
+
+        :param code: Coupon code
+        :type code: str
+        :param in_redis: Whether the redemption was counted in Redis
+        :type in_redis: bool
+        :return: None
+        """
+        from snake_eyes.blueprints.billing.redemptions import CouponRedemptions
+
+        code = code.upper()
+
+        if in_redis:
+            CouponRedemptions.release(code)
+            return None
+
+        used_up = and_(
+            Coupon.times_redeemed == Coupon.max_redemptions,
+            or_(
+                Coupon.redeem_by.is_(None),
+                Coupon.redeem_by > tz_aware_datetime(),
+            ),
+        )
+        statement = (
+            Coupon.__table__.update()
+            .where(Coupon.code == code)
+            .where(Coupon.times_redeemed > 0)
+            .values(
+                times_redeemed=Coupon.times_redeemed - 1,
+                valid=case([(used_up, True)], else_=Coupon.valid),
+            )
+        )
+
+        db.session.execute(statement)
+        Coupon.invalidate_codes_on_commit([code])
+        db.session.commit()
+
+    @classmethod
+    @contextmanager
+    def claimed(cls, code):
+        """
+        Claim a coupon for the calls to Stripe made within, the redemption
+        is given back when they raise.
+
+        :param code: Coupon code, None when no coupon is used
+        :type code: str or None
+        :raise CouponRedemptionError: The coupon is no longer valid
+        :return: None
+        """
+        if not code:
+            yield
+            return
+
+        in_redis = Coupon.claim_code(code)
+
+        try:
+            yield
+        except Exception:
+            db.session.rollback()
+            Coupon.release_claim(code, in_redis)
+            raise
+
+    @classmethod
+    def reserve_in_redis(cls, code):
+        """
+        Count a redemption in Redis.
+
+        :param code: Coupon code
+        :type code: str
+        :return: bool, None when Redis is unavailable
         """
-        Update the redeem stats for this coupon.
+        from snake_eyes.blueprints.billing.redemptions import CouponRedemptions
+
+        coupon = (
+            db.session.query(
+                Coupon.valid, Coupon.times_redeemed, Coupon.max_redemptions
+            )
+            .filter(Coupon.code == code)
+            .first()
+        )
+
+        if coupon is None or not coupon.valid:
+            return False
+
+        return CouponRedemptions.reserve(
+            code, coupon.times_redeemed, coupon.max_redemptions
+        )
 
-        :return: Result of saving the record
+    @classmethod
+    def apply_redemptions(cls, redemptions, batch_id):
+        """
+        Store redemptions counted in Redis in a single statement. The batch
+        is recorded in the same transaction, a batch stored already by a
+        flush that died before Redis forgot it is skipped.
+
+        :param redemptions: Coupon codes and their number of redemptions
+        :type redemptions: dict
+        :param batch_id: Id of the batch from `take_pending`
+        :type batch_id: str
+        :return: int
         """
-        self.times_redeemed += 1
+        if not redemptions:
+            return 0
+
+        recorded = db.session.execute(
+            insert(CouponRedemptionFlush.__table__)
+            .values(batch_id=batch_id)
+            .on_conflict_do_nothing(index_elements=["batch_id"])
+            .returning(CouponRedemptionFlush.id)
+        ).first()
 
-        if self.max_redemptions:
-            if self.times_redeemed >= self.max_redemptions:
-                self.valid = False
+        if recorded is None:
+            db.session.rollback()
+            return 0
+
+        # Only the batch being flushed can be handed out again.
+        CouponRedemptionFlush.query.filter(
+            CouponRedemptionFlush.created_on < tz_aware_datetime() - timedelta(days=1)
+        ).delete(synchronize_session=False)
+
+        times_redeemed = Coupon.times_redeemed + bindparam("count")
+        statement = (
+            Coupon.__table__.update()
+            .where(Coupon.code == bindparam("redeemed_code"))
+            .values(
+                times_redeemed=times_redeemed,
+                valid=case(
+                    [(times_redeemed >= Coupon.max_redemptions, False)],
+                    else_=Coupon.valid,
+                ),
+            )
+        )
+
+        db.session.execute(
+            statement,
+            [
+                {"redeemed_code": code, "count": count}
+                for code, count in redemptions.items()
+            ],
+        )
+        db.session.commit()
+
+        Coupon.invalidate_codes(list(redemptions))
+
+        return sum(redemptions.values())
+
+    @classmethod
+    def invalidate_codes_on_commit(cls, codes):
+        """
+        Drop coupon codes from the lookup cache once the current
+        transaction is committed.
+
+        :param codes: Coupon codes
+        :type codes: list
+        """
+        from snake_eyes.blueprints.billing.cache import CouponCache
 
-        return db.session.commit()
+        db.session.info.setdefault(CouponCache.PENDING_KEY, set()).update(codes)
 
     def to_json(self):
         """
@@ -0,0 +1,18 @@
+from lib.src.util_sqlalchemy import ResourceMixin
+from snake_eyes.extensions import db
+
+
+class CouponRedemptionFlush(ResourceMixin, db.Model):
+    """
+    Batches of coupon redemptions counted in Redis and stored in the db,
+    recorded in the same transaction so a batch is never stored twice.
+    """
+
+    __tablename__ = "coupon_redemption_flushes"
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    batch_id = db.Column(db.String(32), unique=True, index=True, nullable=False)
+
+    def __init__(self, **kwargs):
+        super(CouponRedemptionFlush, self).__init__(**kwargs)
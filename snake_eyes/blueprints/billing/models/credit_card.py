@@ -1,5 +1,7 @@
 from datetime import date
 
+from sqlalchemy import and_
+
 from lib.src.util_datetime import timedelta_month
 from lib.src.util_sqlalchemy import ResourceMixin
 from snake_eyes.extensions import db
@@ -9,6 +11,13 @@ class CreditCard(ResourceMixin, db.Model):
     IS_EXPIRING_THRESHOLD_MONTHS = 2
 
     __tablename__ = "credit_cards"
+    __table_args__ = (
+        db.Index(
+            "ix_credit_cards_exp_date_not_expiring",
+            "exp_date",
+            postgresql_where=db.text("NOT is_expiring"),
+        ),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
 
@@ -45,23 +54,39 @@ class CreditCard(ResourceMixin, db.Model):
         )
 
     @classmethod
-    def mark_old_credit_cards(cls, compare_date=None):
+    def expiring(cls, compare_date=None):
         """
-        Mark credit cards that are going to expire soon or have expired.
+        Condition matching the unmarked cards that are going to expire soon
+        or have expired. The bare `NOT is_expiring` test matches the
+        predicate of the partial index on exp_date.
 
         :param compare_date: Date to compare at
         :type compare_date: date
-        :return: Result of updating the records
+        :return: SQLAlchemy filter
         """
         today_with_delta = timedelta_month(
             CreditCard.IS_EXPIRING_THRESHOLD_MONTHS, compare_date=compare_date
         )
 
-        CreditCard.query.filter(CreditCard.exp_date <= today_with_delta).update(
-            {CreditCard.is_expiring: True}
-        )
+        return and_(CreditCard.exp_date <= today_with_delta, ~CreditCard.is_expiring)
+
+    @classmethod
+    def mark_old_credit_cards(cls, compare_date=None, chunk_size=1000):
+        """
+        Mark credit cards that are going to expire soon or have expired.
+        Cards already marked are left alone.
 
-        return db.session.commit()
+        :param compare_date: Date to compare at
+        :type compare_date: date
+        :param chunk_size: Cards updated per transaction
+        :type chunk_size: int
+        :return: dict with the cards updated, the chunks and the seconds
+        """
+        return CreditCard.update_in_chunks(
+            CreditCard.expiring(compare_date),
+            {"is_expiring": True},
+            chunk_size=chunk_size,
+        )
 
     @classmethod
     def extract_card_params(cls, customer):
@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from sqlalchemy import or_
+from sqlalchemy.orm import contains_eager
 
 from lib.src.util_sqlalchemy import ResourceMixin
 from snake_eyes.blueprints.billing.gateways.stripecom import (
@@ -19,6 +19,10 @@ from snake_eyes.extensions import db
 
 class Invoice(ResourceMixin, db.Model):
     __tablename__ = "invoices"
+    __table_args__ = (
+        db.Index("ix_invoices_created_on_id", "created_on", "id"),
+        db.Index("ix_invoices_user_id_created_on_id", "user_id", "created_on", "id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
 
@@ -52,6 +56,7 @@ class Invoice(ResourceMixin, db.Model):
     def search(cls, query):
         """
         Search a resource by 1 or more fields.
+        The filter is on the invoice's user, so join users first.
 
         :param query: Search query
         :type query: str
@@ -59,16 +64,34 @@ class Invoice(ResourceMixin, db.Model):
         """
         from snake_eyes.blueprints.user.models import User
 
-        if not query:
-            return ""
+        return User.search(query)
 
-        search_query = f"%{query}%"
-        search_chain = (
-            User.email.ilike(search_query),
-            User.username.ilike(search_query),
-        )
+    @classmethod
+    def search_rank(cls, query):
+        """
+        Order search results by their user's similarity to the query.
+
+        :param query: Search query
+        :type query: str
+        :return: SQLAlchemy order by clause
+        """
+        from snake_eyes.blueprints.user.models import User
 
-        return or_(*search_chain)
+        return User.search_rank(query)
+
+    @classmethod
+    def query_with_users(cls):
+        """
+        Invoices joined to their user through user_id, with the user and
+        their subscription loaded from the same row.
+
+        :return: SQLAlchemy query
+        """
+        from snake_eyes.blueprints.user.models import User
+
+        return Invoice.query.join(User, Invoice.user_id == User.id).options(
+            contains_eager(Invoice.users).joinedload(User.subscription)
+        )
 
     @classmethod
     def parse_from_event(cls, payload):
@@ -114,9 +137,9 @@ class Invoice(ResourceMixin, db.Model):
         }
 
     @classmethod
-    def prepare_and_save(cls, parsed_event):
+    def prepare(cls, parsed_event):
         """
-        Prepare and save the Invoice.
+        Prepare the Invoice and add it to the session without committing.
 
         :param parsed_events: Event to be saved
         :type parsed_events: dict
@@ -136,8 +159,21 @@ class Invoice(ResourceMixin, db.Model):
 
             del parsed_event["payment_id"]
 
-            invoice = Invoice(**parsed_event)
-            invoice.save()
+            db.session.add(Invoice(**parsed_event))
+
+        return user
+
+    @classmethod
+    def prepare_and_save(cls, parsed_event):
+        """
+        Prepare and save the Invoice.
+
+        :param parsed_events: Event to be saved
+        :type parsed_events: dict
+        :return: User Instance
+        """
+        user = Invoice.prepare(parsed_event)
+        db.session.commit()
 
         return user
 
@@ -176,19 +212,20 @@ class Invoice(ResourceMixin, db.Model):
         if token is None:
             return False
 
-        customer = PaymentCustomer.create(token=token, email=user.email)
-
         if coupon:
             self.coupon = coupon.upper()
-            coupon = Coupon.query.filter(Coupon.code == self.coupon).first()
-            amount = coupon.apply_discount_to(amount)
 
-        charge = PaymentCharge.create(customer.id, currency, amount)
+        # Redeemed first so a coupon that ran out never discounts a charge,
+        # the redemption is given back if the charge fails.
+        with Coupon.claimed(coupon):
+            if coupon:
+                discount = Coupon.query.filter(Coupon.code == self.coupon).first()
+                amount = discount.apply_discount_to(amount)
 
-        if coupon:
-            coupon.redeem()
+            customer = PaymentCustomer.create(token=token, email=user.email)
+            charge = PaymentCharge.create(customer.id, currency, amount)
 
-        user.coins += coins
+        user.coins = type(user).coins + coins
 
         period_on = datetime.utcfromtimestamp(charge.get("created"))
         card_params = CreditCard.extract_card_params(customer)
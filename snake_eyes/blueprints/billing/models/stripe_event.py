@@ -0,0 +1,173 @@
+from flask import current_app
+from sqlalchemy.dialects.postgresql import insert
+from stripe.error import InvalidRequestError
+
+from lib.src.util_datetime import tz_aware_datetime
+from lib.src.util_sqlalchemy import AwareDateTime
+from lib.src.util_sqlalchemy import ResourceMixin
+from snake_eyes.blueprints.billing.cache import UpcomingInvoiceCache
+from snake_eyes.blueprints.billing.gateways.stripecom import (
+    Event as PaymentEvent,
+)
+from snake_eyes.blueprints.billing.models.invoice import Invoice
+from snake_eyes.blueprints.billing.plans import plan_registry
+from snake_eyes.extensions import db
+
+
+class StripeEvent(ResourceMixin, db.Model):
+    """
+    Webhook events received from Stripe, the unique event id makes
+    retried deliveries no-ops.
+    """
+
+    __tablename__ = "stripe_events"
+
+    UPCOMING_INVOICE_EVENTS = ("customer.subscription.", "invoice.")
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    event_id = db.Column(db.String(255), unique=True, index=True, nullable=False)
+    event_type = db.Column(db.String(128))
+    customer_id = db.Column(db.String(128), index=True)
+    processed_on = db.Column(AwareDateTime(), index=True)
+
+    # Failed attempts, the event is given up on after too many of them so
+    # the later events of the customer are not held back.
+    attempts = db.Column(db.Integer, nullable=False, server_default="0")
+    error = db.Column(db.Text)
+    failed_on = db.Column(AwareDateTime())
+
+    # Verified body of the event, older rows are fetched from Stripe instead.
+    payload = db.Column(db.JSON)
+
+    def __init__(self, **kwargs):
+        super(StripeEvent, self).__init__(**kwargs)
+
+    @classmethod
+    def record(cls, event_id, customer_id=None, event_type=None, payload=None):
+        """
+        Record a delivered event unless it was already received.
+
+        :param event_id: Stripe event id
+        :type event_id: str
+        :param customer_id: Stripe customer id the event belongs to
+        :type customer_id: str
+        :param event_type: Stripe event type
+        :type event_type: str
+        :param payload: Verified event
+        :type payload: dict
+        :return: bool
+        """
+        now = tz_aware_datetime()
+        statement = (
+            insert(StripeEvent.__table__)
+            .values(
+                created_on=now,
+                updated_on=now,
+                event_id=event_id,
+                event_type=event_type,
+                customer_id=customer_id,
+                payload=payload,
+            )
+            .on_conflict_do_nothing(index_elements=["event_id"])
+            .returning(StripeEvent.id)
+        )
+
+        recorded = db.session.execute(statement).first()
+        db.session.commit()
+
+        return recorded is not None
+
+    @classmethod
+    def pending(cls, customer_id):
+        """
+        Unprocessed events of a customer in the order they were received,
+        the ones given up on are left out.
+
+        :param customer_id: Stripe customer id
+        :type customer_id: str
+        :return: SQLAlchemy query
+        """
+        return StripeEvent.query.filter(
+            StripeEvent.customer_id == customer_id,
+            StripeEvent.processed_on.is_(None),
+            StripeEvent.failed_on.is_(None),
+        ).order_by(StripeEvent.id)
+
+    def process(self):
+        """
+        Apply the event, the invoice, coins and processed mark are
+        committed together so an event is never applied twice. Stripe
+        connection errors are left to the caller so it can retry.
+
+        :return: StripeEvent instance
+        """
+        safe_event = self.payload
+
+        if safe_event is None:
+            try:
+                safe_event = PaymentEvent.retrieve(self.event_id)
+            except InvalidRequestError as e:
+                current_app.logger.warning(f"Unknown stripe event {self.event_id}: {e}")
+                return self.mark_processed()
+
+        try:
+            parsed_event = Invoice.parse_from_event(safe_event)
+        except (KeyError, IndexError, TypeError) as e:
+            current_app.logger.info(f"Skipping stripe event {self.event_id}: {e}")
+            return self.mark_processed()
+
+        user = Invoice.prepare(parsed_event)
+
+        if user and user.subscription and parsed_event.get("total") > 0:
+            plan = plan_registry.get(user.subscription.plan)
+            user.coins = type(user).coins + plan["metadata"]["coins"]
+
+        return self.mark_processed()
+
+    def invalidates_upcoming_invoice(self):
+        """
+        Whether the event may change the customer's upcoming invoice.
+
+        :return: bool
+        """
+        return (self.event_type or "").startswith(StripeEvent.UPCOMING_INVOICE_EVENTS)
+
+    def record_failure(self, error):
+        """
+        Count a failed attempt at applying the event, once it failed too
+        often it is marked as failed. The caller rolls back first.
+
+        :param error: Exception raised by `process`
+        :type error: Exception
+        :return: bool, whether the event was given up on
+        """
+        self.attempts = (self.attempts or 0) + 1
+        self.error = f"{type(error).__name__}: {error}"
+
+        given_up = self.attempts >= current_app.config["STRIPE_EVENT_MAX_ATTEMPTS"]
+
+        if given_up:
+            self.failed_on = tz_aware_datetime()
+            current_app.logger.error(
+                f"Giving up on stripe event {self.event_id} after "
+                f"{self.attempts} attempts: {self.error}"
+            )
+
+        self.save()
+
+        return given_up
+
+    def mark_processed(self):
+        """
+        Mark the event as processed and commit the current transaction.
+
+        :return: StripeEvent instance
+        """
+        self.processed_on = tz_aware_datetime()
+        self.save()
+
+        if self.invalidates_upcoming_invoice():
+            UpcomingInvoiceCache.invalidate(self.customer_id)
+
+        return self
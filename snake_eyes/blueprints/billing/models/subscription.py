@@ -2,9 +2,9 @@ from datetime import datetime
 
 from pytz import utc
 
-from config import settings
 from lib.src.util_sqlalchemy import ResourceMixin
 from snake_eyes.blueprints.bet.models.coin import add_subscription_coins
+from snake_eyes.blueprints.billing.cache import UpcomingInvoiceCache
 from snake_eyes.blueprints.billing.gateways.stripecom import (
     Card as PaymentCard,
 )
@@ -16,6 +16,7 @@ from snake_eyes.blueprints.billing.gateways.stripecom import (
 )
 from snake_eyes.blueprints.billing.models.coupon import Coupon
 from snake_eyes.blueprints.billing.models.credit_card import CreditCard
+from snake_eyes.blueprints.billing.plans import plan_registry
 from snake_eyes.extensions import db
 
 
@@ -48,9 +49,7 @@ class Subscription(ResourceMixin, db.Model):
         :type plan: str
         :return: dict or None
         """
-        for key, value in settings.STRIPE_PLANS.items():
-            if value.get("id") == plan:
-                return settings.STRIPE_PLANS[key]
+        return plan_registry.get(plan)
 
     @classmethod
     def get_new_plan(cls, keys):
@@ -61,12 +60,7 @@ class Subscription(ResourceMixin, db.Model):
         :type keys: list
         :return: str or None
         """
-        for key in keys:
-            split_key = key.split("submit_")
-
-            if isinstance(split_key, list) and len(split_key) == 2:
-                if Subscription.get_plan_by_id(split_key[1]):
-                    return split_key[1]
+        return plan_registry.from_form_keys(keys)
 
     def create(self, user=None, name=None, plan=None, coupon=None, token=None):
         """
@@ -90,15 +84,16 @@ class Subscription(ResourceMixin, db.Model):
         if coupon:
             self.coupon = coupon.upper()
 
-        customer = PaymentCustomer.create(
-            token=token, email=user.email, plan=plan, coupon=self.coupon
-        )
+        with Coupon.claimed(self.coupon):
+            customer = PaymentCustomer.create(
+                token=token, email=user.email, plan=plan, coupon=self.coupon
+            )
 
         user.payment_id = customer.id
         user.name = name
         user.previous_plan = plan
         user.coins = add_subscription_coins(
-            user.coins,
+            type(user).coins,
             Subscription.get_plan_by_id(user.previous_plan),
             Subscription.get_plan_by_id(plan),
             user.cancelled_subscription_on,
@@ -108,10 +103,6 @@ class Subscription(ResourceMixin, db.Model):
         self.user_id = user.id
         self.plan = plan
 
-        if coupon:
-            coupon = Coupon.query.filter(Coupon.code == self.coupon).first()
-            coupon.redeem()
-
         credit_card = CreditCard(
             user_id=user.id, **CreditCard.extract_card_params(customer)
         )
@@ -136,12 +127,13 @@ class Subscription(ResourceMixin, db.Model):
         :type plan: str
         :return: bool
         """
-        PaymentSubscription.update(user.payment_id, coupon, plan)
+        with Coupon.claimed(coupon):
+            PaymentSubscription.update(user.payment_id, coupon, plan)
 
         user.previous_plan = user.subscription.plan
         user.subscription.plan = plan
         user.coins = add_subscription_coins(
-            user.coins,
+            type(user).coins,
             Subscription.get_plan_by_id(user.previous_plan),
             Subscription.get_plan_by_id(plan),
             user.cancelled_subscription_on,
@@ -149,14 +141,12 @@ class Subscription(ResourceMixin, db.Model):
 
         if coupon:
             user.subscription.coupon = coupon
-            coupon = Coupon.query.filter(Coupon.code == coupon).first()
-
-            if coupon:
-                coupon.redeem()
 
         db.session.add(user.subscription)
         db.session.commit()
 
+        UpcomingInvoiceCache.invalidate(user.payment_id)
+
         return True
 
     def cancel(self, user=None, discard_credit_card=True):
@@ -170,6 +160,7 @@ class Subscription(ResourceMixin, db.Model):
         :return: bool
         """
         PaymentSubscription.cancel(user.payment_id)
+        UpcomingInvoiceCache.invalidate(user.payment_id)
 
         user.payment_id = None
         user.cancelled_subscription_on = datetime.now(utc)
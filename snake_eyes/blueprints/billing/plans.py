@@ -0,0 +1,270 @@
+import json
+import logging
+import time
+
+from redis.exceptions import RedisError
+
+from snake_eyes.extensions import redis
+
+
+logger = logging.getLogger(__name__)
+
+
+class PlanRegistry:
+    """
+    Subscription plans indexed by plan id and by pricing form key, built
+    from STRIPE_PLANS when the app is created and hot reloaded whenever
+    `snake_eyes stripe sync` publishes plans pulled from Stripe.
+    """
+
+    FORM_KEY_PREFIX = "submit_"
+    PLANS_KEY = "plans:registry"
+    VERSION_KEY = "plans:version"
+    REMOTE_FIELDS = (
+        "name",
+        "amount",
+        "currency",
+        "interval",
+        "interval_count",
+        "trial_period_days",
+        "statement_descriptor",
+    )
+    UPDATABLE_FIELDS = ("name", "metadata", "statement_descriptor")
+
+    def __init__(self, app=None):
+        self.plans = {}
+        self.configured = {}
+        self.refresh_interval = 30
+
+        self._by_id = {}
+        self._by_form_key = {}
+        self._version = None
+        self._checked_at = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Build the registry from the app's config.
+
+        :param app: Flask application instance
+        """
+        self.refresh_interval = app.config["PLAN_REGISTRY_REFRESH_INTERVAL"]
+        self._version = None
+        self._checked_at = 0
+
+        self.configured = app.config["STRIPE_PLANS"] or {}
+        self.load(self.configured)
+
+    def load(self, plans):
+        """
+        Swap in a new set of plans.
+
+        :param plans: Plans keyed by their position on the pricing page
+        :type plans: dict
+        :return: None
+        """
+        by_id = {plan["id"]: plan for plan in plans.values()}
+        by_form_key = {f"{self.FORM_KEY_PREFIX}{plan_id}": plan_id for plan_id in by_id}
+
+        self.plans, self._by_id, self._by_form_key = plans, by_id, by_form_key
+
+    def get(self, plan_id):
+        """
+        Pick the plan based on the plan identifier.
+
+        :param plan_id: Plan identifier
+        :type plan_id: str
+        :return: dict or None
+        """
+        self.refresh_if_changed()
+
+        return self._by_id.get(plan_id)
+
+    def from_form_keys(self, keys):
+        """
+        Pick the plan id matching one of the submitted form keys.
+
+        :param keys: Keys to look through
+        :type keys: list
+        :return: str or None
+        """
+        self.refresh_if_changed()
+
+        for key in keys:
+            plan_id = self._by_form_key.get(key)
+
+            if plan_id is not None:
+                return plan_id
+
+    def all(self):
+        """
+        Every plan keyed by its position on the pricing page.
+
+        :return: dict
+        """
+        self.refresh_if_changed()
+
+        return self.plans
+
+    def publish(self, plans):
+        """
+        Share plans with every process, which reload them on their next
+        version check.
+
+        :param plans: Plans keyed by their position on the pricing page
+        :type plans: dict
+        :return: int, new version
+        """
+        pipe = redis.pipeline()
+        pipe.set(self.PLANS_KEY, json.dumps(plans))
+        pipe.incr(self.VERSION_KEY)
+        _, version = pipe.execute()
+
+        self.load(plans)
+        self._version = version
+
+        return version
+
+    def refresh_if_changed(self):
+        """
+        Reload the published plans when their version changed, Redis is
+        asked at most once per refresh interval. The configured plans
+        still decide which plans are offered and where.
+
+        :return: bool
+        """
+        now = time.monotonic()
+
+        if now - self._checked_at < self.refresh_interval:
+            return False
+
+        self._checked_at = now
+
+        try:
+            version = redis.get(self.VERSION_KEY)
+
+            if version is None or int(version) == self._version:
+                return False
+
+            plans = redis.get(self.PLANS_KEY)
+        except RedisError as e:
+            logger.warning(f"Plan registry unavailable: {e}")
+            return False
+
+        if plans is not None:
+            published = {plan["id"]: plan for plan in json.loads(plans).values()}
+
+            self.load(
+                {
+                    key: published.get(plan["id"], plan)
+                    for key, plan in self.configured.items()
+                }
+            )
+
+        self._version = int(version)
+
+        return True
+
+    @classmethod
+    def merge_remote(cls, plans, remote_plans):
+        """
+        Overlay the plans fetched from Stripe onto the configured ones,
+        Stripe metadata values are strings so they are coerced back. The
+        metadata is merged key by key so a key missing on Stripe, such as
+        coins, keeps its configured value.
+
+        :param plans: Configured plans keyed by their position
+        :type plans: dict
+        :param remote_plans: Stripe plans
+        :type remote_plans: list
+        :return: dict
+        """
+        remote_by_id = {plan["id"]: plan for plan in remote_plans}
+        merged = {}
+
+        for key, plan in plans.items():
+            remote = remote_by_id.get(plan["id"])
+            plan = dict(plan)
+
+            if remote is not None:
+                for field in PlanRegistry.REMOTE_FIELDS:
+                    plan[field] = remote.get(field, plan.get(field))
+
+                plan["metadata"] = {
+                    **(plan.get("metadata") or {}),
+                    **{
+                        k: PlanRegistry.coerce(v)
+                        for k, v in (remote.get("metadata") or {}).items()
+                    },
+                }
+
+            merged[key] = plan
+
+        return merged
+
+    @classmethod
+    def diff(cls, plans, remote_plans):
+        """
+        Compare the configured plans with the ones on Stripe.
+
+        :param plans: Configured plans keyed by their position
+        :type plans: dict
+        :param remote_plans: Stripe plans
+        :type remote_plans: list
+        :return: list of (plan, action, fields) tuples, action is one of
+                 create, update or unchanged and fields lists what differs
+        """
+        remote_by_id = {plan["id"]: plan for plan in remote_plans}
+        changes = []
+
+        for plan in plans.values():
+            remote = remote_by_id.get(plan["id"])
+
+            if remote is None:
+                changes.append((plan, "create", []))
+                continue
+
+            remote_metadata = {
+                k: PlanRegistry.coerce(v)
+                for k, v in (remote.get("metadata") or {}).items()
+            }
+            fields = [
+                field
+                for field in PlanRegistry.REMOTE_FIELDS
+                if remote.get(field) != plan.get(field)
+            ]
+
+            if remote_metadata != (plan.get("metadata") or {}):
+                fields.append("metadata")
+
+            if set(fields) & set(PlanRegistry.UPDATABLE_FIELDS):
+                changes.append((plan, "update", fields))
+            else:
+                changes.append((plan, "unchanged", fields))
+
+        return changes
+
+    @classmethod
+    def coerce(cls, value):
+        """
+        Convert a Stripe metadata string back to the type used in config.
+
+        :param value: Metadata value
+        :type value: str
+        :return: int, bool or str
+        """
+        if not isinstance(value, str):
+            return value
+
+        if value.isdigit():
+            return int(value)
+
+        if value in ("True", "False"):
+            return value == "True"
+
+        return value
+
+
+plan_registry = PlanRegistry()
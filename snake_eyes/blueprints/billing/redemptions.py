@@ -0,0 +1,185 @@
+from uuid import uuid4
+
+from flask import current_app
+from redis.exceptions import RedisError
+
+from snake_eyes.extensions import redis
+
+
+# Counts a redemption unless the coupon ran out. The total is reconciled
+# with the db on every call, the count stored in the db plus the ones not
+# flushed yet, since redemptions made while Redis was unavailable only
+# went to the db. The highest of both counts wins so a flush committed
+# between reading the db and running this script is never missed.
+RESERVE_SCRIPT = """
+local unflushed = tonumber(redis.call('HGET', KEYS[2], ARGV[3]) or 0)
+    + tonumber(redis.call('HGET', KEYS[3], ARGV[3]) or 0)
+local total = math.max(
+    tonumber(redis.call('GET', KEYS[1]) or 0), tonumber(ARGV[1]) + unflushed
+)
+local max_redemptions = tonumber(ARGV[2])
+
+if max_redemptions > 0 and total >= max_redemptions then
+    return -1
+end
+
+redis.call('SET', KEYS[1], total + 1, 'EX', ARGV[4])
+redis.call('HINCRBY', KEYS[2], ARGV[3], 1)
+
+return total + 1
+"""
+
+# Gives back a redemption whose charge failed. The pending count may go
+# below zero when the redemption was flushed already, the next flush then
+# takes it off the db.
+RELEASE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('DECR', KEYS[1])
+end
+
+if redis.call('HINCRBY', KEYS[2], ARGV[1], -1) == 0 then
+    redis.call('HDEL', KEYS[2], ARGV[1])
+end
+
+return 1
+"""
+
+# Hands out the batch being flushed, a batch left over by a flush that
+# failed comes before the redemptions counted since. Every batch gets an
+# id the db records once it is stored.
+TAKE_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        return false
+    end
+
+    redis.call('RENAME', KEYS[1], KEYS[2])
+    redis.call('DEL', KEYS[3])
+end
+
+local batch_id = redis.call('GET', KEYS[3])
+
+if not batch_id then
+    batch_id = ARGV[1]
+    redis.call('SET', KEYS[3], batch_id)
+end
+
+return {batch_id, redis.call('HGETALL', KEYS[2])}
+"""
+
+
+class CouponRedemptions:
+    """
+    Redemption counters of coupons kept in Redis, so a coupon redeemed by
+    many customers at once never waits on its row lock. The counts are
+    written to the db in batches by a periodic task.
+    """
+
+    PENDING_KEY = "coupon_redemptions:pending"
+    FLUSHING_KEY = "coupon_redemptions:flushing"
+    FLUSHING_BATCH_KEY = "coupon_redemptions:flushing:batch"
+    # Seconds the count of a coupon nobody redeems is kept
+    COUNTER_TTL = 3600
+
+    @classmethod
+    def key(cls, code):
+        """
+        Redis key of a coupon's redemption count
+
+        :param code: Coupon code
+        :type code: str
+        :return: str
+        """
+        return f"coupon_redemptions:{code}"
+
+    @classmethod
+    def reserve(cls, code, times_redeemed, max_redemptions):
+        """
+        Count a redemption of a coupon.
+
+        :param code: Coupon code
+        :type code: str
+        :param times_redeemed: Redemptions stored in the db
+        :type times_redeemed: int
+        :param max_redemptions: Max number of times it can be redeemed
+        :type max_redemptions: int or None
+        :return: bool, None when Redis is unavailable
+        """
+        try:
+            total = redis.eval(
+                RESERVE_SCRIPT,
+                3,
+                CouponRedemptions.key(code),
+                CouponRedemptions.PENDING_KEY,
+                CouponRedemptions.FLUSHING_KEY,
+                times_redeemed,
+                max_redemptions or 0,
+                code,
+                CouponRedemptions.COUNTER_TTL,
+            )
+        except RedisError as e:
+            current_app.logger.warning(f"Coupon redemptions unavailable: {e}")
+            return None
+
+        return total > 0
+
+    @classmethod
+    def release(cls, code):
+        """
+        Give back a redemption counted by `reserve`.
+
+        :param code: Coupon code
+        :type code: str
+        :return: None
+        """
+        try:
+            redis.eval(
+                RELEASE_SCRIPT,
+                2,
+                CouponRedemptions.key(code),
+                CouponRedemptions.PENDING_KEY,
+                code,
+            )
+        except RedisError as e:
+            current_app.logger.warning(f"Coupon redemptions unavailable: {e}")
+
+    @classmethod
+    def take_pending(cls):
+        """
+        Redemptions not written to the db yet. A batch left over by a
+        flush that failed is handed out again, under the same id, before
+        any new one.
+
+        :return: tuple of the batch id and a dict of coupon codes and
+                 redemption counts, (None, {}) when there is nothing to flush
+        """
+        taken = redis.eval(
+            TAKE_SCRIPT,
+            3,
+            CouponRedemptions.PENDING_KEY,
+            CouponRedemptions.FLUSHING_KEY,
+            CouponRedemptions.FLUSHING_BATCH_KEY,
+            uuid4().hex,
+        )
+
+        if taken is None:
+            return None, {}
+
+        batch_id, pending = taken
+        pairs = zip(pending[::2], pending[1::2])
+
+        return (
+            batch_id.decode("utf-8"),
+            {code.decode("utf-8"): int(count) for code, count in pairs},
+        )
+
+    @classmethod
+    def done(cls):
+        """
+        Forget the batch handed out by `take_pending` once it is stored.
+
+        :return: None
+        """
+        redis.delete(
+            CouponRedemptions.FLUSHING_KEY, CouponRedemptions.FLUSHING_BATCH_KEY
+        )
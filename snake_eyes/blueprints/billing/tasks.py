@@ -1,10 +1,19 @@
-from snake_eyes.app import create_celery
+from datetime import timedelta
+
+from celery import chord
+from flask import current_app
+from stripe.error import APIConnectionError
+
+from lib.src.util_datetime import tz_aware_datetime
+from snake_eyes.app import celery
+from snake_eyes.blueprints.admin.progress import BulkProgress
 from snake_eyes.blueprints.billing.models.coupon import Coupon
 from snake_eyes.blueprints.billing.models.credit_card import CreditCard
+from snake_eyes.blueprints.billing.models.stripe_event import StripeEvent
+from snake_eyes.blueprints.billing.redemptions import CouponRedemptions
 from snake_eyes.blueprints.user.models import User
-
-
-celery = create_celery()
+from snake_eyes.extensions import db
+from snake_eyes.extensions import redis
 
 
 @celery.task()
@@ -12,9 +21,14 @@ def mark_old_credit_cards():
     """
     Mark credit cards that are going to expire soon or have expired.
 
-    :return: Result of updating the records
+    :return: dict with the cards updated, the chunks and the seconds
     """
-    return CreditCard.mark_old_credit_cards()
+    report = CreditCard.mark_old_credit_cards(
+        chunk_size=current_app.config["MAINTENANCE_CHUNK_SIZE"]
+    )
+    current_app.logger.info(f"Marked expiring credit cards: {report}")
+
+    return report
 
 
 @celery.task()
@@ -22,9 +36,32 @@ def expire_old_coupons():
     """
     Invalidate coupons that are past their redeem date.
 
-    :return: Result of updating the records
+    :return: dict with the coupons updated, the chunks and the seconds
     """
-    return Coupon.expire_old_coupons()
+    report = Coupon.expire_old_coupons(
+        chunk_size=current_app.config["MAINTENANCE_CHUNK_SIZE"]
+    )
+    current_app.logger.info(f"Expired old coupons: {report}")
+
+    return report
+
+
+@celery.task()
+def flush_coupon_redemptions():
+    """
+    Store the coupon redemptions counted in Redis.
+
+    :return: int
+    """
+    batch_id, redemptions = CouponRedemptions.take_pending()
+
+    if batch_id is None:
+        return 0
+
+    count = Coupon.apply_redemptions(redemptions, batch_id)
+    CouponRedemptions.done()
+
+    return count
 
 
 @celery.task()
@@ -32,20 +69,284 @@ def delete_users(ids):
     """
     Delete users and potentially cancel their subscription.
 
+    Users without a subscription are deleted right away, the others are
+    split into chunks processed in parallel by the workers since each of
+    them costs a call to Stripe.
+
+    :param ids: List of ids to be deleted
+    :type ids: list
+    :return: str, id of the job tracking the progress
+    """
+    job_id = BulkProgress.start("delete_users", len(ids))
+
+    with BulkProgress.failing_on_error("delete_users", job_id):
+        deleted = User.delete_unsubscribed(ids)
+        subscribed_ids = User.subscribed_ids(ids)
+
+        # Ids that matched nothing, already deleted users for example.
+        skipped = len(ids) - deleted - len(subscribed_ids)
+        BulkProgress.advance("delete_users", job_id, done=deleted + skipped)
+
+        size = current_app.config["BULK_DELETE_CHUNK_SIZE"]
+        chunks = []
+
+        for start in range(0, len(subscribed_ids), size):
+            end = start + size
+            chunks.append(subscribed_ids[start:end])
+
+        if not chunks:
+            BulkProgress.finish("delete_users", job_id)
+            return job_id
+
+        # A chunk that fails marks the job as failed itself since the chord
+        # callback finishing the job never runs then.
+        chord(delete_users_chunk.s(chunk, job_id) for chunk in chunks)(
+            finish_bulk_job.s("delete_users", job_id)
+        )
+
+    return job_id
+
+
+@celery.task()
+def delete_users_chunk(ids, job_id):
+    """
+    Cancel the subscription of a chunk of users and delete them.
+
     :param ids: List of ids to be deleted
     :type ids: list
+    :param job_id: Id of the job tracking the progress
+    :type job_id: str
     :return: int
     """
-    return User.bulk_delete(ids)
+    with BulkProgress.failing_on_error("delete_users", job_id):
+        deleted, failed = User.cancel_and_delete(
+            ids, workers=current_app.config["BULK_DELETE_STRIPE_WORKERS"]
+        )
+
+    BulkProgress.advance("delete_users", job_id, done=deleted, failed=failed)
+
+    return deleted
 
 
 @celery.task()
-def delete_coupons(ids):
+def finish_bulk_job(results, kind, job_id):
+    """
+    Mark a bulk job as finished once all of its chunks ran.
+
+    :param results: Results of the chunks
+    :type results: list
+    :param kind: Kind of job
+    :type kind: str
+    :param job_id: Id of the job tracking the progress
+    :type job_id: str
+    :return: int
+    """
+    BulkProgress.finish(kind, job_id)
+
+    return sum(results)
+
+
+@celery.task(bind=True, max_retries=10)
+def delete_coupons(self, ids, job_id=None):
     """
     Delete coupons both on the payment gateway and locally.
 
+    Coupons are deleted in batches, every batch is checkpointed once it
+    is committed so a retried task skips the coupons it already handled.
+
     :param ids: List of ids to be deleted
     :type ids: list
+    :param job_id: Id of the job tracking the progress, set on retries
+    :type job_id: str
+    :return: int
+    """
+    if job_id is None:
+        job_id = BulkProgress.start("delete_coupons", len(ids))
+
+    with BulkProgress.failing_on_error("delete_coupons", job_id):
+        handled = BulkProgress.handled("delete_coupons", job_id)
+        remaining = [_id for _id in ids if _id not in handled]
+
+        size = current_app.config["BULK_DELETE_CHUNK_SIZE"]
+        workers = current_app.config["BULK_DELETE_STRIPE_WORKERS"]
+        deleted = 0
+        retry_ids = []
+
+        for start in range(0, len(remaining), size):
+            end = start + size
+            batch = remaining[start:end]
+            deleted_ids, failed_ids, batch_retry_ids = Coupon.delete_batch(
+                batch, workers=workers
+            )
+
+            # Ids that matched nothing were deleted by someone else already.
+            skipped = len(batch) - len(deleted_ids + failed_ids + batch_retry_ids)
+
+            BulkProgress.advance(
+                "delete_coupons",
+                job_id,
+                done=len(deleted_ids) + skipped,
+                failed=len(failed_ids),
+                handled=list(set(batch) - set(batch_retry_ids)),
+            )
+
+            deleted += len(deleted_ids)
+            retry_ids.extend(batch_retry_ids)
+
+        if retry_ids:
+            # Raises MaxRetriesExceededError once the retries ran out, which
+            # marks the job as failed.
+            raise self.retry(
+                kwargs={"ids": ids, "job_id": job_id},
+                countdown=min(2 ** self.request.retries, 300),
+            )
+
+    BulkProgress.finish("delete_coupons", job_id)
+
+    return deleted
+
+
+@celery.task(bind=True, max_retries=10)
+def generate_coupons(self, count, params, job_id=None, ids=None):
+    """
+    Generate coupons with random codes, locally then on Stripe.
+
+    The coupons are inserted once, a retried task pushes the ones that are
+    still invalid, whether Stripe could not confirm them or the task died
+    before pushing them.
+
+    :param count: Number of coupons
+    :type count: int
+    :param params: Parameters shared by the coupons
+    :type params: dict
+    :param job_id: Id of the job tracking the progress, set on retries
+    :type job_id: str
+    :param ids: Ids of the inserted coupons, set on retries
+    :type ids: list
+    :return: int
+    """
+    if job_id is None:
+        job_id = BulkProgress.start("generate_coupons", count)
+
+    with BulkProgress.failing_on_error("generate_coupons", job_id):
+        generation_params = Coupon.generation_params(params)
+
+        if ids is None:
+            coupons = Coupon.insert_unique(count, generation_params)
+            ids = [_id for _id, _ in coupons]
+
+            # Codes that could not be made unique are failures as well.
+            BulkProgress.advance(
+                "generate_coupons", job_id, failed=count - len(coupons)
+            )
+        else:
+            coupons = Coupon.unpushed(ids)
+
+        size = current_app.config["COUPON_GENERATION_BATCH_SIZE"]
+        workers = current_app.config["COUPON_GENERATION_STRIPE_WORKERS"]
+        created = 0
+        retry_coupons = []
+        retry_kwargs = {"count": count, "params": params, "job_id": job_id, "ids": ids}
+
+        try:
+            for start in range(0, len(coupons), size):
+                end = start + size
+                batch_created, batch_failed, batch_retry = Coupon.push_batch(
+                    coupons[start:end], generation_params, workers=workers
+                )
+                BulkProgress.advance(
+                    "generate_coupons", job_id, done=batch_created, failed=batch_failed
+                )
+
+                created += batch_created
+                retry_coupons += batch_retry
+        except Exception as e:
+            db.session.rollback()
+            raise self.retry(
+                exc=e,
+                kwargs=retry_kwargs,
+                countdown=min(2 ** self.request.retries, 300),
+            )
+
+        if retry_coupons:
+            # Raises MaxRetriesExceededError once the retries ran out, which
+            # marks the job as failed.
+            raise self.retry(
+                kwargs=retry_kwargs,
+                countdown=min(2 ** self.request.retries, 300),
+            )
+
+    BulkProgress.finish("generate_coupons", job_id)
+
+    return created
+
+
+@celery.task(bind=True, max_retries=None)
+def process_stripe_events(self, customer_id):
+    """
+    Apply the pending webhook events of a customer in the order they were
+    received, only one worker processes a given customer at a time.
+
+    :param customer_id: Stripe customer id
+    :type customer_id: str
     :return: int
     """
-    return Coupon.bulk_delete(ids)
+    lock = redis.lock(f"stripe_events:{customer_id}", timeout=300)
+
+    if not lock.acquire(blocking=False):
+        raise self.retry(countdown=1)
+
+    processed = 0
+
+    try:
+        for stripe_event in StripeEvent.pending(customer_id):
+            try:
+                stripe_event.process()
+            except APIConnectionError:
+                raise
+            except Exception as e:
+                db.session.rollback()
+
+                # Later events wait for this one unless it is given up on.
+                if not stripe_event.record_failure(e):
+                    raise
+
+                continue
+
+            processed += 1
+    except Exception as e:
+        db.session.rollback()
+        raise self.retry(exc=e, countdown=min(2 ** self.request.retries, 300))
+    finally:
+        lock.release()
+
+    return processed
+
+
+@celery.task()
+def process_stale_stripe_events():
+    """
+    Re-enqueue customers whose webhook events are still pending, in case
+    their task was lost.
+
+    :return: int
+    """
+    received_before = tz_aware_datetime() - timedelta(minutes=5)
+
+    customer_ids = (
+        db.session.query(StripeEvent.customer_id)
+        .filter(
+            StripeEvent.processed_on.is_(None),
+            StripeEvent.failed_on.is_(None),
+            StripeEvent.created_on < received_before,
+        )
+        .distinct()
+    )
+
+    count = 0
+
+    for (customer_id,) in customer_ids:
+        process_stripe_events.delay(customer_id)
+        count += 1
+
+    return count
@@ -8,9 +8,11 @@ from flask import url_for
 from flask_babel import gettext as _
 from flask_login import current_user
 from flask_login import login_required
+from stripe.error import APIConnectionError
 
-from config import settings
 from lib.src.util_json import render_json
+from snake_eyes.blueprints.billing.cache import CouponCache
+from snake_eyes.blueprints.billing.cache import UpcomingInvoiceCache
 from snake_eyes.blueprints.billing.decorators import handle_stripe_exceptions
 from snake_eyes.blueprints.billing.decorators import subscription_required
 from snake_eyes.blueprints.billing.forms import CancelSubscriptionForm
@@ -20,6 +22,7 @@ from snake_eyes.blueprints.billing.forms import UpdateSubscriptionForm
 from snake_eyes.blueprints.billing.models.coupon import Coupon
 from snake_eyes.blueprints.billing.models.invoice import Invoice
 from snake_eyes.blueprints.billing.models.subscription import Subscription
+from snake_eyes.blueprints.billing.plans import plan_registry
 
 
 bp = Blueprint(
@@ -34,9 +37,7 @@ def pricing():
 
     form = UpdateSubscriptionForm()
 
-    return render_template(
-        "billing/pricing.html", form=form, plans=settings.STRIPE_PLANS
-    )
+    return render_template("billing/pricing.html", form=form, plans=plan_registry.all())
 
 
 @bp.route("/coupon_code", methods=["POST"])
@@ -47,12 +48,12 @@ def coupon_code():
     if code is None:
         return render_json(422, {"error": "Coupon code can not be processed"})
 
-    coupon = Coupon.find_by_code(code)
+    coupon = CouponCache.lookup(code)
 
     return (
         render_json(404, {"error": "Coupon code not found"})
         if coupon is None
-        else render_json(200, {"data": coupon.to_json()})
+        else render_json(200, {"data": coupon})
     )
 
 
@@ -65,7 +66,7 @@ def create():
         return redirect(url_for("user.settings"))
 
     plan = request.args.get("plan")
-    subscription_plan = Subscription.get_plan_by_id(plan)
+    subscription_plan = plan_registry.get(plan)
 
     if subscription_plan is None and request.method == "GET":
         flash(_("Sorry the plan does not exists"), "error")
@@ -102,10 +103,10 @@ def create():
 @subscription_required
 def update():
     current_plan = current_user.subscription.plan
-    active_plan = Subscription.get_plan_by_id(current_plan)
-    new_plan = Subscription.get_new_plan(request.form.keys())
+    active_plan = plan_registry.get(current_plan)
+    new_plan = plan_registry.from_form_keys(request.form.keys())
 
-    plan = Subscription.get_plan_by_id(new_plan)
+    plan = plan_registry.get(new_plan)
 
     is_same_plan = new_plan == active_plan["id"]
     if (new_plan is not None and plan is None) or is_same_plan:
@@ -129,7 +130,7 @@ def update():
     return render_template(
         "billing/pricing.html",
         form=form,
-        plans=settings.STRIPE_PLANS,
+        plans=plan_registry.all(),
         active_plan=active_plan,
     )
 
@@ -166,7 +167,7 @@ def update_payment_method():
         flash(_("You do not have a payment method added"), "error")
         return redirect(url_for("user.settings"))
 
-    active_plan = Subscription.get_plan_by_id(current_user.subscription.plan)
+    active_plan = plan_registry.get(current_user.subscription.plan)
     card = current_user.credit_card
 
     form = SubscriptionForm(
@@ -199,20 +200,25 @@ def update_payment_method():
     )
 
 
-@bp.route("/billing_details", defaults={"page": 1})
-@bp.route("/billing_details/page/<int:page>")
+@bp.route("/billing_details")
 @login_required
 @handle_stripe_exceptions
-def billing_details(page):
-    paginated_invoices = (
-        Invoice.query.filter(Invoice.user_id == current_user.id)
-        .order_by(Invoice.created_on.desc())
-        .paginate(page, 12, True)
+def billing_details():
+    paginated_invoices = Invoice.seek(
+        Invoice.query.filter(Invoice.user_id == current_user.id),
+        cursor=request.args.get("cursor"),
+        per_page=12,
     )
 
-    upcoming = (
-        Invoice.upcoming(current_user.payment_id) if current_user.subscription else None
-    )
+    upcoming = None
+    upcoming_unavailable = False
+
+    if current_user.subscription:
+        try:
+            upcoming = UpcomingInvoiceCache.get(current_user.payment_id)
+        except APIConnectionError:
+            upcoming_unavailable = True
+
     coupon = (
         Coupon.query.filter(Coupon.code == current_user.subscription.coupon).first()
         if current_user.subscription
@@ -223,12 +229,14 @@ def billing_details(page):
         "billing/billing_details.html",
         paginated_invoices=paginated_invoices,
         upcoming=upcoming,
+        upcoming_unavailable=upcoming_unavailable,
         coupon=coupon,
     )
 
 
 @bp.route("/purchase_coins", methods=["GET", "POST"])
 @login_required
+@handle_stripe_exceptions
 def purchase_coins():
     form = PaymentForm(stripe_key=current_app.config.get("STRIPE_PUBLISHABLE_KEY"))
 
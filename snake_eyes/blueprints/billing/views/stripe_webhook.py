@@ -1,13 +1,13 @@
 from flask import Blueprint
+from flask import current_app
 from flask import request
-from stripe.error import InvalidRequestError
 
 from lib.src.util_json import render_json
 from snake_eyes.blueprints.billing.gateways.stripecom import (
-    Event as PaymentEvent,
+    SignatureVerificationError,
 )
-from snake_eyes.blueprints.billing.models.invoice import Invoice
-from snake_eyes.blueprints.billing.models.subscription import Subscription
+from snake_eyes.blueprints.billing.gateways.stripecom import Webhook
+from snake_eyes.blueprints.billing.models.stripe_event import StripeEvent
 from snake_eyes.extensions import csrf
 
 
@@ -17,24 +17,36 @@ bp = Blueprint("stripe_webhook", __name__, url_prefix="/stripe_webhook")
 @bp.route("/event", methods=["POST"])
 @csrf.exempt
 def event():
-    if not request.json:
+    if request.mimetype != "application/json":
         return render_json(406, {"error": "Mime-Type is not application/json"})
 
-    if request.json.get("id") is None:
+    try:
+        safe_event = Webhook.construct_event(
+            request.get_data(),
+            request.headers.get("Stripe-Signature"),
+            current_app.config["STRIPE_WEBHOOK_SECRET"],
+            current_app.config["STRIPE_WEBHOOK_TOLERANCE"],
+        )
+    except SignatureVerificationError as e:
+        return render_json(400, {"error": str(e)})
+
+    if not isinstance(safe_event, dict) or safe_event.get("id") is None:
         return render_json(406, {"error": "Invalid stripe event"})
 
-    try:
-        safe_event = PaymentEvent.retrieve(request.json.get("id"))
-        parsed_event = Invoice.parse_from_event(safe_event)
-
-        user = Invoice.prepare_and_save(parsed_event)
-
-        if parsed_event.get("total") > 0:
-            plan = Subscription.get_plan_by_id(user.subscription.plan)
-            user.add_coins(plan)
-    except InvalidRequestError as e:
-        return render_json(422, {"error": str(e)})
-    except Exception as e:
-        return render_json(200, {"error": str(e)})
+    data = safe_event.get("data") or {}
+    stripe_object = data.get("object") if isinstance(data, dict) else None
+    customer_id = None
+
+    if isinstance(stripe_object, dict):
+        customer_id = stripe_object.get("customer")
+
+    recorded = StripeEvent.record(
+        safe_event["id"], customer_id, safe_event.get("type"), safe_event
+    )
+
+    if recorded:
+        from snake_eyes.blueprints.billing.tasks import process_stripe_events
+
+        process_stripe_events.delay(customer_id)
 
     return render_json(200, {"success": True})
@@ -1,13 +1,11 @@
-from uuid import uuid4
-from snake_eyes.app import create_celery
-from requests import post
-from requests.exceptions import RequestException
+from lib.src.util_email import RETRY_OPTIONS
+from snake_eyes.app import celery
+from snake_eyes.extensions import email_client
+from snake_eyes.tasks import send_email
 
-celery = create_celery()
 
-
-@celery.task()
-def deliver_contact_email(email, message):
+@celery.task(bind=True, **RETRY_OPTIONS)
+def deliver_contact_email(self, email, message):
     """
     Send a contact e-mail.
 
@@ -17,16 +15,13 @@ def deliver_contact_email(email, message):
     :type user_id: str
     :return: None
     """
-    try:
-        url = f"{celery.conf.get('EMAIL_SERVICE_HOST')}/api/email/"
-        payload = {
-            "sender": email,
-            "receiver": celery.conf.get("MAIL_USERNAME"),
-            "subject": "[Snake Eyes] Contact",
-            "template_id": 1,
-            "request_id": uuid4().hex,
-            "template_params": {"email": email, "message": message}
-        }
-        response = post(url, json=payload, headers={"Accept": "application/json"})
-    except RequestException as e:
-        print(f"[********] UNABLE TO DELIEVER MAIL {e}")
+    send_email(
+        email_client.message(
+            celery.conf.get("MAIL_USERNAME"),
+            "[Snake Eyes] Contact",
+            1,
+            {"email": email, "message": message},
+            sender=email,
+            request_id=self.request.id,
+        )
+    )
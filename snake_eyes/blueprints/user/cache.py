@@ -0,0 +1,231 @@
+from pickle import dumps
+from pickle import loads
+
+from flask import current_app
+from flask_sqlalchemy import SignallingSession
+from redis.exceptions import RedisError
+from sqlalchemy import event
+from sqlalchemy.orm import class_mapper
+from sqlalchemy.orm import make_transient_to_detached
+
+from snake_eyes.blueprints.billing.models.credit_card import CreditCard
+from snake_eyes.blueprints.billing.models.subscription import Subscription
+from snake_eyes.blueprints.user.models import User
+from snake_eyes.extensions import db
+from snake_eyes.extensions import redis
+
+
+class UserCache:
+    """
+    Cache of a user row along with their subscription and credit card,
+    shared by every worker through Redis.
+
+    Only the columns listed below are cached, the others such as the
+    password hash or the coins, which must never be stale, are loaded from
+    the db when accessed. Every invalidation bumps the version of the user,
+    a lookup only caches what it read when the version did not change in
+    the meantime.
+    """
+
+    PENDING_KEY = "user_cache_invalidations"
+    # Seconds the version of a user is kept, well past any lookup
+    VERSION_TTL = 86400
+    USER_FIELDS = (
+        "id",
+        "role",
+        "active",
+        "username",
+        "email",
+        "name",
+        "payment_id",
+        "cancelled_subscription_on",
+        "previous_plan",
+        "last_bet_on",
+        "locale",
+    )
+    SUBSCRIPTION_FIELDS = ("id", "user_id", "plan", "coupon")
+    CREDIT_CARD_FIELDS = ("id", "user_id", "brand", "last4", "exp_date", "is_expiring")
+
+    @classmethod
+    def key(cls, user_id):
+        """
+        Cache key of a user
+
+        :param user_id: ID of the user
+        :type user_id: int
+        :return: str
+        """
+        return f"user:{user_id}"
+
+    @classmethod
+    def version_key(cls, user_id):
+        """
+        Key of the version of a user, bumped on invalidation
+
+        :param user_id: ID of the user
+        :type user_id: int
+        :return: str
+        """
+        return f"user:{user_id}:version"
+
+    @classmethod
+    def get(cls, user_id):
+        """
+        Return a user attached to the current session, from the cache when
+        possible, otherwise from the db with their billing rows eager loaded.
+
+        :param user_id: ID of the user
+        :type user_id: int or str
+        :return: User or None
+        """
+        ttl = current_app.config["USER_CACHE_TTL"]
+        key = UserCache.key(user_id)
+        version_key = UserCache.version_key(user_id)
+        version = None
+
+        if ttl:
+            try:
+                cached, version = redis.get_with_version(key, version_key)
+
+                if cached is not None:
+                    return UserCache.restore(loads(cached))
+            except RedisError as e:
+                current_app.logger.warning(f"User cache unavailable: {e}")
+
+        user = User.with_billing().get(int(user_id))
+
+        if user is not None and version is not None:
+            try:
+                redis.setex_if_version(
+                    key, version_key, version, ttl, dumps(UserCache.dump(user))
+                )
+            except RedisError as e:
+                current_app.logger.warning(f"User cache unavailable: {e}")
+
+        return user
+
+    @classmethod
+    def dump(cls, user):
+        """
+        Cached columns of a user and their billing rows.
+
+        :param user: User with their billing rows loaded
+        :type user: User
+        :return: dict
+        """
+        return {
+            "user": UserCache.fields(user, UserCache.USER_FIELDS),
+            "subscription": UserCache.fields(
+                user.subscription, UserCache.SUBSCRIPTION_FIELDS
+            ),
+            "credit_card": UserCache.fields(
+                user.credit_card, UserCache.CREDIT_CARD_FIELDS
+            ),
+        }
+
+    @classmethod
+    def restore(cls, cached):
+        """
+        Rebuild a cached user and attach it to the current session without
+        reaching the db.
+
+        :param cached: Cached columns
+        :type cached: dict
+        :return: User
+        """
+        user = UserCache.instance(User, cached["user"])
+        user.subscription = UserCache.instance(Subscription, cached["subscription"])
+        user.credit_card = UserCache.instance(CreditCard, cached["credit_card"])
+
+        for instance in (user, user.subscription, user.credit_card):
+            if instance is not None:
+                make_transient_to_detached(instance)
+
+        return db.session.merge(user, load=False)
+
+    @classmethod
+    def fields(cls, instance, names):
+        """
+        Values of some columns of a row.
+
+        :param instance: Model instance
+        :param names: Column names
+        :type names: tuple
+        :return: dict or None
+        """
+        if instance is None:
+            return None
+
+        return {name: getattr(instance, name) for name in names}
+
+    @classmethod
+    def instance(cls, model, values):
+        """
+        Model instance holding only the given values, its constructor is not
+        called since it would set defaults such as an empty password.
+
+        :param model: Model class
+        :param values: Column values
+        :type values: dict or None
+        :return: Model instance or None
+        """
+        if values is None:
+            return None
+
+        instance = class_mapper(model).class_manager.new_instance()
+
+        for name, value in values.items():
+            setattr(instance, name, value)
+
+        return instance
+
+    @classmethod
+    def invalidate(cls, *user_ids):
+        """
+        Drop one or more users from the cache.
+
+        :param user_ids: IDs of the users
+        :type user_ids: int
+        """
+        if not user_ids:
+            return
+
+        keys = [
+            (UserCache.key(user_id), UserCache.version_key(user_id))
+            for user_id in user_ids
+        ]
+
+        try:
+            redis.invalidate_versioned(keys, UserCache.VERSION_TTL)
+        except RedisError as e:
+            current_app.logger.warning(f"User cache unavailable: {e}")
+
+
+@event.listens_for(SignallingSession, "before_flush")
+def collect_user_changes(session, flush_context, instances):
+    """
+    Remember which cached users are changed by this flush
+    """
+    pending = session.info.setdefault(UserCache.PENDING_KEY, set())
+
+    for instance in session.new | session.dirty | session.deleted:
+        if isinstance(instance, User) and instance.id is not None:
+            pending.add(instance.id)
+        elif isinstance(instance, (Subscription, CreditCard)):
+            pending.add(instance.user_id)
+
+
+@event.listens_for(SignallingSession, "after_commit")
+def invalidate_user_changes(session):
+    """
+    Drop the changed users once the transaction is committed
+    """
+    UserCache.invalidate(*session.info.pop(UserCache.PENDING_KEY, ()))
+
+
+@event.listens_for(SignallingSession, "after_soft_rollback")
+def discard_user_changes(session, previous_transaction):
+    """
+    Nothing was written, keep the cache as is
+    """
+    session.info.pop(UserCache.PENDING_KEY, None)
@@ -1,4 +1,6 @@
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
 from datetime import datetime
 from hashlib import md5
 
@@ -8,13 +10,18 @@ from flask_login import UserMixin
 from itsdangerous import TimedJSONWebSignatureSerializer
 from itsdangerous import URLSafeTimedSerializer
 from pytz import utc
-from sqlalchemy import or_
+from sqlalchemy.orm import joinedload
+from stripe.error import StripeError
 from werkzeug.security import check_password_hash
 from werkzeug.security import generate_password_hash
 
 from lib.src.util_sqlalchemy import AwareDateTime
 from lib.src.util_sqlalchemy import ResourceMixin
 from snake_eyes.blueprints.bet.models.bet import Bet
+from snake_eyes.blueprints.billing.cache import UpcomingInvoiceCache
+from snake_eyes.blueprints.billing.gateways.stripecom import (
+    Subscription as PaymentSubscription,
+)
 from snake_eyes.blueprints.billing.models.credit_card import CreditCard
 from snake_eyes.blueprints.billing.models.invoice import Invoice
 from snake_eyes.blueprints.billing.models.subscription import Subscription
@@ -23,6 +30,21 @@ from snake_eyes.extensions import db
 
 class User(UserMixin, ResourceMixin, db.Model):
     __tablename__ = "users"
+    __table_args__ = (
+        db.Index("ix_users_created_on_id", "created_on", "id"),
+        db.Index(
+            "ix_users_email_trgm",
+            "email",
+            postgresql_using="gin",
+            postgresql_ops={"email": "gin_trgm_ops"},
+        ),
+        db.Index(
+            "ix_users_username_trgm",
+            "username",
+            postgresql_using="gin",
+            postgresql_ops={"username": "gin_trgm_ops"},
+        ),
+    )
 
     ROLE = OrderedDict(
         [
@@ -31,6 +53,9 @@ class User(UserMixin, ResourceMixin, db.Model):
         ]
     )
 
+    SEARCH_COLUMNS = ("email", "username")
+    SEARCH_EMAIL_COLUMN = "email"
+
     id = db.Column(db.Integer, primary_key=True)
 
     # Relationships with billing related tables
@@ -83,6 +108,18 @@ class User(UserMixin, ResourceMixin, db.Model):
         self.password = User.encrypt_password(kwargs.get("password", ""))
         self.coins = 100
 
+    @classmethod
+    def with_billing(cls):
+        """
+        Query users along with their subscription and credit card
+        in the same statement.
+
+        :return: SQLAlchemy query
+        """
+        return User.query.options(
+            joinedload(User.subscription), joinedload(User.credit_card)
+        )
+
     @classmethod
     def find_by_identity(cls, identity):
         """
@@ -142,25 +179,6 @@ class User(UserMixin, ResourceMixin, db.Model):
 
         return user
 
-    @classmethod
-    def search(cls, query):
-        """
-        Search a resource by one or more fields
-        :param query: Search query
-        :type query: str
-        return: SQLAlchemy filter
-        """
-        if not query:
-            return ""
-
-        search_query = f"%{query}%"
-        search_chain = (
-            User.email.ilike(search_query),
-            User.username.ilike(search_query),
-        )
-
-        return or_(*search_chain)
-
     @classmethod
     def is_last_admin(cls, user, new_role, new_active):
         """
@@ -191,33 +209,122 @@ class User(UserMixin, ResourceMixin, db.Model):
     def bulk_delete(cls, ids):
         """
         Override the general bulk delete method.
-        Users need to be deleted one at a time
-        from our db and also from stripe
+        Subscribed users also have their subscription cancelled on stripe.
 
         :param ids: List of ids to be deleted
         :type ids: list
         :return: int
         """
-        delete_count = 0
+        deleted, _ = User.cancel_and_delete(ids)
+
+        return User.delete_unsubscribed(ids) + deleted
+
+    @classmethod
+    def delete_unsubscribed(cls, ids):
+        """
+        Delete the users without a subscription in a single statement.
+
+        :param ids: List of ids to be deleted
+        :type ids: list
+        :return: int
+        """
+        statement = (
+            User.__table__.delete()
+            .where(User.id.in_(ids))
+            .where(User.payment_id.is_(None))
+            .returning(User.id)
+        )
+
+        deleted_ids = [row.id for row in db.session.execute(statement)]
+        db.session.commit()
+
+        User.invalidate_users(deleted_ids)
+
+        return len(deleted_ids)
+
+    @classmethod
+    def subscribed_ids(cls, ids):
+        """
+        The ids of the users who have a subscription.
+
+        :param ids: List of ids to look through
+        :type ids: list
+        :return: list
+        """
+        query = db.session.query(User.id).filter(
+            User.id.in_(ids), User.payment_id.isnot(None)
+        )
 
-        for _id in ids:
-            user = User.query.get(_id)
+        return [row.id for row in query.order_by(User.id)]
 
-            if user is None:
-                continue
+    @classmethod
+    def cancel_and_delete(cls, ids, workers=1):
+        """
+        Cancel the subscriptions of the users on stripe concurrently, then
+        delete the users whose subscription was cancelled.
 
-            if user.payment_id is None:
-                user.delete()
-            else:
-                subscription = Subscription()
-                cancelled = subscription.cancel(user=user)
+        :param ids: List of ids to be deleted
+        :type ids: list
+        :param workers: How many cancellations run at once
+        :type workers: int
+        :return: tuple, deleted and failed counts
+        """
+        customers = (
+            db.session.query(User.id, User.payment_id)
+            .filter(User.id.in_(ids), User.payment_id.isnot(None))
+            .all()
+        )
 
-                if cancelled:
-                    user.delete()
+        if not customers:
+            return 0, 0
 
-            delete_count += 1
+        cancelled_ids = []
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(PaymentSubscription.cancel, payment_id): (
+                    user_id,
+                    payment_id,
+                )
+                for user_id, payment_id in customers
+            }
+
+            for future in as_completed(futures):
+                user_id, payment_id = futures[future]
+
+                try:
+                    future.result()
+                except StripeError as e:
+                    current_app.logger.warning(
+                        f"Could not cancel the subscription of user {user_id}: {e}"
+                    )
+                    continue
+
+                UpcomingInvoiceCache.invalidate(payment_id)
+                cancelled_ids.append(user_id)
+
+        if cancelled_ids:
+            User.query.filter(User.id.in_(cancelled_ids)).delete(
+                synchronize_session=False
+            )
+            db.session.commit()
+
+            User.invalidate_users(cancelled_ids)
+
+        return len(cancelled_ids), len(customers) - len(cancelled_ids)
+
+    @classmethod
+    def invalidate_users(cls, ids):
+        """
+        Rows deleted outside of the ORM have to be dropped from the user
+        cache by hand.
+
+        :param ids: IDs of the users
+        :type ids: list
+        """
+        from snake_eyes.blueprints.user.cache import UserCache
 
-        return delete_count
+        UserCache.invalidate(*ids)
 
     def is_active(self):
         """
@@ -297,5 +404,5 @@ class User(UserMixin, ResourceMixin, db.Model):
         :type plan: str
         :return: SQLAlchemy commit results
         """
-        self.coins += plan["metadata"]["coins"]
+        self.coins = User.coins + plan["metadata"]["coins"]
         return self.save()
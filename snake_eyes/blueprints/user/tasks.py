@@ -1,16 +1,12 @@
-from uuid import uuid4
-
-from snake_eyes.app import create_celery
+from lib.src.util_email import RETRY_OPTIONS
+from snake_eyes.app import celery
 from snake_eyes.blueprints.user.models import User
-from requests import post
-from requests.exceptions import RequestException
-
-
-celery = create_celery()
+from snake_eyes.extensions import email_client
+from snake_eyes.tasks import send_email
 
 
-@celery.task()
-def deliever_password_reset_mail(user_id, reset_password_url):
+@celery.task(bind=True, **RETRY_OPTIONS)
+def deliever_password_reset_mail(self, user_id, reset_password_url):
     """
     Send a password reset email to the suer
 
@@ -22,16 +18,15 @@ def deliever_password_reset_mail(user_id, reset_password_url):
     user = User.query.get(user_id)
 
     if user is not None:
-        try:
-            url = f"{celery.conf.get('EMAIL_SERVICE_HOST')}/api/email/"
-            payload = {
-                "sender": celery.conf.get("MAIL_DEFAULT_SENDER"),
-                "receiver": user.email,
-                "subject": "Password reset from snake eyes",
-                "template_id": 2,
-                "request_id": uuid4().hex,
-                "template_params": {"username": user.username, "reset_password_url": reset_password_url}
-            }
-            response = post(url, json=payload, headers={"Accept": "application/json"})
-        except RequestException as e:
-            print(f"[********] UNABLE TO DELIEVER MAIL {e}")
+        send_email(
+            email_client.message(
+                user.email,
+                "Password reset from snake eyes",
+                2,
+                {
+                    "username": user.username,
+                    "reset_password_url": reset_password_url,
+                },
+                request_id=self.request.id,
+            )
+        )
@@ -5,9 +5,16 @@ from flask_login import LoginManager
 from flask_sqlalchemy import SQLAlchemy
 from flask_wtf import CsrfProtect
 
+from lib.src.util_email import EmailClient
+from lib.src.util_query_stats import QueryStats
+from lib.src.util_redis import Redis
+
 
 db = SQLAlchemy()
 login_manager = LoginManager()
 csrf = CsrfProtect()
 limiter = Limiter(key_func=get_remote_address)
 babel = Babel()
+redis = Redis()
+email_client = EmailClient()
+query_stats = QueryStats()
@@ -0,0 +1,48 @@
+from alembic import op
+
+
+"""
+Keyset pagination indexes
+
+Revision ID: 002
+Revises: 001
+Create Date: 2026-10-18 10:12:31.204518
+"""
+
+# revision identifiers, used by Alembic.
+revision = "002"
+down_revision = "001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        "ix_bets_user_id_created_on_id",
+        "bets",
+        ["user_id", "created_on", "id"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_invoices_created_on_id", "invoices", ["created_on", "id"], unique=False
+    )
+    op.create_index(
+        "ix_invoices_user_id_created_on_id",
+        "invoices",
+        ["user_id", "created_on", "id"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_users_created_on_id", "users", ["created_on", "id"], unique=False
+    )
+    op.create_index(
+        "ix_coupons_created_on_id", "coupons", ["created_on", "id"], unique=False
+    )
+
+
+def downgrade():
+    op.drop_index("ix_coupons_created_on_id", table_name="coupons")
+    op.drop_index("ix_users_created_on_id", table_name="users")
+    op.drop_index("ix_invoices_user_id_created_on_id", table_name="invoices")
+    op.drop_index("ix_invoices_created_on_id", table_name="invoices")
+    op.drop_index("ix_bets_user_id_created_on_id", table_name="bets")
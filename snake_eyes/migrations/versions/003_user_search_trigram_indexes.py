@@ -0,0 +1,41 @@
+from alembic import op
+
+
+"""
+User search trigram indexes
+
+Revision ID: 003
+Revises: 002
+Create Date: 2026-10-18 11:02:47.913052
+"""
+
+# revision identifiers, used by Alembic.
+revision = "003"
+down_revision = "002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.create_index(
+        "ix_users_email_trgm",
+        "users",
+        ["email"],
+        unique=False,
+        postgresql_using="gin",
+        postgresql_ops={"email": "gin_trgm_ops"},
+    )
+    op.create_index(
+        "ix_users_username_trgm",
+        "users",
+        ["username"],
+        unique=False,
+        postgresql_using="gin",
+        postgresql_ops={"username": "gin_trgm_ops"},
+    )
+
+
+def downgrade():
+    op.drop_index("ix_users_username_trgm", table_name="users")
+    op.drop_index("ix_users_email_trgm", table_name="users")
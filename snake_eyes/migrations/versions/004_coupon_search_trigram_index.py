@@ -0,0 +1,32 @@
+from alembic import op
+
+
+"""
+Coupon search trigram index
+
+Revision ID: 004
+Revises: 003
+Create Date: 2026-10-18 11:40:05.671384
+"""
+
+# revision identifiers, used by Alembic.
+revision = "004"
+down_revision = "003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.create_index(
+        "ix_coupons_code_trgm",
+        "coupons",
+        ["code"],
+        unique=False,
+        postgresql_using="gin",
+        postgresql_ops={"code": "gin_trgm_ops"},
+    )
+
+
+def downgrade():
+    op.drop_index("ix_coupons_code_trgm", table_name="coupons")
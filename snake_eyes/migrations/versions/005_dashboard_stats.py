@@ -0,0 +1,41 @@
+import sqlalchemy as sa
+
+from alembic import op
+
+from lib.src.util_sqlalchemy import AwareDateTime
+
+
+"""
+Dashboard stats snapshot
+
+Revision ID: 005
+Revises: 004
+Create Date: 2026-10-18 12:21:36.448170
+"""
+
+# revision identifiers, used by Alembic.
+revision = "005"
+down_revision = "004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "dashboard_stats",
+        sa.Column("created_on", AwareDateTime(timezone=True), nullable=True),
+        sa.Column("updated_on", AwareDateTime(timezone=True), nullable=True),
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("stat", sa.String(length=32), nullable=False),
+        sa.Column("label", sa.String(length=128), nullable=True),
+        sa.Column("count", sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_dashboard_stats_stat"), "dashboard_stats", ["stat"], unique=False
+    )
+
+
+def downgrade():
+    op.drop_index(op.f("ix_dashboard_stats_stat"), table_name="dashboard_stats")
+    op.drop_table("dashboard_stats")
@@ -0,0 +1,59 @@
+import sqlalchemy as sa
+
+from alembic import op
+
+from lib.src.util_sqlalchemy import AwareDateTime
+
+
+"""
+Stripe webhook events
+
+Revision ID: 006
+Revises: 005
+Create Date: 2026-10-18 13:02:11.514372
+"""
+
+# revision identifiers, used by Alembic.
+revision = "006"
+down_revision = "005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "stripe_events",
+        sa.Column("created_on", AwareDateTime(timezone=True), nullable=True),
+        sa.Column("updated_on", AwareDateTime(timezone=True), nullable=True),
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("event_id", sa.String(length=255), nullable=False),
+        sa.Column("event_type", sa.String(length=128), nullable=True),
+        sa.Column("customer_id", sa.String(length=128), nullable=True),
+        sa.Column("processed_on", AwareDateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_stripe_events_event_id"),
+        "stripe_events",
+        ["event_id"],
+        unique=True,
+    )
+    op.create_index(
+        op.f("ix_stripe_events_customer_id"),
+        "stripe_events",
+        ["customer_id"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_stripe_events_processed_on"),
+        "stripe_events",
+        ["processed_on"],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index(op.f("ix_stripe_events_processed_on"), table_name="stripe_events")
+    op.drop_index(op.f("ix_stripe_events_customer_id"), table_name="stripe_events")
+    op.drop_index(op.f("ix_stripe_events_event_id"), table_name="stripe_events")
+    op.drop_table("stripe_events")
@@ -0,0 +1,26 @@
+import sqlalchemy as sa
+
+from alembic import op
+
+
+"""
+Store the verified Stripe webhook payload
+
+Revision ID: 007
+Revises: 006
+Create Date: 2026-10-18 13:41:52.207115
+"""
+
+# revision identifiers, used by Alembic.
+revision = "007"
+down_revision = "006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("stripe_events", sa.Column("payload", sa.JSON(), nullable=True))
+
+
+def downgrade():
+    op.drop_column("stripe_events", "payload")
@@ -0,0 +1,40 @@
+import sqlalchemy as sa
+
+from alembic import op
+
+
+"""
+Partial indexes for the nightly card and coupon maintenance
+
+Revision ID: 008
+Revises: 007
+Create Date: 2026-10-18 16:02:37.418226
+"""
+
+# revision identifiers, used by Alembic.
+revision = "008"
+down_revision = "007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        "ix_credit_cards_exp_date_not_expiring",
+        "credit_cards",
+        ["exp_date"],
+        unique=False,
+        postgresql_where=sa.text("NOT is_expiring"),
+    )
+    op.create_index(
+        "ix_coupons_redeem_by_valid",
+        "coupons",
+        ["redeem_by"],
+        unique=False,
+        postgresql_where=sa.text("valid"),
+    )
+
+
+def downgrade():
+    op.drop_index("ix_coupons_redeem_by_valid", table_name="coupons")
+    op.drop_index("ix_credit_cards_exp_date_not_expiring", table_name="credit_cards")
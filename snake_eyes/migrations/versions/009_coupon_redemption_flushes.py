@@ -0,0 +1,45 @@
+import sqlalchemy as sa
+
+from alembic import op
+
+from lib.src.util_sqlalchemy import AwareDateTime
+
+
+"""
+Batches of coupon redemptions flushed from Redis
+
+Revision ID: 009
+Revises: 008
+Create Date: 2026-10-18 19:12:45.608213
+"""
+
+# revision identifiers, used by Alembic.
+revision = "009"
+down_revision = "008"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "coupon_redemption_flushes",
+        sa.Column("created_on", AwareDateTime(timezone=True), nullable=True),
+        sa.Column("updated_on", AwareDateTime(timezone=True), nullable=True),
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("batch_id", sa.String(length=32), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_coupon_redemption_flushes_batch_id"),
+        "coupon_redemption_flushes",
+        ["batch_id"],
+        unique=True,
+    )
+
+
+def downgrade():
+    op.drop_index(
+        op.f("ix_coupon_redemption_flushes_batch_id"),
+        table_name="coupon_redemption_flushes",
+    )
+    op.drop_table("coupon_redemption_flushes")
@@ -0,0 +1,38 @@
+import sqlalchemy as sa
+
+from alembic import op
+
+from lib.src.util_sqlalchemy import AwareDateTime
+
+
+"""
+Count failed attempts of Stripe webhook events
+
+Revision ID: 010
+Revises: 009
+Create Date: 2026-10-18 20:04:17.381542
+"""
+
+# revision identifiers, used by Alembic.
+revision = "010"
+down_revision = "009"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "stripe_events",
+        sa.Column("attempts", sa.Integer(), nullable=False, server_default="0"),
+    )
+    op.add_column("stripe_events", sa.Column("error", sa.Text(), nullable=True))
+    op.add_column(
+        "stripe_events",
+        sa.Column("failed_on", AwareDateTime(timezone=True), nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_column("stripe_events", "failed_on")
+    op.drop_column("stripe_events", "error")
+    op.drop_column("stripe_events", "attempts")
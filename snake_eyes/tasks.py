@@ -0,0 +1,70 @@
+import json
+
+from flask import current_app
+
+from lib.src.util_email import RETRY_OPTIONS
+from lib.src.util_email import EmailServiceError
+from snake_eyes.app import celery
+from snake_eyes.extensions import email_client
+from snake_eyes.extensions import redis
+
+
+EMAIL_OUTBOX_KEY = "email:outbox"
+EMAIL_OUTBOX_SCHEDULED_KEY = "email:outbox:scheduled"
+
+
+def send_email(message):
+    """
+    Send a message right away or, when the e-mail service takes several
+    messages in a single call, queue it in the outbox so that it goes out
+    along with the messages queued within the batch window.
+
+    :param message: Message built by the e-mail client
+    :type message: dict
+    :return: None
+    """
+    if current_app.config["EMAIL_BATCH_SIZE"] <= 1 or not email_client.bulk:
+        email_client.send(message)
+        return None
+
+    window = current_app.config["EMAIL_BATCH_WINDOW"]
+
+    redis.rpush(EMAIL_OUTBOX_KEY, json.dumps(message))
+
+    if redis.set(EMAIL_OUTBOX_SCHEDULED_KEY, 1, nx=True, ex=window * 10):
+        flush_email_outbox.apply_async(countdown=window)
+
+
+@celery.task(**RETRY_OPTIONS)
+def flush_email_outbox():
+    """
+    Send the queued messages in batches.
+
+    The messages of a batch that were not sent when the e-mail service
+    failed go back to the head of the outbox before the task is retried,
+    the request id of each message lets the e-mail service drop the ones
+    it already received.
+
+    :return: int, number of messages sent
+    """
+    redis.delete(EMAIL_OUTBOX_SCHEDULED_KEY)
+
+    size = current_app.config["EMAIL_BATCH_SIZE"]
+    sent = 0
+
+    while True:
+        pipe = redis.pipeline()
+        pipe.lrange(EMAIL_OUTBOX_KEY, 0, size - 1)
+        pipe.ltrim(EMAIL_OUTBOX_KEY, size, -1)
+        batch, _ = pipe.execute()
+
+        if not batch:
+            return sent
+
+        try:
+            sent += email_client.send_batch([json.loads(raw) for raw in batch])
+        except EmailServiceError as e:
+            if e.unsent:
+                unsent = [json.dumps(message) for message in e.unsent]
+                redis.lpush(EMAIL_OUTBOX_KEY, *reversed(unsent))
+            raise
@@ -0,0 +1,72 @@
+from datetime import timedelta
+
+from mock import patch
+from sqlalchemy import func
+from sqlalchemy import select
+
+from lib.src.util_datetime import tz_aware_datetime
+from snake_eyes.blueprints.admin.models import Dashboard
+from snake_eyes.blueprints.admin.models import DashboardStat
+from snake_eyes.blueprints.admin.tasks import refresh_dashboard_stats
+from snake_eyes.blueprints.user.models import User
+from snake_eyes.extensions import db
+from snake_eyes.extensions import redis
+
+
+class TestDashboardModel:
+    def test_refresh(self, users):
+        """
+        Test the snapshot matches the live aggregates
+        """
+        Dashboard.refresh()
+
+        group_and_count_users = Dashboard.group_and_count_users()
+
+        assert group_and_count_users["total"] == User.query.count()
+        assert sum(count for count, _ in group_and_count_users["query"]) == 2
+
+    def test_refresh_skipped_while_locked(self, users):
+        """
+        Test a refresh running alongside another one keeps the snapshot
+        """
+        Dashboard.refresh()
+        snapshot = DashboardStat.query.count()
+
+        with db.engine.connect() as connection:
+            connection.execute(
+                select([func.pg_advisory_lock(Dashboard.REFRESH_LOCK_ID)])
+            )
+
+            try:
+                assert Dashboard.refresh() is None
+            finally:
+                connection.execute(
+                    select([func.pg_advisory_unlock(Dashboard.REFRESH_LOCK_ID)])
+                )
+
+        assert DashboardStat.query.count() == snapshot
+        assert Dashboard.refreshed_on() is not None
+
+    def test_is_stale(self):
+        """
+        Test a snapshot is stale when missing or older than the bound
+        """
+        now = tz_aware_datetime()
+
+        assert Dashboard.is_stale(None, 600) is True
+        assert Dashboard.is_stale(now - timedelta(seconds=601), 600) is True
+        assert Dashboard.is_stale(now - timedelta(seconds=60), 600) is False
+
+    def test_queue_refresh_once_per_interval(self):
+        """
+        Test repeated views of a stale dashboard queue a single refresh
+        """
+        redis.delete(Dashboard.REFRESH_QUEUED_KEY)
+
+        with patch.object(refresh_dashboard_stats, "delay") as delay:
+            assert Dashboard.queue_refresh(60) is True
+            assert Dashboard.queue_refresh(60) is False
+
+        redis.delete(Dashboard.REFRESH_QUEUED_KEY)
+
+        assert delay.call_count == 1
@@ -0,0 +1,42 @@
+from pytest import raises
+
+from snake_eyes.blueprints.admin.progress import BulkProgress
+
+
+class TestBulkProgress:
+    def test_latest(self, app):
+        """Test the latest job reports its counts and percentage"""
+        job_id = BulkProgress.start("test_job", 4)
+        BulkProgress.advance("test_job", job_id, done=2, failed=1)
+
+        progress = BulkProgress.latest("test_job")
+
+        assert progress["done"] == 2
+        assert progress["failed"] == 1
+        assert progress["percent"] == 75
+        assert "finished_on" not in progress
+
+        BulkProgress.finish("test_job", job_id)
+
+        assert "finished_on" in BulkProgress.latest("test_job")
+
+    def test_handled(self, app):
+        """Test checkpointed ids are remembered for retries"""
+        job_id = BulkProgress.start("test_job", 3)
+        BulkProgress.advance("test_job", job_id, done=2, handled=[1, 2])
+
+        assert BulkProgress.handled("test_job", job_id) == {1, 2}
+        assert BulkProgress.latest("test_job")["done"] == 2
+
+    def test_failing_on_error(self, app):
+        """Test a job that raises is reported as failed"""
+        job_id = BulkProgress.start("test_job", 2)
+
+        with raises(ValueError):
+            with BulkProgress.failing_on_error("test_job", job_id):
+                raise ValueError("boom")
+
+        progress = BulkProgress.latest("test_job")
+
+        assert progress["error"] == "ValueError: boom"
+        assert "finished_on" in progress
@@ -2,7 +2,9 @@ from flask import url_for
 
 from lib.src.util_tests import ViewTestMixin
 from lib.src.util_tests import assert_status_with_message
+from lib.src.util_tests import capture_queries
 from snake_eyes.blueprints.user.models import User
+from snake_eyes.extensions import db
 
 
 class TestDashboardView(ViewTestMixin):
@@ -28,6 +30,49 @@ class TestUsersView(ViewTestMixin):
 
         assert response.status_code == 200
 
+    def test_index_page_eager_loads_subscriptions(self, subscriptions):
+        """
+        Test index page does not query subscriptions once per user
+        """
+        self.login()
+
+        with capture_queries(db.engine) as statements:
+            response = self.client.get(url_for("admin.users"))
+
+        lazy_loads = [
+            statement
+            for statement in statements
+            if statement.lstrip().startswith("SELECT subscriptions.")
+        ]
+
+        assert response.status_code == 200
+        assert lazy_loads == []
+
+    def test_index_page_server_timing(self, app, monkeypatch):
+        """
+        Test index page reports the queries it sent in Server-Timing
+        """
+        monkeypatch.setitem(app.config, "QUERY_STATS_SERVER_TIMING", True)
+        self.login()
+
+        with capture_queries(db.engine) as statements:
+            response = self.client.get(url_for("admin.users"))
+
+        server_timing = response.headers["Server-Timing"]
+
+        assert server_timing.startswith("db;dur=")
+        assert f'desc="{len(statements)} queries"' in server_timing
+
+    def test_index_page_cursor(self):
+        """
+        Test index page ignores a tampered cursor
+        """
+        self.login()
+
+        response = self.client.get(url_for("admin.users", cursor="tampered"))
+
+        assert_status_with_message(200, response, "admin@localhost")
+
     def test_edit_user_page(self):
         """
         Test edit page renders correctly
@@ -69,3 +114,15 @@ class TestUsersView(ViewTestMixin):
 
         new_count = User.query.count()
         assert old_count == new_count
+
+
+class TestInvoicesView(ViewTestMixin):
+    def test_index_page_search(self):
+        """
+        Test searching invoices by their user renders correctly
+        """
+        self.login()
+
+        response = self.client.get(url_for("admin.invoices", q="admin"))
+
+        assert response.status_code == 200
@@ -0,0 +1,99 @@
+from snake_eyes.blueprints.bet.models.bet import Bet
+from snake_eyes.blueprints.user.models import User
+
+
+def _bet(**kwargs):
+    params = {
+        "guess": 7,
+        "dice_1": 3,
+        "dice_2": 4,
+        "roll": 7,
+        "wagered": 10,
+        "payout": 6.0,
+        "net": 60,
+    }
+    params.update(kwargs)
+
+    return Bet(**params)
+
+
+class TestBetModel:
+    def test_save_and_update_user(self, users):
+        """
+        Winning bet is recorded and credited in one statement
+        """
+        user = User.find_by_identity("admin@localhost")
+        old_coins = user.coins
+
+        bet = _bet()
+
+        assert bet.save_and_update_user(user) is user
+        assert bet.id is not None
+        assert user.coins == old_coins + 60
+        assert user.last_bet_on is not None
+        assert Bet.query.filter(Bet.user_id == user.id).count() == 1
+
+    def test_save_and_update_user_losing_bet(self, users):
+        """
+        Losing bet debits the wager from the user
+        """
+        user = User.find_by_identity("admin@localhost")
+        old_coins = user.coins
+
+        bet = _bet(guess=2, payout=1.0, net=-10)
+        bet.save_and_update_user(user)
+
+        assert user.coins == old_coins - 10
+
+    def test_save_and_update_user_insufficient_coins(self, users):
+        """
+        Wagers above the stored balance are rejected without writing a bet
+        """
+        user = User.find_by_identity("admin@localhost")
+        old_coins = user.coins
+
+        bet = _bet(wagered=old_coins + 1, net=-(old_coins + 1))
+
+        assert bet.save_and_update_user(user) is None
+        assert bet.id is None
+        assert user.coins == old_coins
+        assert Bet.query.filter(Bet.user_id == user.id).count() == 0
+
+    def test_from_wagers(self):
+        """
+        Batch bets follow the same payout rules as single bets
+        """
+        payouts = {"7": 6.0, "12": 36.0}
+        wagers = [(7, 10), (12, 5)]
+
+        bets = Bet.from_wagers(1, wagers, payouts, [3, 1], [4, 2])
+
+        assert [bet.roll for bet in bets] == [7, 3]
+        assert [bet.payout for bet in bets] == [6.0, 1.0]
+        assert [bet.net for bet in bets] == [60, -5]
+
+    def test_bulk_save_and_update_user(self, users):
+        """
+        Batch of bets is recorded with a single coin delta
+        """
+        user = User.find_by_identity("admin@localhost")
+        old_coins = user.coins
+
+        bets = [_bet(), _bet(guess=2, payout=1.0, net=-10)]
+
+        assert Bet.bulk_save_and_update_user(bets, user) is user
+        assert user.coins == old_coins + 50
+        assert Bet.query.filter(Bet.user_id == user.id).count() == 2
+
+    def test_bulk_save_and_update_user_insufficient_coins(self, users):
+        """
+        Batch is rejected when the total wager exceeds the balance
+        """
+        user = User.find_by_identity("admin@localhost")
+        old_coins = user.coins
+
+        bets = [_bet(wagered=old_coins, net=-old_coins), _bet(wagered=1, net=-1)]
+
+        assert Bet.bulk_save_and_update_user(bets, user) is None
+        assert user.coins == old_coins
+        assert Bet.query.filter(Bet.user_id == user.id).count() == 0
@@ -0,0 +1,25 @@
+from flask import url_for
+
+from lib.src.util_tests import ViewTestMixin
+from lib.src.util_tests import assert_status_with_message
+from snake_eyes.blueprints.bet.models.bet import Bet
+from snake_eyes.blueprints.user.models import User
+
+
+class TestHistoryView(ViewTestMixin):
+    def test_history_page(self, users):
+        """
+        Test history page walks through bets with cursors
+        """
+        user = User.find_by_identity("admin@localhost")
+
+        for _ in range(60):
+            self.session.add(
+                Bet(user_id=user.id, guess=7, roll=7, wagered=1, payout=6.0, net=6)
+            )
+        self.session.commit()
+
+        self.login()
+        response = self.client.get(url_for("bet.history"))
+
+        assert_status_with_message(200, response, "cursor=")
@@ -0,0 +1,96 @@
+from mock import patch
+from pytest import fixture
+
+from snake_eyes.blueprints.billing.cache import CouponCache
+from snake_eyes.blueprints.billing.cache import UpcomingInvoiceCache
+from snake_eyes.blueprints.billing.gateways.stripecom import (
+    Invoice as PaymentInvoice,
+)
+from snake_eyes.blueprints.billing.models.coupon import Coupon
+from snake_eyes.extensions import db
+from snake_eyes.extensions import redis
+
+
+UPCOMING_INVOICE_API = {
+    "date": 1433018770,
+    "amount_due": 500,
+    "lines": {
+        "data": [
+            {
+                "plan": {
+                    "name": "Gold",
+                    "statement_descriptor": "GOLD MONTHLY",
+                    "interval": "month",
+                }
+            }
+        ]
+    },
+}
+
+
+class TestUpcomingInvoiceCache:
+    @fixture(autouse=True)
+    def clear_cache(self, app):
+        UpcomingInvoiceCache.invalidate("cus_cache")
+
+        yield
+
+        UpcomingInvoiceCache.invalidate("cus_cache")
+
+    def test_get_caches_upcoming_invoice(self):
+        """Test the upcoming invoice is fetched from Stripe only once"""
+        with patch.object(
+            PaymentInvoice, "upcoming", return_value=UPCOMING_INVOICE_API
+        ) as upcoming:
+            UpcomingInvoiceCache.get("cus_cache")
+            cached = UpcomingInvoiceCache.get("cus_cache")
+
+        assert upcoming.call_count == 1
+        assert cached["plan"] == "Gold"
+
+    def test_invalidate(self):
+        """Test an invalidated customer is fetched again"""
+        with patch.object(
+            PaymentInvoice, "upcoming", return_value=UPCOMING_INVOICE_API
+        ) as upcoming:
+            UpcomingInvoiceCache.get("cus_cache")
+            UpcomingInvoiceCache.invalidate("cus_cache")
+            UpcomingInvoiceCache.get("cus_cache")
+
+        assert upcoming.call_count == 2
+
+
+class TestCouponCache:
+    def test_lookup_caches_missing_code(self, coupons):
+        """Test an unknown code is looked up in the db only once"""
+        CouponCache.invalidate("NOPE")
+
+        with patch.object(Coupon, "find_by_code", return_value=None) as find:
+            assert CouponCache.lookup("nope") is None
+            assert CouponCache.lookup("NOPE") is None
+
+        assert find.call_count == 1
+
+    def test_redeem_invalidates_code(self, coupons):
+        """Test redeeming a coupon drops its cached lookup"""
+        coupon = Coupon.query.filter(Coupon.redeem_by.is_(None)).first()
+        CouponCache.lookup(coupon.code)
+
+        Coupon.redeem_code(coupon.code)
+        db.session.commit()
+
+        assert not redis.exists(CouponCache.key(coupon.code))
+
+    def test_lookup_skips_invalidated_code(self, coupons):
+        """Test a lookup racing an invalidation does not cache what it read"""
+        CouponCache.invalidate("RACE")
+
+        def find_by_code(code):
+            CouponCache.invalidate(code)
+
+            return None
+
+        with patch.object(Coupon, "find_by_code", side_effect=find_by_code):
+            assert CouponCache.lookup("RACE") is None
+
+        assert not redis.exists(CouponCache.key("RACE"))
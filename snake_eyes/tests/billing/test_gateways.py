@@ -0,0 +1,127 @@
+import time
+
+from mock import Mock
+from mock import patch
+from pytest import fixture
+from pytest import raises
+from requests import Session
+from requests.exceptions import ConnectionError
+from stripe.error import APIConnectionError
+
+from snake_eyes.blueprints.billing.gateways.breaker import CircuitBreaker
+from snake_eyes.blueprints.billing.gateways.breaker import CircuitOpenError
+from snake_eyes.blueprints.billing.gateways.stripecom import (
+    SignatureVerificationError,
+)
+from snake_eyes.blueprints.billing.gateways.stripecom import Webhook
+from snake_eyes.blueprints.billing.gateways.transport import PooledHTTPClient
+from snake_eyes.blueprints.billing.gateways.transport import metrics
+from snake_eyes.blueprints.billing.gateways.transport import timed
+from snake_eyes.extensions import redis
+
+
+PAYLOAD = b'{"id": "evt_000", "type": "invoice.created"}'
+KEYS = ("open", "tripped", "probe", "failures", "opened", "rejected")
+
+
+class TestWebhook:
+    def test_construct_event(self):
+        """Test a signed payload is verified and decoded"""
+        header = Webhook.sign(PAYLOAD, "whsec_test")
+
+        event = Webhook.construct_event(PAYLOAD, header, "whsec_test", 300)
+
+        assert event["id"] == "evt_000"
+
+    def test_tampered_payload(self):
+        """Test a payload changed after signing is rejected"""
+        header = Webhook.sign(PAYLOAD, "whsec_test")
+
+        with raises(SignatureVerificationError):
+            Webhook.construct_event(PAYLOAD + b" ", header, "whsec_test", 300)
+
+    def test_expired_signature(self):
+        """Test a signature older than the tolerance is rejected"""
+        header = Webhook.sign(PAYLOAD, "whsec_test", int(time.time()) - 301)
+
+        with raises(SignatureVerificationError):
+            Webhook.construct_event(PAYLOAD, header, "whsec_test", 300)
+
+    def test_missing_header(self):
+        """Test a request without a signature is rejected"""
+        with raises(SignatureVerificationError):
+            Webhook.construct_event(PAYLOAD, None, "whsec_test", 300)
+
+
+class TestPooledHTTPClient:
+    def test_retries_transient_status(self):
+        """Test a 503 is retried and POSTs keep one idempotency key"""
+        client = PooledHTTPClient(backoff=0)
+        responses = [
+            Mock(status_code=503, content=b"{}", headers={}),
+            Mock(status_code=200, content=b"{}", headers={}),
+        ]
+
+        with patch.object(Session, "request", side_effect=responses) as request:
+            body, status, _ = client.request("post", "https://api.stripe.com", {})
+
+        keys = {c[1]["headers"]["Idempotency-Key"] for c in request.call_args_list}
+
+        assert status == 200
+        assert request.call_count == 2
+        assert len(keys) == 1
+
+    def test_gives_up_after_max_retries(self):
+        """Test connection errors surface once the retries are spent"""
+        client = PooledHTTPClient(max_retries=1, backoff=0)
+
+        with patch.object(Session, "request", side_effect=ConnectionError()):
+            with raises(APIConnectionError):
+                client.request("get", "https://api.stripe.com", {})
+
+    def test_timed(self):
+        """Test gateway operations record their latency"""
+        metrics.reset()
+
+        timed("test.operation")(lambda: None)()
+
+        assert metrics.snapshot()["test.operation"]["count"] == 1
+
+
+class TestCircuitBreaker:
+    @fixture(autouse=True)
+    def breaker(self, app):
+        self.breaker = CircuitBreaker("test", redis)
+        redis.delete(*[self.breaker.key(k) for k in KEYS])
+
+        yield
+
+        redis.delete(*[self.breaker.key(k) for k in KEYS])
+
+    def test_opens_after_threshold(self):
+        """Test calls fail fast once enough of them failed"""
+        for _ in range(self.breaker.failure_threshold):
+            assert self.breaker.allow() is False
+            self.breaker.record_failure()
+
+        assert self.breaker.state() == CircuitBreaker.OPEN
+
+        with raises(CircuitOpenError):
+            self.breaker.allow()
+
+        assert self.breaker.stats()["rejected"] == 1
+
+    def test_probe_closes_circuit(self):
+        """Test a single probe is let through and its success closes it"""
+        self.breaker.record_failure(probe=True)
+        redis.delete(self.breaker.key("open"))
+
+        assert self.breaker.state() == CircuitBreaker.HALF_OPEN
+        assert self.breaker.allow() is True
+
+        with raises(CircuitOpenError):
+            self.breaker.allow()
+
+        self.breaker.record_success(probe=True)
+
+        assert self.breaker.state() == CircuitBreaker.CLOSED
@@ -0,0 +1,230 @@
+from datetime import date
+from datetime import datetime
+
+from mock import Mock
+from pytest import raises
+from pytz import utc
+from stripe.error import APIConnectionError
+from stripe.error import InvalidRequestError
+
+from snake_eyes.blueprints.billing.gateways.stripecom import (
+    Charge as PaymentCharge,
+)
+from snake_eyes.blueprints.billing.gateways.stripecom import (
+    Coupon as PaymentCoupon,
+)
+from snake_eyes.blueprints.billing.gateways.stripecom import (
+    Customer as PaymentCustomer,
+)
+from snake_eyes.blueprints.billing.models.coupon import Coupon
+from snake_eyes.blueprints.billing.models.coupon import CouponRedemptionError
+from snake_eyes.blueprints.billing.models.credit_card import CreditCard
+from snake_eyes.blueprints.billing.models.invoice import Invoice
+from snake_eyes.blueprints.billing.models.stripe_event import StripeEvent
+from snake_eyes.blueprints.user.models import User
+from snake_eyes.extensions import db
+
+
+def explain(query):
+    """
+    Plan of a query, sequential scans are disabled so a usable index is
+    picked even on the few rows of the fixtures.
+
+    :param query: SQLAlchemy query
+    :return: str
+    """
+    statement = query.statement.compile(dialect=db.engine.dialect)
+    cursor = db.session.connection().connection.cursor()
+
+    cursor.execute("SET LOCAL enable_seqscan = off")
+    cursor.execute(f"EXPLAIN {statement}", statement.params)
+
+    return "\n".join(row[0] for row in cursor.fetchall())
+
+
+class TestCreditCard:
+    def test_mark_old_credit_cards(self, credit_cards):
+        """Test cards are marked once and left alone afterwards"""
+        report = CreditCard.mark_old_credit_cards(date(2021, 5, 1), chunk_size=1)
+
+        assert report["updated"] == 1
+        assert report["chunks"] == 1
+        assert CreditCard.query.filter(CreditCard.is_expiring).count() == 1
+        assert CreditCard.mark_old_credit_cards(date(2021, 5, 1))["updated"] == 0
+
+    def test_expiring_uses_partial_index(self, credit_cards):
+        """Test the cards left to mark are found through the partial index"""
+        query = db.session.query(CreditCard.id).filter(
+            CreditCard.expiring(date(2021, 5, 1))
+        )
+
+        assert "ix_credit_cards_exp_date_not_expiring" in explain(query)
+
+
+class TestCoupon:
+    def test_expire_old_coupons(self, coupons):
+        """Test expired coupons are invalidated once, in chunks"""
+        compare_datetime = utc.localize(datetime(2021, 7, 1))
+
+        report = Coupon.expire_old_coupons(compare_datetime, chunk_size=1)
+
+        assert report["updated"] == 2
+        assert report["chunks"] == 2
+        assert Coupon.query.filter(Coupon.valid.is_(False)).count() == 2
+        assert Coupon.expire_old_coupons(compare_datetime)["updated"] == 0
+
+    def test_expired_uses_partial_index(self, coupons):
+        """Test the coupons left to expire are found through the partial index"""
+        compare_datetime = utc.localize(datetime(2021, 7, 1))
+        query = db.session.query(Coupon.id).filter(Coupon.expired(compare_datetime))
+
+        assert "ix_coupons_redeem_by_valid" in explain(query)
+
+    def test_redeem_code_stops_at_max_redemptions(self, coupons):
+        """Test a coupon can not be redeemed past its max redemptions"""
+        coupon = Coupon.query.filter(Coupon.redeem_by.is_(None)).first()
+        coupon.max_redemptions = 2
+        coupon.save()
+
+        assert Coupon.redeem_code(coupon.code.lower()) is True
+        assert Coupon.redeem_code(coupon.code) is True
+        assert Coupon.redeem_code(coupon.code) is False
+        db.session.commit()
+
+        db.session.refresh(coupon)
+
+        assert coupon.times_redeemed == 2
+        assert coupon.valid is False
+
+    def test_exhausted_coupon_blocks_purchase(self, coupons, monkeypatch):
+        """Test nothing is charged with a coupon that ran out"""
+        coupon = Coupon.query.filter(Coupon.redeem_by.is_(None)).first()
+        coupon.max_redemptions = 1
+        coupon.times_redeemed = 1
+        coupon.save()
+
+        charge = Mock()
+        monkeypatch.setattr(PaymentCharge, "create", charge)
+        monkeypatch.setattr(PaymentCustomer, "create", Mock())
+        user = User.find_by_identity("admin@localhost")
+        coins = user.coins
+        invoices = Invoice.query.filter(Invoice.user_id == user.id).count()
+
+        with raises(CouponRedemptionError):
+            Invoice().create(
+                user=user,
+                currency="inr",
+                amount=500,
+                coins=100,
+                coupon=coupon.code,
+                token="tok_000",
+            )
+
+        assert charge.called is False
+        assert User.find_by_identity("admin@localhost").coins == coins
+        assert Invoice.query.filter(Invoice.user_id == user.id).count() == invoices
+
+    def test_failed_charge_releases_coupon(self, coupons, monkeypatch):
+        """Test a coupon used up by a charge that failed can be redeemed again"""
+        coupon = Coupon.query.filter(Coupon.redeem_by.is_(None)).first()
+        coupon.max_redemptions = 1
+        coupon.times_redeemed = 0
+        coupon.save()
+
+        monkeypatch.setattr(
+            PaymentCharge, "create", Mock(side_effect=APIConnectionError("down"))
+        )
+        monkeypatch.setattr(PaymentCustomer, "create", Mock())
+
+        with raises(APIConnectionError):
+            Invoice().create(
+                user=User.find_by_identity("admin@localhost"),
+                currency="inr",
+                amount=500,
+                coins=100,
+                coupon=coupon.code,
+                token="tok_000",
+            )
+
+        db.session.refresh(coupon)
+
+        assert coupon.times_redeemed == 0
+        assert coupon.valid is True
+
+    def test_random_coupon_codes(self):
+        """Test generated codes are unique and human readable"""
+        codes = Coupon.random_coupon_codes(1000)
+
+        assert len(set(codes)) == 1000
+        assert all(len(code) == 14 and code.count("-") == 2 for code in codes)
+        assert not set("".join(codes)) & set("BIOS01")
+
+    def test_insert_codes_skips_taken_codes(self, coupons):
+        """Test codes already taken are skipped and new coupons start invalid"""
+        taken = Coupon.query.first().code
+        params = Coupon.generation_params({"amount_off": 1, "duration": "once"})
+
+        inserted = Coupon.insert_codes([taken, "NEW1-NEW2-NEW3"], params)
+
+        assert [code for _, code in inserted] == ["NEW1-NEW2-NEW3"]
+        assert Coupon.query.filter_by(code="NEW1-NEW2-NEW3").one().valid is False
+
+    def test_push_batch_keeps_unconfirmed_coupons(self, coupons, monkeypatch):
+        """Test coupons Stripe may have created are kept for another push"""
+        params = Coupon.generation_params({"amount_off": 1, "duration": "once"})
+        inserted = Coupon.insert_codes(
+            ["KEEP-KEEP-KEEP", "DUPE-DUPE-DUPE", "GONE-GONE-GONE"], params
+        )
+        errors = {
+            "KEEP-KEEP-KEEP": APIConnectionError("timed out"),
+            "DUPE-DUPE-DUPE": InvalidRequestError(
+                "Coupon already exists.",
+                "id",
+                json_body={"error": {"code": "resource_already_exists"}},
+            ),
+            "GONE-GONE-GONE": InvalidRequestError("Invalid amount_off", "amount_off"),
+        }
+
+        def create(code=None, **params):
+            raise errors[code]
+
+        monkeypatch.setattr(PaymentCoupon, "create", create)
+
+        created, failed, retry = Coupon.push_batch(inserted, params)
+
+        assert (created, failed) == (1, 1)
+        assert [code for _, code in retry] == ["KEEP-KEEP-KEEP"]
+        assert Coupon.query.filter_by(code="KEEP-KEEP-KEEP").one().valid is False
+        assert Coupon.query.filter_by(code="DUPE-DUPE-DUPE").one().valid is True
+        assert Coupon.query.filter_by(code="GONE-GONE-GONE").count() == 0
+
+    def test_unpushed(self, coupons):
+        """Test only generated coupons missing on Stripe are pushed again"""
+        params = Coupon.generation_params({"amount_off": 1, "duration": "once"})
+        inserted = Coupon.insert_codes(["PUSH-PUSH-PUSH", "DONE-DONE-DONE"], params)
+        Coupon.query.filter_by(code="DONE-DONE-DONE").update({"valid": True})
+        db.session.commit()
+
+        unpushed = Coupon.unpushed([_id for _id, _ in inserted])
+
+        assert [code for _, code in unpushed] == ["PUSH-PUSH-PUSH"]
+
+
+class TestStripeEvent:
+    def test_failing_event_is_given_up(self, app, session):
+        """Test an event failing too often stops holding back the next ones"""
+        for event_id in ("evt_poison", "evt_next"):
+            StripeEvent.record(
+                event_id, customer_id="cus_poison", event_type="invoice.created"
+            )
+
+        poison = StripeEvent.pending("cus_poison").first()
+        attempts = [
+            poison.record_failure(KeyError("coins"))
+            for _ in range(app.config["STRIPE_EVENT_MAX_ATTEMPTS"])
+        ]
+
+        assert attempts[-1] is True
+        assert not any(attempts[:-1])
+        assert poison.error == "KeyError: 'coins'"
+        assert [e.event_id for e in StripeEvent.pending("cus_poison")] == ["evt_next"]
@@ -0,0 +1,75 @@
+from pytest import fixture
+
+from snake_eyes.blueprints.billing.plans import PlanRegistry
+from snake_eyes.extensions import redis
+
+
+class IsolatedPlanRegistry(PlanRegistry):
+    PLANS_KEY = "test:plans:registry"
+    VERSION_KEY = "test:plans:version"
+
+
+class TestPlans:
+    @fixture(autouse=True)
+    def registry(self, app):
+        self.registry = IsolatedPlanRegistry(app)
+        self.registry.refresh_interval = 0
+        redis.delete(IsolatedPlanRegistry.PLANS_KEY, IsolatedPlanRegistry.VERSION_KEY)
+
+        yield
+
+        redis.delete(IsolatedPlanRegistry.PLANS_KEY, IsolatedPlanRegistry.VERSION_KEY)
+
+    def test_get(self):
+        """Test plans are found by id and by form key"""
+        assert self.registry.get("gold")["name"] == "Gold"
+        assert self.registry.get("nope") is None
+        assert self.registry.from_form_keys(["coupon", "submit_gold"]) == "gold"
+
+    def test_merge_remote(self):
+        """Test Stripe values win and metadata strings are coerced"""
+        remote = [
+            {"id": "gold", "name": "Gold+", "metadata": {"coins": "700"}},
+        ]
+
+        plans = PlanRegistry.merge_remote(self.registry.configured, remote)
+
+        assert plans["1"]["name"] == "Gold+"
+        assert plans["1"]["metadata"] == {"coins": 700, "recommended": True}
+        assert plans["0"] == self.registry.configured["0"]
+
+    def test_merge_remote_keeps_configured_metadata(self):
+        """Test metadata missing on Stripe keeps its configured value"""
+        remote = [{"id": "gold", "metadata": {"recommended": "False"}}]
+
+        plans = PlanRegistry.merge_remote(self.registry.configured, remote)
+
+        assert plans["1"]["metadata"] == {"coins": 600, "recommended": False}
+
+    def test_refresh_if_changed(self, app):
+        """Test other processes pick up published plans"""
+        plans = PlanRegistry.merge_remote(
+            self.registry.configured, [{"id": "gold", "name": "Gold+"}]
+        )
+        IsolatedPlanRegistry(app).publish(plans)
+
+        assert self.registry.refresh_if_changed() is True
+        assert self.registry.get("gold")["name"] == "Gold+"
+        assert self.registry.refresh_if_changed() is False
+
+    def test_diff(self):
+        """Test plans are created, updated or left alone as needed"""
+        gold = dict(self.registry.get("gold"))
+        gold["metadata"] = {k: str(v) for k, v in gold["metadata"].items()}
+        platinum = dict(self.registry.get("platinum"), name="Old name")
+
+        changes = {
+            plan["id"]: (action, fields)
+            for plan, action, fields in PlanRegistry.diff(
+                self.registry.configured, [gold, platinum]
+            )
+        }
+
+        assert changes["bronze"] == ("create", [])
+        assert changes["gold"] == ("unchanged", [])
+        assert changes["platinum"] == ("update", ["name"])
@@ -0,0 +1,55 @@
+from pytest import fixture
+
+from snake_eyes.blueprints.billing.models.coupon import Coupon
+from snake_eyes.blueprints.billing.redemptions import CouponRedemptions
+from snake_eyes.extensions import db
+from snake_eyes.extensions import redis
+
+
+class TestCouponRedemptions:
+    @fixture(autouse=True)
+    def clear_redemptions(self, app):
+        keys = (
+            CouponRedemptions.key("TEST"),
+            CouponRedemptions.PENDING_KEY,
+            CouponRedemptions.FLUSHING_KEY,
+            CouponRedemptions.FLUSHING_BATCH_KEY,
+        )
+        redis.delete(*keys)
+
+        yield
+
+        redis.delete(*keys)
+
+    def test_reserve_stops_at_max_redemptions(self):
+        """Test a coupon can not be reserved past its max redemptions"""
+        assert CouponRedemptions.reserve("TEST", 0, 2) is True
+        assert CouponRedemptions.reserve("TEST", 0, 2) is True
+        assert CouponRedemptions.reserve("TEST", 0, 2) is False
+
+    def test_reserve_counts_redemptions_stored_in_the_db(self):
+        """Test redemptions made while Redis was unavailable are counted"""
+        assert CouponRedemptions.reserve("TEST", 0, 3) is True
+
+        # Two more redemptions went straight to the db in the meantime.
+        assert CouponRedemptions.reserve("TEST", 2, 3) is False
+
+    def test_flush_is_applied_once(self, coupons):
+        """Test a batch handed out again after a failed flush is stored once"""
+        coupon = Coupon.query.filter(Coupon.redeem_by.is_(None)).first()
+        CouponRedemptions.reserve(coupon.code, coupon.times_redeemed, None)
+
+        batch_id, redemptions = CouponRedemptions.take_pending()
+        assert Coupon.apply_redemptions(redemptions, batch_id) == 1
+
+        # The flush died before Redis forgot the batch.
+        assert CouponRedemptions.take_pending() == (batch_id, redemptions)
+        assert Coupon.apply_redemptions(redemptions, batch_id) == 0
+
+        CouponRedemptions.done()
+        db.session.refresh(coupon)
+
+        assert coupon.times_redeemed == 1
+        assert CouponRedemptions.take_pending() == (None, {})
+
+        redis.delete(CouponRedemptions.key(coupon.code))
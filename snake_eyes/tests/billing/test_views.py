@@ -0,0 +1,64 @@
+from flask import url_for
+from mock import patch
+
+from lib.src.util_tests import ViewTestMixin
+from lib.src.util_tests import assert_status_with_message
+from snake_eyes.blueprints.billing.gateways.breaker import CircuitOpenError
+from snake_eyes.blueprints.billing.gateways.stripecom import (
+    Invoice as PaymentInvoice,
+)
+from snake_eyes.blueprints.billing.models.stripe_event import StripeEvent
+
+
+def stripe_event(event_id):
+    return {
+        "id": event_id,
+        "type": "invoice.created",
+        "data": {"object": {"customer": "cus_000"}},
+    }
+
+
+class TestStripeWebhook(ViewTestMixin):
+    def test_event_is_queued(self, stripe_webhook):
+        """Test a new event is recorded and handed to the worker"""
+        with patch(
+            "snake_eyes.blueprints.billing.tasks.process_stripe_events.delay"
+        ) as delay:
+            response = stripe_webhook(stripe_event("evt_queued"))
+
+        stored = StripeEvent.query.filter_by(event_id="evt_queued").one()
+
+        assert response.status_code == 200
+        delay.assert_called_once_with("cus_000")
+        assert stored.payload["data"]["object"]["customer"] == "cus_000"
+
+    def test_replayed_event_is_ignored(self, stripe_webhook):
+        """Test a redelivered event is acknowledged without being queued"""
+        with patch(
+            "snake_eyes.blueprints.billing.tasks.process_stripe_events.delay"
+        ) as delay:
+            stripe_webhook(stripe_event("evt_replayed"))
+            response = stripe_webhook(stripe_event("evt_replayed"))
+
+        assert response.status_code == 200
+        assert delay.call_count == 1
+
+    def test_forged_event_is_rejected(self, stripe_webhook):
+        """Test an event signed with another secret is refused"""
+        response = stripe_webhook(stripe_event("evt_forged"), secret="whsec_nope")
+
+        assert response.status_code == 400
+        assert StripeEvent.query.filter_by(event_id="evt_forged").count() == 0
+
+
+class TestBillingDetails(ViewTestMixin):
+    def test_upcoming_invoice_hidden_when_gateway_down(self, subscriptions):
+        """Test billing details still render while the breaker is open"""
+        self.login(identity="subscriber@localhost")
+
+        with patch.object(
+            PaymentInvoice, "upcoming", side_effect=CircuitOpenError("open")
+        ):
+            response = self.client.get(url_for("billing.billing_details"))
+
+        assert_status_with_message(200, response, "shown right now")
@@ -1,6 +1,12 @@
+import json
+import threading
+
 from datetime import date
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
 
+from flask import url_for
 from mock import Mock
 from pytest import fixture
 from pytz import utc
@@ -23,6 +29,7 @@ from snake_eyes.blueprints.billing.gateways.stripecom import (
 from snake_eyes.blueprints.billing.gateways.stripecom import (
     Subscription as PaymentSubscription,
 )
+from snake_eyes.blueprints.billing.gateways.stripecom import Webhook
 from snake_eyes.blueprints.billing.models.coupon import Coupon
 from snake_eyes.blueprints.billing.models.credit_card import CreditCard
 from snake_eyes.blueprints.billing.models.subscription import Subscription
@@ -43,6 +50,7 @@ def app():
         "WTF_CSRF_ENABLED": False,
         "TESTING": True,
         "SQLALCHEMY_DATABASE_URI": f"{settings.SQLALCHEMY_DATABASE_URI}_test",
+        "STRIPE_WEBHOOK_SECRET": "whsec_test",
     }
     test_app = create_app(settings_override=params)
 
@@ -123,6 +131,8 @@ def users(db):
     """
 
     db.session.query(User).delete()
+    # Other fixtures and tests expect the admin to keep the first id
+    db.session.execute("ALTER SEQUENCE users_id_seq RESTART WITH 1")
 
     users = [
         {"role": "admin", "email": "admin@localhost", "password": "password"},
@@ -321,3 +331,62 @@ def mock_stripe():
     PaymentSubscription.update = Mock(return_value={})
     PaymentSubscription.cancel = Mock(return_value={})
     PaymentInvoice.upcoming = Mock(return_value=upcoming_invoice_api)
+
+
+@fixture(scope="function")
+def stripe_webhook(app, client):
+    """
+    Post Stripe events to the webhook, signed offline with the test secret.
+
+    :param app: Pytest app fixture
+    :param client: Pytest client fixture
+    :return: Function posting an event
+    """
+
+    def post(event, timestamp=None, secret=None):
+        payload = json.dumps(event).encode("utf-8")
+        signature = Webhook.sign(
+            payload, secret or app.config["STRIPE_WEBHOOK_SECRET"], timestamp
+        )
+
+        return client.post(
+            url_for("stripe_webhook.event"),
+            data=payload,
+            content_type="application/json",
+            headers={"Stripe-Signature": signature},
+        )
+
+    return post
+
+
+@fixture(scope="function")
+def email_service():
+    """
+    Local stand-in for the e-mail service recording the calls it received.
+
+    :return: Server with its url, the calls made and the status to answer
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            server.calls.append((self.path, len(body.get("messages", [body]))))
+
+            self.send_response(server.status)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    server.calls = []
+    server.status = 202
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    yield server
+
+    server.shutdown()
@@ -0,0 +1,45 @@
+from pytest import raises
+
+from lib.src.util_email import EmailClient
+from lib.src.util_email import EmailServiceError
+
+
+class TestEmailClient:
+    def test_send_batch_bulk(self, email_service):
+        """Test a bulk send goes out in a single call"""
+        client = EmailClient()
+        client.host = email_service.url
+        client.bulk = True
+
+        messages = [client.message(f"{i}@localhost", "Hi", 1, {}) for i in range(3)]
+
+        assert client.send_batch(messages) == 3
+        assert email_service.calls == [("/api/email/bulk/", 3)]
+
+    def test_send_service_error(self, email_service):
+        """Test failures of the e-mail service are worth retrying"""
+        client = EmailClient()
+        client.host = email_service.url
+        email_service.status = 503
+
+        with raises(EmailServiceError):
+            client.send(client.message("foo@localhost", "Hi", 1, {}))
+
+    def test_send_batch_service_error(self):
+        """Test the messages sent before the service failed are not unsent"""
+        client = EmailClient()
+        messages = [client.message(f"{i}@localhost", "Hi", 1, {}) for i in range(3)]
+        sent = []
+
+        def send(message):
+            if sent:
+                raise EmailServiceError("E-mail service failed with status 503")
+
+            sent.append(message)
+
+        client.send = send
+
+        with raises(EmailServiceError) as e:
+            client.send_batch(messages)
+
+        assert e.value.unsent == messages[1:]
@@ -0,0 +1,58 @@
+from pickle import loads
+
+from mock import patch
+
+from snake_eyes.blueprints.user.cache import UserCache
+from snake_eyes.blueprints.user.models import User
+from snake_eyes.extensions import redis
+
+
+class TestUserCache:
+    def test_get_caches_user(self, users):
+        """Test a loaded user is stored in the cache"""
+        user = User.find_by_identity("admin@localhost")
+        UserCache.invalidate(user.id)
+
+        cached = UserCache.get(user.id)
+
+        assert cached.email == "admin@localhost"
+        assert redis.exists(UserCache.key(user.id))
+
+    def test_save_invalidates_user(self, users):
+        """Test saving a user drops it from the cache"""
+        user = UserCache.get(User.find_by_identity("admin@localhost").id)
+
+        user.coins = 42
+        user.save()
+
+        assert not redis.exists(UserCache.key(user.id))
+        assert UserCache.get(user.id).coins == 42
+
+    def test_get_leaves_out_password(self, users):
+        """Test the password hash is not cached but still loads"""
+        user = User.find_by_identity("admin@localhost")
+        UserCache.invalidate(user.id)
+        UserCache.get(user.id)
+
+        cached = loads(redis.get(UserCache.key(user.id)))
+        user = UserCache.get(user.id)
+
+        assert "password" not in cached["user"]
+        assert "coins" not in cached["user"]
+        assert user.authenticated(password="password")
+
+    def test_get_skips_invalidated_user(self, users):
+        """Test a lookup racing an invalidation does not cache what it read"""
+        user_id = User.find_by_identity("admin@localhost").id
+        UserCache.invalidate(user_id)
+        with_billing = User.with_billing
+
+        def invalidating_query():
+            UserCache.invalidate(user_id)
+
+            return with_billing()
+
+        with patch.object(User, "with_billing", side_effect=invalidating_query):
+            assert UserCache.get(user_id).id == user_id
+
+        assert not redis.exists(UserCache.key(user_id))
@@ -15,3 +15,44 @@ class TestUserModel:
         """Test token deserializer works correctly for tampered token"""
         user = User.deserialize_token(f"{token}xyz")
         assert user is None
+
+    def test_delete_unsubscribed(self, users):
+        """Test users without a subscription are deleted in one go"""
+        disabled = User.find_by_identity("disabl@localhost")
+        disabled.payment_id = "cus_000"
+        disabled.save()
+
+        ids = [user.id for user in User.query.all()]
+
+        assert User.delete_unsubscribed(ids) == 1
+        assert User.subscribed_ids(ids) == [disabled.id]
+        assert User.find_by_identity("admin@localhost") is None
+
+    def test_seek_with_prefix(self, users):
+        """Test keyset pages keep the rows grouped by the prefix"""
+        prefix = (User.role, User.payment_id.is_(None))
+
+        first = User.seek(User.query, per_page=1, prefix=prefix)
+        second = User.seek(
+            User.query, cursor=first.next_cursor, per_page=1, prefix=prefix
+        )
+        back = User.seek(
+            User.query, cursor=second.prev_cursor, per_page=1, prefix=prefix
+        )
+
+        assert [user.role for user in first.items] == ["admin"]
+        assert [user.role for user in second.items] == ["member"]
+        assert second.has_next is False
+        assert back.items == first.items
+
+    def test_search(self, users):
+        """Test a search runs against the db by substring and similarity"""
+        found = User.query.filter(User.search("admin")).all()
+
+        assert "admin@localhost" in [user.email for user in found]
+
+    def test_search_email_prefix_is_literal(self, users):
+        """Test wildcards in an email search are not treated as such"""
+        assert User.query.filter(User.search("admin@local")).count() == 1
+        assert User.query.filter(User.search("_dmin@localhost")).count() == 0
+        assert User.query.filter(User.search("%@localhost")).count() == 0